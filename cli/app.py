@@ -1,24 +1,51 @@
-import requests
-import time
+import argparse
+import csv
+import heapq
+import json
 import os
+import random
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
 from rich.console import Console
 from rich.panel import Panel
 from rich.prompt import Prompt, IntPrompt
 from rich.table import Table
-from rich.status import Status
 
 console = Console()
 
 # Configuration
 # Ensure you have forwarded the port: kubectl port-forward svc/api-gateway 3000:3000
-GATEWAY_URL = "http://localhost:3000"
+GATEWAY_URL = os.getenv("GATEWAY_URL", "http://localhost:3000")
+REQUEST_TIMEOUT = 10      # seconds per HTTP request
+BALANCE_TTL = 5.0         # seconds a fetched balance is shown without asking the ledger again
+POLL_INITIAL = 0.25       # first status check this long after a transfer...
+POLL_MAX = 4.0            # ...then twice as long each time, up to this
+TRACK_TIMEOUT = 30.0      # seconds to wait for a verdict in the interactive menu
+BATCH_CONCURRENCY = 16    # transfers in flight at once in batch mode
+
+# One keep-alive connection pool for every request (the gateway is the only host we talk to)
+session = requests.Session()
+
+def size_pool(connections):
+    """Keeps up to `connections` connections open (one per request in flight)"""
+    for prefix in ("http://", "https://"):
+        session.mount(prefix, HTTPAdapter(pool_connections=1, pool_maxsize=connections))
+
+size_pool(BATCH_CONCURRENCY)
 
 # Session State
 current_token = None
 current_user_id = None
 current_username = None
 
+# Balance Cache: (balance, fetched at), dropped whenever a transfer may have changed it
+balance_cache = None
+
+FINAL_STATUSES = ("COMPLETED", "REJECTED")
+
 def clear_screen():
     os.system('cls' if os.name == 'nt' else 'clear')
 
@@ -26,56 +53,65 @@ def print_header():
     clear_screen()
     console.print(Panel.fit("[bold blue]🏦 SafeLedger Banking CLI[/bold blue]", subtitle="Secure. Distributed. Fast."))
 
+def auth_headers():
+    return {"Authorization": f"Bearer {current_token}"}
+
+def error_message(resp, default=None):
+    """The service's error message, robust to non-JSON responses (e.g., 502 Bad Gateway)"""
+    try:
+        return resp.json().get('message') or default or resp.text[:200]
+    except ValueError:
+        return default or f"Server Error ({resp.status_code}): {resp.text[:200]}"  # first 200 chars
+
+def authenticate(username, password):
+    """Logs in and stores the session token; returns None on success, else an error message"""
+    global current_token, current_user_id, current_username, balance_cache
+    resp = session.post(f"{GATEWAY_URL}/auth/login", json={"username": username, "password": password},
+                        timeout=REQUEST_TIMEOUT)
+    if resp.status_code != 200:
+        return error_message(resp, f"Invalid Credentials (Status: {resp.status_code})")
+    data = resp.json()
+    current_token = data['token']
+    # Note: Auth service needs to return 'id' in the login response for this to work
+    # If your auth service doesn't return ID, we default to 0 (which might cause issues with balance checks)
+    current_user_id = data.get('id', 0)
+    current_username = username
+    balance_cache = None
+    return None
+
 def register():
     print_header()
     console.print("[yellow]📝 Create New Account[/yellow]")
     username = Prompt.ask("Choose a username")
     password = Prompt.ask("Choose a password", password=True)
-    
+
     try:
-        resp = requests.post(f"{GATEWAY_URL}/auth/register", json={"username": username, "password": password})
+        resp = session.post(f"{GATEWAY_URL}/auth/register", json={"username": username, "password": password},
+                            timeout=REQUEST_TIMEOUT)
         if resp.status_code == 200:
             console.print(f"[green]✅ Account created for {username}! You can now login.[/green]")
         else:
-            # FIX: Robust error handling for non-JSON responses (e.g., 502 Bad Gateway)
-            try:
-                error_msg = resp.json().get('message')
-            except ValueError:
-                error_msg = f"Server Error ({resp.status_code}): {resp.text[:200]}" # Print first 200 chars
-            console.print(f"[red]❌ Error: {error_msg}[/red]")
+            console.print(f"[red]❌ Error: {error_message(resp)}[/red]")
     except Exception as e:
         console.print(f"[red]❌ Connection Error: {e}[/red]")
         console.print("[yellow]💡 Hint: Check if 'kubectl port-forward' is running and the Gateway pod is healthy.[/yellow]")
-    
+
     Prompt.ask("\nPress Enter to return...")
 
 def login():
-    global current_token, current_user_id, current_username
     print_header()
     console.print("[yellow]🔐 Login[/yellow]")
     username = Prompt.ask("Username")
     password = Prompt.ask("Password", password=True)
-    
+
     try:
-        resp = requests.post(f"{GATEWAY_URL}/auth/login", json={"username": username, "password": password})
-        if resp.status_code == 200:
-            data = resp.json()
-            current_token = data['token']
-            # Note: Auth service needs to return 'id' in the login response for this to work
-            # If your auth service doesn't return ID, we default to 0 (which might cause issues with balance checks)
-            current_user_id = data.get('id', 0) 
-            current_username = username
+        error = authenticate(username, password)
+        if error is None:
             console.print("[green]✅ Login Successful![/green]")
             time.sleep(1)
             main_menu()
         else:
-            try:
-                # Try to get specific error message if possible
-                error_text = resp.json().get('message', 'Invalid Credentials')
-            except ValueError:
-                error_text = f"Invalid Credentials (Status: {resp.status_code})"
-                
-            console.print(f"[red]❌ {error_text}[/red]")
+            console.print(f"[red]❌ {error}[/red]")
             time.sleep(2)
     except Exception as e:
         console.print(f"[red]❌ Connection Error to Gateway ({GATEWAY_URL}).[/red]")
@@ -83,97 +119,159 @@ def login():
         console.print("[yellow]💡 Hint: Ensure 'kubectl port-forward svc/api-gateway 3000:3000' is running.[/yellow]")
         Prompt.ask("Press Enter...")
 
-def get_balance():
-    headers = {"Authorization": f"Bearer {current_token}"}
+def get_balance(refresh=False):
+    """Balance from the ledger, reused for BALANCE_TTL seconds unless refresh is asked for"""
+    global balance_cache
+    if not refresh and balance_cache is not None and time.monotonic() - balance_cache[1] < BALANCE_TTL:
+        return balance_cache[0]
     try:
-        resp = requests.get(f"{GATEWAY_URL}/transaction/balance", headers=headers)
+        resp = session.get(f"{GATEWAY_URL}/transaction/balance", headers=auth_headers(), timeout=REQUEST_TIMEOUT)
         if resp.status_code == 200:
-            return resp.json()['balance']
+            balance = resp.json()['balance']
+            balance_cache = (balance, time.monotonic())
+            return balance
         else:
             return 0
-    except:
+    except Exception:
         return 0
 
+def invalidate_balance():
+    global balance_cache
+    balance_cache = None
+
+def submit_transfer(recipient, amount):
+    """Sends one transfer; returns (transactionId, None) or (None, error message)"""
+    try:
+        resp = session.post(f"{GATEWAY_URL}/transaction/transfer", json={"recipientId": recipient, "amount": amount},
+                            headers=auth_headers(), timeout=REQUEST_TIMEOUT)
+    except requests.RequestException as e:
+        return None, f"Connection error: {e}"
+    finally:
+        invalidate_balance()  # debited, or at least possibly so
+    if resp.status_code == 200:
+        return resp.json()['transactionId'], None
+    return None, error_message(resp, f"Status {resp.status_code}")
+
+def get_status(tx_id):
+    """Current status of a transaction, or None if it could not be read"""
+    try:
+        resp = session.get(f"{GATEWAY_URL}/transaction/status/{tx_id}", headers=auth_headers(), timeout=REQUEST_TIMEOUT)
+        if resp.status_code == 200:
+            return resp.json()['status']
+    except (requests.RequestException, ValueError, KeyError):
+        pass
+    return None
+
+class StatusTracker:
+    """Follows PENDING transactions until the fraud engine decides them.
+
+    Every transaction is checked with its own exponential backoff (POLL_INITIAL, doubling up to
+    POLL_MAX, with jitter so a batch doesn't poll in lockstep), so a fast verdict is seen within a
+    fraction of a second while a slow one costs a handful of requests rather than one per second.
+    The ledger only offers GET /status today; a streaming subscription would replace poll().
+    """
+
+    def __init__(self, concurrency=BATCH_CONCURRENCY, initial=POLL_INITIAL, maximum=POLL_MAX):
+        self.concurrency = concurrency
+        self.initial = initial
+        self.maximum = maximum
+        self.requests = 0
+
+    def poll(self, tx_id):
+        self.requests += 1
+        return get_status(tx_id)
+
+    def track(self, tx_ids, timeout, on_update=None):
+        """{tx_id: last known status} once every transaction is final or `timeout` seconds passed"""
+        statuses = {tx_id: "PENDING" for tx_id in tx_ids}
+        deadline = time.monotonic() + timeout
+        due = [(time.monotonic() + self.initial, tx_id, self.initial) for tx_id in tx_ids]
+        heapq.heapify(due)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            while due:
+                wait = due[0][0] - time.monotonic()
+                if due[0][0] > deadline:
+                    break
+                if wait > 0:
+                    time.sleep(wait)
+                # Everything due by now is checked concurrently
+                now = time.monotonic()
+                ready = []
+                while due and due[0][0] <= now and len(ready) < self.concurrency:
+                    ready.append(heapq.heappop(due))
+                for (_, tx_id, delay), status in zip(ready, pool.map(lambda item: self.poll(item[1]), ready)):
+                    if status is not None and status != statuses[tx_id]:
+                        statuses[tx_id] = status
+                        if on_update is not None:
+                            on_update(tx_id, status)
+                    if status not in FINAL_STATUSES:
+                        delay = min(delay * 2, self.maximum)
+                        heapq.heappush(due, (time.monotonic() + delay * random.uniform(0.8, 1.2), tx_id, delay))
+        return statuses
+
 def transfer_money():
     print_header()
     balance = get_balance()
     console.print(f"💰 Current Balance: [bold green]${balance}[/bold green]")
     console.print("[yellow]💸 Transfer Money[/yellow]")
-    
+
     recipient = IntPrompt.ask("Recipient ID (e.g., 1 for Admin)")
     amount = IntPrompt.ask("Amount to transfer")
-    
+
     if amount > balance:
         console.print("[red]❌ Insufficient Funds![/red]")
         time.sleep(2)
         return
 
-    headers = {"Authorization": f"Bearer {current_token}"}
-    payload = {"recipientId": recipient, "amount": amount}
-    
     # Show a spinner while the request is being sent
     with console.status("[bold green]Processing transaction request...[/bold green]"):
-        try:
-            resp = requests.post(f"{GATEWAY_URL}/transaction/transfer", json=payload, headers=headers)
-            if resp.status_code == 200:
-                data = resp.json()
-                tx_id = data['transactionId']
-                console.print(f"[green]✅ Request Sent! TxID: {tx_id}[/green]")
-                track_transaction(tx_id)
-            else:
-                try:
-                    err = resp.json().get('message', resp.text)
-                except:
-                    err = f"Status {resp.status_code}"
-                console.print(f"[red]❌ Error: {err}[/red]")
-        except Exception as e:
-            console.print(f"[red]Error: {e}[/red]")
+        tx_id, error = submit_transfer(recipient, amount)
+    if tx_id is not None:
+        console.print(f"[green]✅ Request Sent! TxID: {tx_id}[/green]")
+        track_transaction(tx_id)
+    else:
+        console.print(f"[red]❌ Error: {error}[/red]")
+        if error.startswith("Connection error"):
             console.print("[yellow]💡 Hint: Connection lost. Check Port Forwarding.[/yellow]")
-    
+
     Prompt.ask("\nPress Enter to continue...")
 
-def track_transaction(tx_id):
+def track_transaction(tx_id, timeout=TRACK_TIMEOUT):
     console.print("🕵️  Tracking status on Ledger...")
-    headers = {"Authorization": f"Bearer {current_token}"}
-    
-    # Poll for status update (waiting for RabbitMQ + Python Fraud Engine)
-    for _ in range(10): # Poll for 10 seconds max
-        try:
-            resp = requests.get(f"{GATEWAY_URL}/transaction/status/{tx_id}", headers=headers)
-            if resp.status_code == 200:
-                status = resp.json()['status']
-                if status == "COMPLETED":
-                    console.print(f"\n[bold green]✅ Transaction COMPLETED![/bold green]")
-                    return
-                elif status == "REJECTED":
-                    console.print(f"\n[bold red]⛔ Transaction REJECTED (Possible Fraud)[/bold red]")
-                    return
-                else:
-                    console.print(f"[blue]⏳ Status: {status}...[/blue]", end="\r")
-        except:
-            pass
-        time.sleep(1)
-    
-    console.print("\n[yellow]⚠️ Transaction is taking longer than usual.[/yellow]")
+
+    # Waiting for RabbitMQ + Python Fraud Engine, checking less and less often
+    def show(_, status):
+        if status not in FINAL_STATUSES:
+            console.print(f"[blue]⏳ Status: {status}...[/blue]", end="\r")
+
+    status = StatusTracker(concurrency=1).track([tx_id], timeout, on_update=show)[tx_id]
+    invalidate_balance()  # a rejection refunds the sender
+    if status == "COMPLETED":
+        console.print(f"\n[bold green]✅ Transaction COMPLETED![/bold green]")
+    elif status == "REJECTED":
+        console.print(f"\n[bold red]⛔ Transaction REJECTED (Possible Fraud)[/bold red]")
+    else:
+        console.print("\n[yellow]⚠️ Transaction is taking longer than usual.[/yellow]")
 
 def main_menu():
     while True:
         print_header()
         console.print(f"👤 User: [bold cyan]{current_username}[/bold cyan] (ID: {current_user_id})")
-        
-        # Fetch live balance
+
+        # Cached for a few seconds, so redrawing the menu doesn't hit the ledger every time
         balance = get_balance()
         console.print(Panel(f"[bold green]${balance}[/bold green]", title="Wallet Balance", expand=False))
-        
+
         console.print("\n[1] 💸 Transfer Money")
         console.print("[2] 🔄 Refresh Balance")
         console.print("[3] 🚪 Logout")
-        
+
         choice = IntPrompt.ask("Select Option", choices=["1", "2", "3"])
-        
+
         if choice == 1:
             transfer_money()
         elif choice == 2:
+            invalidate_balance()
             continue
         elif choice == 3:
             return
@@ -184,9 +282,9 @@ def start():
         console.print("[1] 🔐 Login")
         console.print("[2] 📝 Register")
         console.print("[3] ❌ Exit")
-        
+
         choice = IntPrompt.ask("Select Option", choices=["1", "2", "3"])
-        
+
         if choice == 1:
             login()
         elif choice == 2:
@@ -195,5 +293,143 @@ def start():
             console.print("Goodbye! 👋")
             sys.exit()
 
+# --- BATCH MODE ---
+# Bulk payouts without the menus:
+#   python app.py batch payouts.csv --username ops --password ...   (or SAFELEDGER_PASSWORD)
+# The file is CSV with recipientId,amount columns (header optional) or JSONL
+# ({"recipientId": 2, "amount": 50} per line). Transfers are submitted --concurrency at a time
+# over the shared session, then tracked together by one StatusTracker.
+
+def read_payouts(path):
+    """[(recipientId, amount), ...] from a CSV or JSONL file"""
+    payouts = []
+    with open(path, encoding='utf-8', newline='') as f:
+        if path.endswith(('.jsonl', '.ndjson')):
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    payouts.append((int(entry['recipientId']), float(entry['amount'])))
+            return payouts
+        for row in csv.reader(f):
+            if not row or row[0].strip().startswith('#'):
+                continue
+            try:
+                payouts.append((int(row[0]), float(row[1])))
+            except ValueError:
+                if payouts:
+                    raise ValueError(f"Bad payout line: {','.join(row)}")
+                # header line
+    return payouts
+
+def whole(amount):
+    return int(amount) if float(amount).is_integer() else amount
+
+def run_batch(payouts, concurrency=BATCH_CONCURRENCY, timeout=120.0):
+    """Submits every payout, then waits for their verdicts; returns one result dict per payout"""
+    results = [{"recipientId": recipient, "amount": whole(amount), "transactionId": None, "status": "FAILED",
+                "error": None} for recipient, amount in payouts]
+
+    def submit(result):
+        result["transactionId"], result["error"] = submit_transfer(result["recipientId"], result["amount"])
+        if result["transactionId"] is not None:
+            result["status"] = "PENDING"
+
+    start = time.monotonic()
+    with console.status(f"[bold green]Submitting {len(results)} transfers...[/bold green]"):
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(submit, results))
+    submit_seconds = time.monotonic() - start
+
+    pending = {r["transactionId"]: r for r in results if r["transactionId"] is not None}
+    tracker = StatusTracker(concurrency)
+    decided = [0]
+
+    def update(tx_id, status):
+        pending[tx_id]["status"] = status
+        if status in FINAL_STATUSES:
+            decided[0] += 1
+            status_line.update(f"[bold green]Waiting for verdicts: {decided[0]}/{len(pending)}[/bold green]")
+
+    with console.status(f"[bold green]Waiting for verdicts: 0/{len(pending)}[/bold green]") as status_line:
+        tracker.track(list(pending), timeout, on_update=update)
+    invalidate_balance()
+    summary = {"submitted": len(pending), "submit_seconds": submit_seconds,
+               "seconds": time.monotonic() - start, "status_requests": tracker.requests}
+    return results, summary
+
+def print_batch_report(results, summary):
+    table = Table(title="Batch Transfers")
+    for column in ("TxID", "Recipient", "Amount", "Status", "Error"):
+        table.add_column(column)
+    colors = {"COMPLETED": "green", "REJECTED": "red", "PENDING": "yellow", "FAILED": "red"}
+    for r in results:
+        color = colors[r["status"]]
+        table.add_row(str(r["transactionId"] or "-"), str(r["recipientId"]), f"${r['amount']}",
+                      f"[{color}]{r['status']}[/{color}]", r["error"] or "")
+    console.print(table)
+    counts = {status: sum(r["status"] == status for r in results) for status in colors}
+    console.print(f"✅ {counts['COMPLETED']} completed, ⛔ {counts['REJECTED']} rejected, "
+                  f"⏳ {counts['PENDING']} still pending, ❌ {counts['FAILED']} not submitted "
+                  f"in {summary['seconds']:.1f}s ({summary['status_requests']} status checks)")
+
+def write_results(path, results):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        if path.endswith(('.jsonl', '.ndjson')):
+            f.write(''.join(json.dumps(r) + '\n' for r in results))
+            return
+        writer = csv.DictWriter(f, fieldnames=["transactionId", "recipientId", "amount", "status", "error"])
+        writer.writeheader()
+        writer.writerows(results)
+
+def batch_main(args):
+    try:
+        payouts = read_payouts(args.file)
+    except (OSError, ValueError, KeyError) as e:
+        console.print(f"[red]❌ Cannot read {args.file}: {e}[/red]")
+        return 2
+    password = args.password or os.getenv("SAFELEDGER_PASSWORD") or Prompt.ask("Password", password=True)
+    try:
+        error = authenticate(args.username, password)
+    except requests.RequestException as e:
+        console.print(f"[red]❌ Connection Error to Gateway ({GATEWAY_URL}): {e}[/red]")
+        return 1
+    if error is not None:
+        console.print(f"[red]❌ {error}[/red]")
+        return 1
+
+    total = sum(amount for _, amount in payouts)
+    balance = get_balance(refresh=True)
+    console.print(f"👤 {current_username}: {len(payouts)} transfers totalling ${whole(total)}, balance ${balance}")
+    if total > balance:
+        console.print("[yellow]⚠️ The batch exceeds the balance: the last transfers will be refused.[/yellow]")
+
+    size_pool(args.concurrency)
+    results, summary = run_batch(payouts, args.concurrency, args.timeout)
+    if args.output:
+        write_results(args.output, results)
+    if args.json:
+        print(json.dumps({"results": results, **summary}, indent=2))
+    else:
+        print_batch_report(results, summary)
+    return 0 if all(r["status"] in FINAL_STATUSES for r in results) else 1
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="SafeLedger banking CLI (interactive without arguments)")
+    parser.add_argument('--gateway', default=GATEWAY_URL, help="API gateway URL (or GATEWAY_URL)")
+    commands = parser.add_subparsers(dest='command')
+    batch = commands.add_parser('batch', help="submit and track many transfers from a file")
+    batch.add_argument('file', help="CSV (recipientId,amount) or JSONL payouts")
+    batch.add_argument('--username', required=True)
+    batch.add_argument('--password', help="default: SAFELEDGER_PASSWORD, else prompted")
+    batch.add_argument('--concurrency', type=int, default=BATCH_CONCURRENCY, help="transfers and status checks in flight")
+    batch.add_argument('--timeout', type=float, default=120.0, help="seconds to wait for the verdicts")
+    batch.add_argument('--output', help="write every result to this .csv or .jsonl file")
+    batch.add_argument('--json', action='store_true', help="print the results as JSON")
+    return parser
+
 if __name__ == "__main__":
-    start()
\ No newline at end of file
+    args = build_parser().parse_args()
+    GATEWAY_URL = args.gateway
+    if args.command == 'batch':
+        sys.exit(batch_main(args))
+    start()
@@ -0,0 +1,85 @@
+import unittest
+import os
+import tempfile
+import time
+from unittest import mock
+import app
+from app import StatusTracker, read_payouts, run_batch
+
+class TestReadPayouts(unittest.TestCase):
+    def write(self, name, text):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        return path
+
+    def test_csv_skips_header_comments_and_blank_lines(self):
+        path = self.write('payouts.csv', "recipientId,amount\n# March payroll\n2,50\n\n 3 , 12.5\n  # done\n")
+        self.assertEqual(read_payouts(path), [(2, 50.0), (3, 12.5)])
+        self.assertEqual(read_payouts(self.write('bare.csv', "2,50\n")), [(2, 50.0)])
+
+    def test_csv_bad_line_after_the_first_payout(self):
+        with self.assertRaises(ValueError):
+            read_payouts(self.write('payouts.csv', "2,50\nthree,10\n"))
+
+    def test_jsonl(self):
+        path = self.write('payouts.jsonl', '{"recipientId": 2, "amount": 50}\n\n{"recipientId": "3", "amount": "12.5"}\n')
+        self.assertEqual(read_payouts(path), [(2, 50.0), (3, 12.5)])
+        with self.assertRaises(KeyError):
+            read_payouts(self.write('bad.ndjson', '{"recipient": 2, "amount": 50}\n'))
+
+class ScriptedTracker(StatusTracker):
+    """poll() answers from a script per transaction; the last answer repeats"""
+    def __init__(self, script, **kwargs):
+        super().__init__(**kwargs)
+        self.script = {tx_id: list(answers) for tx_id, answers in script.items()}
+        self.polls = {tx_id: 0 for tx_id in script}
+
+    def poll(self, tx_id):
+        self.requests += 1
+        self.polls[tx_id] += 1
+        answers = self.script[tx_id]
+        return answers.pop(0) if len(answers) > 1 else answers[0]
+
+class TestStatusTracker(unittest.TestCase):
+    def test_stops_polling_final_statuses(self):
+        tracker = ScriptedTracker({'1': ["PENDING", "COMPLETED"], '2': ["REJECTED"], '3': [None, "PENDING", "COMPLETED"]},
+                                  initial=0.001, maximum=0.004)
+        updates = []
+        statuses = tracker.track(['1', '2', '3'], timeout=5.0, on_update=lambda tx_id, status: updates.append((tx_id, status)))
+        self.assertEqual(statuses, {'1': "COMPLETED", '2': "REJECTED", '3': "COMPLETED"})
+        self.assertEqual(tracker.polls, {'1': 2, '2': 1, '3': 3})
+        # Only changes are reported (None, an unreadable status, is not one)
+        self.assertEqual(sorted(updates), [('1', "COMPLETED"), ('2', "REJECTED"), ('3', "COMPLETED")])
+
+    def test_gives_up_at_the_deadline(self):
+        tracker = ScriptedTracker({'1': ["PENDING"], '2': ["COMPLETED"]}, initial=0.01, maximum=0.02)
+        start = time.monotonic()
+        statuses = tracker.track(['1', '2'], timeout=0.2)
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(statuses, {'1': "PENDING", '2': "COMPLETED"})
+        self.assertGreater(tracker.polls['1'], 3)  # backed off, but kept checking until the deadline
+        self.assertLess(tracker.polls['1'], 25)
+
+class TestRunBatch(unittest.TestCase):
+    def test_submits_then_tracks(self):
+        verdicts = {'1000': "COMPLETED", '1001': "REJECTED"}
+        submitted = iter(['1000', '1001'])
+
+        def submit_transfer(recipient, amount):
+            if recipient == 9:
+                return None, "Insufficient funds"
+            return next(submitted), None
+
+        with mock.patch.object(app, 'submit_transfer', side_effect=submit_transfer), \
+                mock.patch.object(app, 'get_status', side_effect=verdicts.get):
+            results, summary = run_batch([(2, 50.0), (9, 10.0), (3, 12.5)], concurrency=1, timeout=5.0)
+        self.assertEqual([(r["recipientId"], r["amount"], r["transactionId"], r["status"], r["error"]) for r in results],
+                         [(2, 50, '1000', "COMPLETED", None), (9, 10, None, "FAILED", "Insufficient funds"),
+                          (3, 12.5, '1001', "REJECTED", None)])
+        self.assertEqual((summary["submitted"], summary["status_requests"]), (2, 2))
+
+if __name__ == '__main__':
+    unittest.main()
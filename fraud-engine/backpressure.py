@@ -0,0 +1,138 @@
+import json
+import time
+import numpy as np
+from logs import log
+
+# --- BACKPRESSURE ---
+# CONSUMER_MODE=adaptive consumes in micro-batches like batch mode, but sizes them from how far
+# behind the engine is: the queue depth (polled from RabbitMQ) and the age of the events it
+# decodes (now - their 'timestamp', i.e. how long the sender's PENDING transfer has waited).
+#
+#   NORMAL     batches of BATCH_SIZE, one model call at a time
+#   BACKLOG    depth > BACKLOG_DEPTH or p99 age > VERDICT_SLO / 2: batch size and scoring
+#              parallelism double after every batch (up to MAX_BATCH_SIZE / SCORING_PARALLELISM)
+#   SHEDDING   p99 age > SHED_AT * VERDICT_SLO: on top of that, low-risk events (amount below
+#              FAST_PATH_MAX_AMOUNT) take the fast path: no model call, and only the rules whose
+#              cost is at most FAST_PATH_MAX_COST. Lasts until the age is back under VERDICT_SLO / 2.
+#
+# Fast-path verdicts still update the profiles and are delivered to the ledger like any other, but
+# each one is also appended to the DEGRADED_LOG (JSONL) so it can be re-scored with every rule
+# later (python backtest.py ledger_db.json --rescore degraded_decisions.jsonl).
+
+NORMAL, BACKLOG, SHEDDING = 0, 1, 2
+LEVELS = ('normal', 'backlog', 'shedding')
+SHED_AT = 0.8             # fraction of the SLO at which low-risk events start taking the fast path
+DEPTH_POLL_INTERVAL = 1.0  # seconds between queue depth polls
+
+
+class Backpressure:
+    """Batch size, scoring parallelism and fast path for the next batch, from queue depth and event age"""
+
+    def __init__(self, batch_size=100, max_batch_size=1000, max_parallelism=8, backlog_depth=1000, slo=2.0,
+                 fast_path_amount=1000.0, resize_prefetch=True):
+        self.base_batch_size = batch_size
+        self.max_batch_size = max(batch_size, max_batch_size)
+        self.max_parallelism = max(1, max_parallelism)
+        self.backlog_depth = backlog_depth
+        self.slo = slo
+        self.fast_path_amount = fast_path_amount
+        self.level = NORMAL
+        self.batch_size = batch_size
+        self.parallelism = 1
+        self.depth = 0
+        self.age = 0.0            # p99 age of the last batch's events, in seconds
+        self.resize_prefetch = resize_prefetch  # False when PREFETCH_COUNT pins the window
+        self.prefetch = None      # channel-wide prefetch count last set
+        self.last_poll = float('-inf')
+
+    def observe(self, timestamps, now=None):
+        """Takes the event ages of a decoded batch into account and picks the level for the next one"""
+        timestamps = np.asarray(timestamps, dtype=float)
+        if len(timestamps):
+            now = time.time() if now is None else now
+            self.age = max(0.0, float(np.percentile(now - timestamps, 99)))
+        self._update()
+
+    def observe_depth(self, depth):
+        self.depth = depth
+
+    def _update(self):
+        if self.level == SHEDDING:
+            shedding = self.age > self.slo / 2   # hysteresis: don't flap around the threshold
+        else:
+            shedding = self.age > self.slo * SHED_AT
+        backlog = self.depth > self.backlog_depth or self.age > self.slo / 2
+        level = SHEDDING if shedding else BACKLOG if backlog else NORMAL
+        if level != self.level:
+            log.warning(f" ⚠️ Backpressure {LEVELS[self.level]} -> {LEVELS[level]} "
+                        f"(queue depth {self.depth}, p99 event age {self.age:.2f}s)")
+            self.level = level
+        if level == NORMAL:
+            self.batch_size = max(self.base_batch_size, self.batch_size // 2)
+            self.parallelism = max(1, self.parallelism // 2)
+        else:
+            self.batch_size = min(self.max_batch_size, self.batch_size * 2)
+            self.parallelism = min(self.max_parallelism, self.parallelism * 2)
+
+    def fast_path(self, amounts):
+        """Boolean mask of the events that take the fast path (none unless shedding)"""
+        amounts = np.asarray(amounts, dtype=float)
+        if self.level != SHEDDING:
+            return np.zeros(len(amounts), dtype=bool)
+        return amounts < self.fast_path_amount
+
+    def adjust(self, channel, queue, now=None):
+        """Between batches: polls the queue depth now and then, and keeps the prefetch window ahead of the batch size"""
+        now = time.monotonic() if now is None else now
+        if now - self.last_poll >= DEPTH_POLL_INTERVAL:
+            self.last_poll = now
+            try:
+                self.observe_depth(channel.queue_declare(queue=queue, passive=True).method.message_count)
+            except Exception as e:
+                log.warning(f" ⚠️ Cannot read the depth of {queue}: {e}")
+        prefetch = self.batch_size * 2
+        if self.resize_prefetch and prefetch != self.prefetch:
+            # A consumer's own prefetch is fixed when it starts (at MAX_BATCH_SIZE * 2, see run_consumer):
+            # only a channel-wide limit also applies to the running consumer. RabbitMQ enforces both.
+            channel.basic_qos(prefetch_count=prefetch, global_qos=True)
+            self.prefetch = prefetch
+
+
+def _plain(value):
+    return value.item() if isinstance(value, np.generic) else str(value)
+
+
+class DegradedLog:
+    """Append-only JSONL record of the verdicts decided on the fast path, flushed on every batch"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'a', encoding='utf-8')
+        self.decisions = 0
+
+    def append(self, transaction_ids, user_ids, amounts, timestamps, verdicts, skipped, age):
+        decided = time.time()
+        lines = [json.dumps({"transactionId": tx_id, "senderId": user_id, "amount": float(amount),
+                             "timestamp": float(timestamp), "status": status, "reason": reason,
+                             "skippedRules": skipped, "age": round(age, 3), "decidedAt": decided},
+                            default=_plain) + '\n'
+                 for tx_id, user_id, amount, timestamp, (status, reason)
+                 in zip(transaction_ids, user_ids, amounts, timestamps, verdicts)]
+        self.file.write(''.join(lines))
+        self.file.flush()
+        self.decisions += len(lines)
+
+    def close(self):
+        self.file.close()
+
+
+def read_degraded(path):
+    """{transactionId: fast-path status} of every decision in a degraded log (a torn last line is ignored)"""
+    statuses = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.endswith('\n'):
+                break
+            entry = json.loads(line)
+            statuses[str(entry['transactionId'])] = entry['status']
+    return statuses
@@ -0,0 +1,412 @@
+import argparse
+import json
+import re
+import resource
+import sys
+import time
+from collections import Counter
+from itertools import islice
+import main
+from main import RiskEngine, rule_specs
+from profiles import ProfileStore
+from backpressure import read_degraded
+from wire import parse_timestamp, sender_key, transaction_key
+
+# --- OFFLINE BACKTEST ---
+# Streams historical transactions through RiskEngine as fast as it can score them:
+#   python backtest.py ledger_db.json                  a ledger-service dump
+#   python backtest.py events.jsonl more.jsonl         one transaction event per line ('-' = stdin)
+#   python backtest.py dump.json --rules rules.json --decisions out.jsonl --json
+#   python backtest.py dump.json --rescore degraded_decisions.jsonl
+#
+# There is no RabbitMQ, no Ledger callback and no simulated scoring delay. The clock is the
+# events' own 'timestamp' (events without one are spaced 1/--rate seconds apart), so velocity
+# windows and TTL eviction behave exactly as they did live. Files are read incrementally and
+# scored in --batch-size chunks, so memory stays bounded by the batch and the profile store.
+#
+# --rescore takes the fast-path verdicts an adaptive-mode engine recorded under load (see
+# backpressure.py): the history is replayed with every rule, and the report counts the fast-path
+# decisions the full rule set overturns (their decisions lines carry "degradedStatus").
+
+READ_CHUNK = 1 << 20
+
+
+class _JsonStream:
+    """Incremental reader for one large JSON document, decoding one value at a time"""
+
+    SPECIAL = re.compile(r'[{}\[\]"]')
+    STRING_END = re.compile(r'(?:[^"\\]|\\.)*"', re.S)
+
+    def __init__(self, f, chunk_size=READ_CHUNK):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self, at_least=0):
+        """Drops consumed text and reads more (doubling the read size for values bigger than a chunk)"""
+        if self.eof:
+            return False
+        self.buf = self.buf[self.pos:]
+        self.pos = 0
+        data = self.f.read(max(self.chunk_size, at_least))
+        if not data:
+            self.eof = True
+            return False
+        self.buf += data
+        return True
+
+    def peek(self):
+        """Next non-whitespace character (consumed whitespace only)"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at offset ~{self.pos}, found {self.peek()!r}")
+        self.pos += 1
+
+    def decode(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # A number at the very end of the buffer may continue in the next chunk
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill(at_least=len(self.buf))
+
+    def skip(self):
+        """Skips one value; objects and arrays are scanned without being decoded"""
+        if self.peek() not in '{[':
+            self.decode()
+            return
+        depth = 0
+        while True:
+            match = self.SPECIAL.search(self.buf, self.pos)
+            if match is None:
+                self.pos = len(self.buf)
+                if not self._fill():
+                    raise ValueError("Unexpected end of JSON document")
+                continue
+            char = match.group()
+            self.pos = match.end()
+            if char == '"':
+                while True:
+                    end = self.STRING_END.match(self.buf, self.pos)
+                    if end is not None:
+                        self.pos = end.end()
+                        break
+                    if not self._fill(at_least=len(self.buf)):
+                        raise ValueError("Unexpected end of JSON document")
+            elif char in '{[':
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return
+
+    def members(self):
+        """Keys of the object at the cursor; after each key the caller must decode() or skip() its value"""
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.decode()
+            self.expect(':')
+            yield key
+            char = self.peek()
+            self.pos += 1
+            if char == '}':
+                return
+            if char != ',':
+                raise ValueError(f"Expected ',' or '}}' at offset ~{self.pos}, found {char!r}")
+
+
+    def member_batches(self):
+        """Decodes the object at the cursor as a series of dicts, each holding the members of about one chunk.
+
+        Each chunk is cut after its last '}' and parsed in one go: a cut inside a string or a nested
+        value leaves invalid JSON and an earlier '}' is tried, then the next member is decoded alone.
+        Where the object itself ends within the chunk, the parse stops at its closing brace.
+        """
+        self.expect('{')
+        while True:
+            if self.peek() == '}':
+                self.pos += 1
+                return
+            if len(self.buf) - self.pos < self.chunk_size // 2:
+                self._fill()
+            batch = None
+            cut = self.buf.rfind('}', self.pos)
+            for _ in range(2):
+                if cut <= self.pos:
+                    break
+                try:
+                    batch, end = self.decoder.raw_decode('{' + self.buf[self.pos:cut + 1] + '}')
+                    # end - 1 is the closing brace: ours after `cut`, or the object's own one
+                    self.pos += end - 2
+                    break
+                except ValueError:
+                    cut = self.buf.rfind('}', self.pos, cut)
+            if batch is None:
+                key = self.decode()
+                self.expect(':')
+                batch = {key: self.decode()}
+            yield batch
+            char = self.peek()
+            self.pos += 1
+            if char == '}':
+                return
+            if char != ',':
+                raise ValueError(f"Expected ',' or '}}' at offset ~{self.pos}, found {char!r}")
+
+    def elements(self):
+        """Walks the array at the cursor; after each step the caller must decode() or skip() the element"""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield
+            char = self.peek()
+            self.pos += 1
+            if char == ']':
+                return
+            if char != ',':
+                raise ValueError(f"Expected ',' or ']' at offset ~{self.pos}, found {char!r}")
+
+
+def iter_ledger(f, sections=('transactions',), chunk_size=READ_CHUNK):
+    """Yields (section, record) for the 'accounts' and/or 'transactions' of a ledger_db.json dump, in file order"""
+    stream = _JsonStream(f, chunk_size)
+    for key in stream.members():
+        if key == 'accounts' and key in sections:
+            for _ in stream.elements():
+                yield key, stream.decode()
+        elif key == 'transactions' and key in sections:
+            for batch in stream.member_batches():
+                for transaction in batch.values():
+                    yield key, transaction
+        else:
+            stream.skip()
+
+
+def iter_ledger_transactions(f, chunk_size=READ_CHUNK):
+    """Yields the transactions of a ledger_db.json dump one by one, without loading the whole file"""
+    for _, transaction in iter_ledger(f, chunk_size=chunk_size):
+        yield transaction
+
+
+def iter_jsonl(f):
+    for line in f:
+        line = line.strip()
+        if line:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield None  # counted as malformed
+
+
+def read_events(paths, chunk_size=READ_CHUNK):
+    """Transaction dicts from every input in turn (None for an unreadable record)"""
+    for path in paths:
+        if path == '-':
+            yield from iter_jsonl(sys.stdin)
+            continue
+        with open(path, encoding='utf-8') as f:
+            if path.endswith(('.jsonl', '.ndjson')):
+                yield from iter_jsonl(f)
+            else:
+                yield from iter_ledger_transactions(f, chunk_size)
+
+
+def simulated_clock(events, rate=1.0, start=0.0):
+    """Yields (event, event_time): the event's own timestamp, or one 1/rate seconds after the previous event"""
+    clock = start
+    for event in events:
+        try:
+            if event.get('timestamp') is not None:
+                clock = parse_timestamp(event['timestamp'])
+            else:
+                clock += 1.0 / rate
+        except (AttributeError, TypeError, ValueError):
+            yield None, clock  # malformed event or timestamp
+            continue
+        yield event, clock
+
+
+def batches(timed_events, size):
+    """Column chunks (events, tx_ids, user_ids, amounts, timestamps) of at most `size` events, plus malformed counts.
+
+    Ids are normalised like the consumers' (see wire.py), so "7" and 7 are the same sender.
+    """
+    iterator = iter(timed_events)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        events, tx_ids, user_ids, amounts, timestamps = [], [], [], [], []
+        malformed = 0
+        for event, clock in chunk:
+            try:
+                amount = float(event['amount'])
+                user_id = sender_key(event['senderId'])
+            except (KeyError, TypeError, ValueError):
+                malformed += 1
+                continue
+            events.append(event)
+            tx_ids.append(transaction_key(event.get('transactionId')))
+            user_ids.append(user_id)
+            amounts.append(amount)
+            timestamps.append(clock)
+        yield events, tx_ids, user_ids, amounts, timestamps, malformed
+
+
+class Backtest:
+    """Scores an event stream and accumulates decision counts"""
+
+    def __init__(self, engine, batch_size=1000, mode='batch', decisions=None, rescore=None):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.mode = mode
+        self.decisions = decisions  # optional text file receiving one JSON decision per line
+        self.events = 0
+        self.malformed = 0
+        self.statuses = Counter()
+        self.reasons = Counter()
+        self.changed = 0          # events whose recorded (non-PENDING) status differs from the new decision
+        self.rescore = rescore or {}  # {transactionId: status decided on the fast path}
+        self.rescored = 0
+        self.overturned = 0       # fast-path decisions the full rule set disagrees with
+        self.elapsed = 0.0
+
+    def score(self, user_ids, amounts, timestamps):
+        if self.mode == 'single':
+            return [self.engine.analyze(u, a, t) for u, a, t in zip(user_ids, amounts, timestamps)]
+        return self.engine.analyze_batch(user_ids, amounts, timestamps)
+
+    def run(self, events, rate=1.0):
+        start = time.perf_counter()
+        timed_events = simulated_clock(events, rate)
+        for chunk, tx_ids, user_ids, amounts, timestamps, malformed in batches(timed_events, self.batch_size):
+            self.malformed += malformed
+            if not chunk:
+                continue
+            verdicts = self.score(user_ids, amounts, timestamps)
+            self.events += len(chunk)
+            lines = []
+            for event, tx_id, (status, reason) in zip(chunk, tx_ids, verdicts):
+                self.statuses[status] += 1
+                self.reasons[reason] += 1
+                recorded = event.get('status')
+                if recorded not in (None, 'PENDING') and recorded != status:
+                    self.changed += 1
+                decision = {"transactionId": tx_id, "status": status,
+                            "reason": reason, "recordedStatus": recorded}
+                degraded = self.rescore.get(tx_id) if self.rescore else None
+                if degraded is not None:
+                    self.rescored += 1
+                    self.overturned += degraded != status
+                    decision["degradedStatus"] = degraded
+                if self.decisions is not None:
+                    lines.append(json.dumps(decision) + '\n')
+            if lines:
+                self.decisions.write(''.join(lines))
+        self.elapsed += time.perf_counter() - start
+        return self.report()
+
+    def report(self):
+        rules = {}
+        for name, stats in self.engine.rule_stats().items():
+            rules[name] = dict(stats, hit_rate=stats['hits'] / stats['calls'] if stats['calls'] else 0.0)
+        return {
+            "events": self.events,
+            "malformed": self.malformed,
+            "elapsed_seconds": self.elapsed,
+            "events_per_second": self.events / self.elapsed if self.elapsed > 0 else 0.0,
+            "decisions": dict(self.statuses),
+            "reasons": dict(self.reasons),
+            "rejection_rate": self.statuses['REJECTED'] / self.events if self.events else 0.0,
+            "changed_vs_recorded": self.changed,
+            "rescored": self.rescored,
+            "overturned": self.overturned,
+            "rules": rules,
+            "profiles": self.engine.store.memory_usage(),
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        }
+
+
+def print_report(report):
+    print(f" ✅ Backtested {report['events']} events in {report['elapsed_seconds']:.2f}s "
+          f"({report['events_per_second']:,.0f} events/sec), {report['malformed']} malformed")
+    print(f" [*] Decisions: {report['decisions']}  (rejection rate {report['rejection_rate']:.2%})")
+    for reason, count in sorted(report['reasons'].items(), key=lambda item: -item[1]):
+        print(f"     {count:>10}  {reason}")
+    print(" [*] Rules (evaluation order):")
+    for name, stats in report['rules'].items():
+        print(f"     {name:<14} calls {stats['calls']:>10}  hits {stats['hits']:>8} ({stats['hit_rate']:.2%})"
+              f"  {stats['seconds']:.3f}s")
+    print(f" [*] Changed vs recorded status: {report['changed_vs_recorded']}")
+    if report['rescored']:
+        print(f" [*] Fast-path decisions re-scored: {report['rescored']}, overturned: {report['overturned']}")
+    print(f" [*] Profiles: {report['profiles']['users']} users, {report['profiles']['total_bytes'] / 2**20:.1f} MB;"
+          f" peak RSS {report['peak_rss_mb']:.0f} MB")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Replay historical transactions through the fraud engine offline")
+    parser.add_argument('inputs', nargs='+', help="ledger_db.json dumps or .jsonl event files ('-' = JSONL on stdin)")
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--mode', choices=['batch', 'single'], default='batch',
+                        help="score with analyze_batch (default) or one analyze call per event")
+    parser.add_argument('--rules', help="rule specs as JSON, or @file.json (default: RULES / built-in rules)")
+    parser.add_argument('--rate', type=float, default=1.0, help="events/sec of the simulated clock for events without a timestamp")
+    parser.add_argument('--max-profiles', type=int, default=main.MAX_PROFILES, help="LRU-bound the profile store")
+    parser.add_argument('--profile-ttl', type=float, default=main.PROFILE_TTL, help="evict users idle this long (event time)")
+    parser.add_argument('--limit', type=int, help="stop after this many events")
+    parser.add_argument('--decisions', help="write every decision as JSONL to this file")
+    parser.add_argument('--rescore', help="degraded decisions log (adaptive mode) to re-score with every rule")
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    return parser
+
+
+def load_rules(value):
+    if value is None:
+        return rule_specs()
+    if value.startswith('@'):
+        with open(value[1:], encoding='utf-8') as f:
+            return json.load(f)
+    return json.loads(value)
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    engine = RiskEngine(store=ProfileStore(capacity=main.PROFILE_CAPACITY, max_users=args.max_profiles,
+                                           ttl=args.profile_ttl), rules=load_rules(args.rules))
+    events = read_events(args.inputs)
+    if args.limit:
+        events = islice(events, args.limit)
+    decisions = open(args.decisions, 'w', encoding='utf-8') if args.decisions else None
+    try:
+        rescore = read_degraded(args.rescore) if args.rescore else None
+        report = Backtest(engine, args.batch_size, args.mode, decisions, rescore).run(events, args.rate)
+    finally:
+        if decisions is not None:
+            decisions.close()
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
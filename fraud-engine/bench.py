@@ -0,0 +1,317 @@
+import argparse
+import contextlib
+import json
+import logging
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from types import SimpleNamespace
+from unittest import mock
+import numpy as np
+import main
+from main import RiskEngine
+from profiles import ProfileStore
+from callbacks import LedgerClient, Outbox
+from wire import EVENT_CONTENT_TYPE, encode_events, decode_batch, decode_event
+from logs import log
+
+# --- BENCHMARKS ---
+# Reproducible micro/macro benchmarks of the engine's hot path, printed as JSON:
+#   python bench.py                               every benchmark, each in a fresh process
+#   python bench.py --only analyze e2e_batch      a subset
+#   python bench.py --users 1e3,1e7               get_profile at other store sizes (1e7 needs ~12 GB)
+#   python bench.py --check bench_baseline.json   exit 1 if anything regressed past the baseline
+#   python bench.py --update-baseline bench_baseline.json
+#
+# Every benchmark reports p50/p99 latency of one operation (a call, or a batch for batch
+# benchmarks), events/sec and the peak RSS of its process. Baselines are machine-specific:
+# refresh them on the machine that runs the check (CI checks against bench_baseline_ci.json,
+# recorded on its agents, see the Jenkinsfile).
+
+USER_SCALES = [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6]
+SEED = 42
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+def summarize(latencies_ns, events_per_op=1, **extra):
+    latencies = np.asarray(latencies_ns, dtype=float) / 1000.0
+    total_seconds = latencies.sum() / 1e6
+    return dict({
+        "ops": len(latencies),
+        "p50_us": float(np.percentile(latencies, 50)),
+        "p99_us": float(np.percentile(latencies, 99)),
+        "events_per_second": len(latencies) * events_per_op / total_seconds if total_seconds else 0.0,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }, **extra)
+
+
+def synthetic_events(n, users, seed=SEED):
+    """Event columns shaped like the ledger's: lognormal amounts, a few structuring ones, ~50 tx/s overall"""
+    rng = np.random.default_rng(seed)
+    user_ids = rng.integers(0, users, n)
+    amounts = np.round(rng.lognormal(3, 1, n), 2)
+    amounts[rng.random(n) < 0.01] = 9800.0
+    timestamps = 1.7e9 + np.cumsum(rng.exponential(0.02, n))
+    return user_ids.tolist(), amounts.tolist(), timestamps.tolist()
+
+
+def event_bodies(n, users, seed=SEED):
+    """Raw queue messages as the ledger publishes them (ISO timestamps with a trailing Z)"""
+    user_ids, amounts, timestamps = synthetic_events(n, users, seed)
+    bodies = []
+    for i, (user_id, amount, timestamp) in enumerate(zip(user_ids, amounts, timestamps)):
+        iso = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(timestamp)) + f'.{int(timestamp % 1 * 1000):03d}Z'
+        bodies.append(json.dumps({"transactionId": str(1000 + i), "senderId": user_id, "recipientId": 1,
+                                  "amount": amount, "timestamp": iso, "status": "PENDING"}).encode())
+    return bodies
+
+
+@contextlib.contextmanager
+def quiet():
+    """Benchmarks measure the scoring, not the terminal: no prints, no log lines below ERROR"""
+    level = log.level
+    log.setLevel(logging.ERROR)
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            yield
+    finally:
+        log.setLevel(level)
+
+
+@benchmark('analyze')
+def bench_analyze(quick=False):
+    n = 5000 if quick else 100000
+    user_ids, amounts, timestamps = synthetic_events(n, 10000)
+    engine = RiskEngine(store=ProfileStore())
+    latencies = []
+    with quiet():
+        for u, a, t in zip(user_ids, amounts, timestamps):
+            start = time.perf_counter_ns()
+            engine.analyze(u, a, t)
+            latencies.append(time.perf_counter_ns() - start)
+    return summarize(latencies)
+
+
+@benchmark('analyze_batch')
+def bench_analyze_batch(quick=False, batch_size=1000):
+    n = 20000 if quick else 1000000
+    user_ids, amounts, timestamps = synthetic_events(n, 10000)
+    amounts, timestamps = np.asarray(amounts), np.asarray(timestamps)
+    engine = RiskEngine(store=ProfileStore())
+    latencies = []
+    for lo in range(0, n, batch_size):
+        start = time.perf_counter_ns()
+        engine.analyze_batch(user_ids[lo:lo + batch_size], amounts[lo:lo + batch_size], timestamps[lo:lo + batch_size])
+        latencies.append(time.perf_counter_ns() - start)
+    return summarize(latencies, batch_size, batch_size=batch_size)
+
+
+def bench_get_profile(users, quick=False):
+    store = ProfileStore(capacity=users)
+    for lo in range(0, users, 100000):
+        store.rows_for(range(lo, min(lo + 100000, users)))
+    lookups = np.random.default_rng(SEED).integers(0, users, 2000 if quick else 200000).tolist()
+    latencies = []
+    for user_id in lookups:
+        start = time.perf_counter_ns()
+        store.get_profile(user_id)
+        latencies.append(time.perf_counter_ns() - start)
+    return summarize(latencies, users=users, store_mb=store.memory_usage()['total_bytes'] / 2 ** 20)
+
+
+def register_get_profile(scales):
+    for users in scales:
+        BENCHMARKS[f'get_profile_{users:.0e}'.replace('+0', '')] = \
+            (lambda users: lambda quick=False: bench_get_profile(users, quick))(users)
+
+
+@benchmark('json_decode')
+def bench_json_decode(quick=False):
+    bodies = event_bodies(5000 if quick else 200000, 10000)
+    latencies = []
+    for body in bodies:
+        start = time.perf_counter_ns()
+        decode_event(body)
+        latencies.append(time.perf_counter_ns() - start)
+    return summarize(latencies)
+
+
+def bench_decode_batch(messages, batch_size):
+    latencies = []
+    for lo in range(0, len(messages), batch_size):
+        start = time.perf_counter_ns()
+        decode_batch(messages[lo:lo + batch_size])
+        latencies.append(time.perf_counter_ns() - start)
+    return latencies
+
+
+@benchmark('batch_decode_json')
+def bench_batch_decode_json(quick=False, batch_size=100):
+    bodies = event_bodies(5000 if quick else 200000, 10000)
+    messages = [(None, None, body) for body in bodies]
+    return summarize(bench_decode_batch(messages, batch_size), batch_size, batch_size=batch_size)
+
+
+@benchmark('batch_decode_binary')
+def bench_batch_decode_binary(quick=False, batch_size=100):
+    """Binary wire format, one event per message (the worst case: producers may pack several)"""
+    n = 5000 if quick else 200000
+    user_ids, amounts, timestamps = synthetic_events(n, 10000)
+    properties = SimpleNamespace(content_type=EVENT_CONTENT_TYPE)
+    messages = [(None, properties, encode_events([1000 + i], [u], [a], [t]))
+                for i, (u, a, t) in enumerate(zip(user_ids, amounts, timestamps))]
+    return summarize(bench_decode_batch(messages, batch_size), batch_size, batch_size=batch_size)
+
+
+class FakeChannel:
+    def basic_ack(self, delivery_tag, multiple=False):
+        pass
+
+    def basic_nack(self, delivery_tag, multiple=False, requeue=True):
+        raise AssertionError("benchmark message was requeued")
+
+
+class FakeLedgerSession:
+    """Answers every callback with 200 OK without touching the network"""
+    response = SimpleNamespace(status_code=200)
+
+    def post(self, url, json=None, timeout=None):
+        return self.response
+
+
+@contextlib.contextmanager
+def fake_pipeline():
+    """main's consumer wired to a fake channel and an in-process ledger (with a real fsync'd outbox)"""
+    with tempfile.TemporaryDirectory() as tmp:
+        ledger = LedgerClient('http://ledger/update', outbox=Outbox(os.path.join(tmp, 'outbox.jsonl')),
+                              session=FakeLedgerSession())
+        with mock.patch.object(main, 'ledger', ledger), mock.patch.object(main, 'engine', RiskEngine(store=ProfileStore())), \
+                mock.patch.object(main, 'verdict_cache', main.new_verdict_cache()), \
+                mock.patch.object(main, 'PROCESSING_DELAY', 0), quiet():
+            try:
+                yield FakeChannel(), ledger
+            finally:
+                ledger.close()
+
+
+@benchmark('e2e_single')
+def bench_e2e_single(quick=False):
+    bodies = event_bodies(2000 if quick else 50000, 10000)
+    latencies = []
+    with fake_pipeline() as (channel, ledger):
+        for tag, body in enumerate(bodies, 1):
+            method = SimpleNamespace(delivery_tag=tag)
+            start = time.perf_counter_ns()
+            main.process_transaction(channel, method, None, body)
+            latencies.append(time.perf_counter_ns() - start)
+        ledger.flush()
+    return summarize(latencies)
+
+
+@benchmark('e2e_batch')
+def bench_e2e_batch(quick=False, batch_size=100):
+    bodies = event_bodies(10000 if quick else 500000, 10000)
+    messages = [(SimpleNamespace(delivery_tag=tag), None, body) for tag, body in enumerate(bodies, 1)]
+    latencies = []
+    with fake_pipeline() as (channel, ledger):
+        for lo in range(0, len(messages), batch_size):
+            start = time.perf_counter_ns()
+            main.process_batch(channel, messages[lo:lo + batch_size])
+            latencies.append(time.perf_counter_ns() - start)
+        ledger.flush()
+    return summarize(latencies, batch_size, batch_size=batch_size)
+
+
+def run_one(name, quick=False, scales=None):
+    if scales:
+        register_get_profile(scales)
+    return BENCHMARKS[name](quick=quick)
+
+
+def run(names, quick=False, isolate=True, scales=None):
+    """Runs benchmarks, each in its own process by default so peak RSS is its own"""
+    results = {}
+    for name in names:
+        if isolate:
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+                results[name] = pool.submit(run_one, name, quick, scales).result()
+        else:
+            results[name] = run_one(name, quick, scales)
+        print(f" [*] {name}: {results[name]['events_per_second']:,.0f} events/sec, "
+              f"p50 {results[name]['p50_us']:.1f}us, p99 {results[name]['p99_us']:.1f}us", file=sys.stderr)
+    return results
+
+
+def compare(results, baseline, tolerance=0.25, latency_tolerance=1.0):
+    """Regressions versus a baseline: throughput or memory worse than `tolerance`, p99 worse than `latency_tolerance`"""
+    regressions = []
+    for name, base in baseline.get('results', {}).items():
+        current = results.get(name)
+        if current is None:
+            continue
+        if current['events_per_second'] < base['events_per_second'] * (1 - tolerance):
+            regressions.append(f"{name}: {current['events_per_second']:,.0f} events/sec "
+                               f"< baseline {base['events_per_second']:,.0f}")
+        if current['p99_us'] > base['p99_us'] * (1 + latency_tolerance):
+            regressions.append(f"{name}: p99 {current['p99_us']:.1f}us > baseline {base['p99_us']:.1f}us")
+        if current['peak_rss_mb'] > base['peak_rss_mb'] * (1 + tolerance):
+            regressions.append(f"{name}: peak RSS {current['peak_rss_mb']:.0f} MB > baseline {base['peak_rss_mb']:.0f} MB")
+    return regressions
+
+
+def metadata(quick):
+    return {"python": platform.python_version(), "numpy": np.__version__, "machine": platform.machine(),
+            "cpus": os.cpu_count(), "quick": quick}
+
+
+def parse_scales(value):
+    return [int(float(part)) for part in value.split(',')]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fraud engine hot-path benchmarks")
+    parser.add_argument('--only', nargs='+', help="benchmarks to run (default: all)")
+    parser.add_argument('--users', type=parse_scales, default=USER_SCALES, help="get_profile store sizes, e.g. 1e3,1e7")
+    parser.add_argument('--quick', action='store_true', help="fewer iterations (smoke test, noisy numbers)")
+    parser.add_argument('--no-isolate', action='store_true', help="run everything in this process")
+    parser.add_argument('--output', help="also write the JSON report to this file")
+    parser.add_argument('--check', metavar='BASELINE', help="fail (exit 1) on regressions versus this baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed throughput/memory regression (fraction)")
+    parser.add_argument('--latency-tolerance', type=float, default=1.0, help="allowed p99 regression (fraction)")
+    parser.add_argument('--update-baseline', metavar='BASELINE', help="write the results as the new baseline")
+    args = parser.parse_args()
+
+    register_get_profile(args.users)
+    names = args.only or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmarks {unknown}, expected some of {list(BENCHMARKS)}")
+
+    report = {"meta": metadata(args.quick),
+              "results": run(names, args.quick, not args.no_isolate, args.users)}
+    print(json.dumps(report, indent=2))
+    for path in filter(None, [args.output, args.update_baseline]):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+
+    if args.check:
+        with open(args.check, encoding='utf-8') as f:
+            regressions = compare(report['results'], json.load(f), args.tolerance, args.latency_tolerance)
+        for regression in regressions:
+            print(f" ❌ REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print(" ✅ No regressions against the baseline", file=sys.stderr)
@@ -0,0 +1,246 @@
+import json
+import os
+import queue
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from logs import log
+from metrics import REGISTRY
+
+# --- LEDGER CALLBACKS ---
+# Verdicts are written to a local append-only outbox (fsync'd) before the queue message is acked,
+# then delivered by a small pool of threads sharing one keep-alive HTTP session.
+# Failed deliveries are retried with exponential backoff; anything still undelivered when the
+# engine stops stays in the outbox and is replayed on the next start (at-least-once delivery,
+# the ledger ignores an update that repeats a transaction's current status).
+#
+# Outbox format, one JSON object per line:
+#   {"seq": 7, "transactionId": "1007", "status": "COMPLETED"}   queued update
+#   {"done": [5, 6, 7]}                                           delivered updates
+
+CALLBACK_SECONDS = REGISTRY.histogram('fraud_engine_ledger_callback_seconds',
+                                      "Duration of one ledger callback POST (one update, or one bulk request).")
+
+
+class Outbox:
+    """Durable log of ledger updates that have not been delivered yet (path=None keeps it in memory)"""
+
+    COMPACT_BYTES = 1 << 20  # truncate the log once it is this large and fully delivered
+
+    def __init__(self, path, fsync=True):
+        self.path = path
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.seq = 0
+        self.file = None
+
+    def open(self):
+        """Loads the log left by a previous run (no file I/O happens before this)"""
+        with self.lock:
+            if self.path and self.file is None:
+                self._load()
+                self.file = open(self.path, 'a', encoding='utf-8')
+
+    def _load(self):
+        """Replays the log, then rewrites it with only the undelivered updates"""
+        if os.path.exists(self.path):
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line from a crash mid-write
+                    if 'done' in record:
+                        for seq in record['done']:
+                            self.pending.pop(seq, None)
+                    else:
+                        self.pending[record['seq']] = (record['transactionId'], record['status'])
+                        self.seq = max(self.seq, record['seq'])
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            for seq, (tx_id, status) in self.pending.items():
+                f.write(json.dumps({"seq": seq, "transactionId": tx_id, "status": status}) + '\n')
+        os.replace(tmp, self.path)
+
+    def append(self, updates):
+        """Durably records [(transactionId, status), ...] and returns their sequence numbers"""
+        with self.lock:
+            seqs = list(range(self.seq + 1, self.seq + 1 + len(updates)))
+            self.seq += len(updates)
+            if self.file is not None:
+                self.file.write(''.join(json.dumps({"seq": seq, "transactionId": tx_id, "status": status}) + '\n'
+                                        for seq, (tx_id, status) in zip(seqs, updates)))
+                self.file.flush()
+                if self.fsync:
+                    os.fsync(self.file.fileno())
+            self.pending.update(zip(seqs, updates))
+        return seqs
+
+    def complete(self, seqs):
+        """Marks updates as delivered. Not fsync'd: losing it only means a harmless redelivery"""
+        with self.lock:
+            for seq in seqs:
+                self.pending.pop(seq, None)
+            if self.file is None:
+                return
+            if not self.pending and self.file.tell() >= self.COMPACT_BYTES:
+                self.file.truncate(0)
+                self.file.seek(0)
+            else:
+                self.file.write(json.dumps({"done": list(seqs)}) + '\n')
+                self.file.flush()
+
+    def undelivered(self):
+        with self.lock:
+            return [(seq, tx_id, status) for seq, (tx_id, status) in sorted(self.pending.items())]
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class RetryableError(Exception):
+    """The ledger could not take the update right now (5xx, 429)"""
+
+
+class LedgerClient:
+    """Delivers verdicts to the ledger from a bounded pool of threads over one pooled HTTP session"""
+
+    def __init__(self, url, bulk_url=None, workers=4, outbox=None, session=None, timeout=5,
+                 backoff=0.5, max_backoff=30.0, bulk_size=500):
+        self.url = url
+        self.bulk_url = bulk_url    # when set, updates are posted as {"updates": [...]} in bulk
+        self.workers = workers
+        self.outbox = outbox if outbox is not None else Outbox(None)
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.bulk_size = bulk_size
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+        self.queue = queue.Queue()
+        self.threads = []
+        self.stopping = threading.Event()
+        self.start_lock = threading.Lock()
+        self.delivered = 0
+        self.retries = 0
+        self.dropped = 0
+
+    def start(self):
+        """Starts the delivery threads and replays the outbox (called lazily on first enqueue)"""
+        with self.start_lock:
+            if self.threads:
+                return
+            self.outbox.open()
+            replay = self.outbox.undelivered()
+            if replay:
+                log.info(f" [*] Replaying {len(replay)} undelivered ledger updates from the outbox")
+            for item in replay:
+                self.queue.put(item)
+            self.threads = [threading.Thread(target=self._run, daemon=True, name=f'ledger-callback-{i}')
+                            for i in range(self.workers)]
+            for thread in self.threads:
+                thread.start()
+
+    def enqueue(self, updates):
+        """Queues [(transactionId, status), ...]. Returns once they are durably in the outbox"""
+        if not updates:
+            return
+        self.start()
+        updates = [(str(tx_id), status) for tx_id, status in updates]
+        for seq, (tx_id, status) in zip(self.outbox.append(updates), updates):
+            self.queue.put((seq, tx_id, status))
+
+    def flush(self, timeout=None):
+        """Waits until every queued update was delivered (or given up on). Returns False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.queue.all_tasks_done.wait(remaining)
+        return True
+
+    def close(self, timeout=5):
+        """Delivers what it can within timeout, then stops. Undelivered updates stay in the outbox"""
+        if self.threads:
+            self.flush(timeout)
+        self.stopping.set()
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join(timeout=1)
+        self.outbox.close()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            items = [item]
+            if self.bulk_url:
+                while len(items) < self.bulk_size:
+                    try:
+                        more = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if more is None:
+                        self.queue.put(None)  # leave the stop signal for this or another thread
+                        self.queue.task_done()
+                        break
+                    items.append(more)
+            try:
+                self._deliver(items)
+            finally:
+                for _ in items:
+                    self.queue.task_done()
+
+    def _deliver(self, items):
+        """Posts items, retrying with exponential backoff until delivered or the client stops"""
+        attempt = 0
+        while True:
+            try:
+                self._post(items)
+                break
+            except (RetryableError, requests.RequestException) as e:
+                if self.stopping.is_set():
+                    return  # still in the outbox, replayed on restart
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+                attempt += 1
+                self.retries += 1
+                log.warning(f" ⚠️ Failed to update Ledger: {e}. Retrying in {delay:.1f}s")
+                if self.stopping.wait(delay):
+                    return
+        self.delivered += len(items)
+        self.outbox.complete([seq for seq, _, _ in items])
+
+    def _post(self, items):
+        start = time.perf_counter()
+        try:
+            response = self._send(items)
+        finally:
+            CALLBACK_SECONDS.observe(time.perf_counter() - start)
+        if response.status_code >= 500 or response.status_code == 429:
+            raise RetryableError(f"HTTP {response.status_code}")
+        if response.status_code >= 400:
+            # Unknown transaction or a bad payload: retrying cannot help
+            self.dropped += len(items)
+            log.warning(f" ⚠️ Ledger refused update ({response.status_code}) for Tx "
+                        f"{', '.join(tx_id for _, tx_id, _ in items[:5])}")
+
+    def _send(self, items):
+        if self.bulk_url:
+            payload = {"updates": [{"transactionId": tx_id, "status": status} for _, tx_id, status in items]}
+            return self.session.post(self.bulk_url, json=payload, timeout=self.timeout)
+        _, tx_id, status = items[0]
+        return self.session.post(self.url, json={"transactionId": tx_id, "status": status}, timeout=self.timeout)
@@ -0,0 +1,426 @@
+import argparse
+import json
+import os
+import resource
+import time
+import numpy as np
+from backtest import iter_ledger, READ_CHUNK
+from wire import iso_timestamps, parse_timestamp
+
+# --- LEDGER EXPORT & RECONCILIATION ---
+# ledger_db.json keeps every transaction in one JSON object that only grows. This tool streams it
+# (backtest's incremental reader, one record at a time) into a directory of flat columns that
+# NumPy memory-maps, then reconciles the account balances against the transactions:
+#   python ledger_export.py export ../ledger_db.json ledger_columns/
+#   python ledger_export.py reconcile ledger_columns/ --opening 7=2500 --json
+#   python ledger_export.py show ledger_columns/ --transaction 1000
+#   python ledger_export.py show ledger_columns/ --sender 4
+#
+# Layout of the directory:
+#   <column>.bin        raw little-endian values, one per transaction version, append-only
+#   index-*.npy         transactionId -> row of its latest version, and senderId -> those rows
+#   accounts-*.npy      userId and balance of every account, as of the last export
+#   meta.json           row count, dtypes and export history; written last, so it is the commit point
+#
+# Exporting again appends only what changed since the previous export: new transactions, and a
+# new version of those whose status moved (PENDING -> COMPLETED/REJECTED). Readers take the
+# latest version of each transaction through the index. Bytes past meta.json's row count (a
+# crashed export) are truncated by the next one.
+#
+# Parsing holds EXPORT_CHUNK transactions at a time and reconciliation reads the columns in
+# chunks as well; only the index build needs a few int64 arrays the size of the transaction count.
+
+COLUMNS = (('transaction_id', '<u8'), ('sender_id', '<i8'), ('recipient_id', '<i8'),
+           ('amount', '<f8'), ('timestamp', '<f8'), ('status', 'u1'))
+STATUSES = ('PENDING', 'COMPLETED', 'REJECTED')
+PENDING, COMPLETED, REJECTED = 0, 1, 2
+UNKNOWN_STATUS = 255
+STATUS_CODES = {status: code for code, status in enumerate(STATUSES)}
+EXPORT_CHUNK = 100000
+
+# Opening balances, as the ledger service creates accounts: the two seeded in getDb(), and the
+# $1000 bonus of every account created on a first GET /balance
+OPENING_BALANCE = 1000.0
+SEED_BALANCES = {1: 10000.0, 2: 50000.0}
+TOLERANCE = 1e-6
+
+
+def _column_path(directory, name):
+    return os.path.join(directory, f'{name}.bin')
+
+
+def _read_meta(directory):
+    path = os.path.join(directory, 'meta.json')
+    if not os.path.exists(path):
+        return {"rows": 0, "columns": dict(COLUMNS), "accounts": 0, "exports": []}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_meta(directory, meta):
+    tmp = os.path.join(directory, 'meta.json.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, os.path.join(directory, 'meta.json'))
+
+
+def _save(directory, name, array):
+    """np.save to a temporary name, then rename: readers never see a half-written index"""
+    tmp = os.path.join(directory, f'{name}.tmp.npy')
+    np.save(tmp, array)
+    os.replace(tmp, os.path.join(directory, f'{name}.npy'))
+
+
+class LedgerColumns:
+    """Read-only, memory-mapped view of an exported ledger"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.meta = _read_meta(directory)
+        self.rows = self.meta['rows']
+        self.columns = {}
+        for name, dtype in self.meta['columns'].items():
+            if self.rows:
+                self.columns[name] = np.memmap(_column_path(directory, name), dtype=dtype, mode='r', shape=(self.rows,))
+            else:
+                self.columns[name] = np.zeros(0, dtype=dtype)  # np.memmap cannot map an empty file
+        load = lambda name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r')
+        if self.rows:
+            self.transaction_ids, self.latest = load('index-transaction_id'), load('index-transaction_row')
+            self.sender_ids, self.sender_starts = load('index-sender_id'), load('index-sender_start')
+            self.sender_rows = load('index-sender_rows')
+        else:
+            self.transaction_ids, self.sender_ids = np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.int64)
+            self.latest, self.sender_rows = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+            self.sender_starts = np.zeros(1, dtype=np.int64)
+        if os.path.exists(os.path.join(directory, 'accounts-user_id.npy')):
+            self.account_ids, self.balances = load('accounts-user_id'), load('accounts-balance')
+        else:
+            self.account_ids, self.balances = np.zeros(0, dtype=np.int64), np.zeros(0)
+
+    def __len__(self):
+        """Transactions (latest versions only)"""
+        return len(self.transaction_ids)
+
+    def find(self, transaction_ids):
+        """Row of the latest version of each transactionId (-1 where unknown)"""
+        ids = np.asarray(transaction_ids, dtype=np.uint64)
+        if not len(self):
+            return np.full(len(ids), -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.transaction_ids, ids), len(self) - 1)
+        return np.where(self.transaction_ids[pos] == ids, self.latest[pos], -1)
+
+    def sent_by(self, sender_id):
+        """Rows of the latest versions of a sender's transactions, by transactionId"""
+        i = np.searchsorted(self.sender_ids, sender_id)
+        if i == len(self.sender_ids) or self.sender_ids[i] != sender_id:
+            return np.zeros(0, dtype=np.int64)
+        return np.asarray(self.sender_rows[self.sender_starts[i]:self.sender_starts[i + 1]])
+
+    def record(self, row):
+        """One transaction version as the ledger stores it"""
+        c = self.columns
+        status = int(c['status'][row])
+        return {"transactionId": str(int(c['transaction_id'][row])), "senderId": int(c['sender_id'][row]),
+                "recipientId": int(c['recipient_id'][row]), "amount": float(c['amount'][row]),
+                "timestamp": float(c['timestamp'][row]),
+                "status": STATUSES[status] if status < len(STATUSES) else None}
+
+
+def _timestamps(values):
+    stamps = iso_timestamps(values)
+    if stamps is not None:
+        return stamps
+    stamps = np.empty(len(values))
+    for i, value in enumerate(values):
+        try:
+            stamps[i] = parse_timestamp(value) if value is not None else np.nan
+        except (TypeError, ValueError):
+            stamps[i] = np.nan
+    return stamps
+
+
+class LedgerExport:
+    """Appends the transactions of one ledger dump to an export directory"""
+
+    def __init__(self, directory, chunk_size=EXPORT_CHUNK):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        os.makedirs(directory, exist_ok=True)
+        self.meta = _read_meta(directory)
+        self.previous = LedgerColumns(directory) if self.meta['rows'] else None
+        self.rows = self.meta['rows']
+        self.parsed = self.appended = self.updated = self.malformed = 0
+        self.pending = []
+        self.account_ids, self.balances = [], []
+        self.files = {}
+        for name, dtype in COLUMNS:
+            path = _column_path(directory, name)
+            with open(path, 'ab') as f:
+                f.truncate(self.rows * np.dtype(dtype).itemsize)  # drops what a crashed export appended
+            self.files[name] = open(path, 'ab')
+
+    def add_account(self, account):
+        try:
+            user_id, balance = int(account['userId']), float(account['balance'])
+        except (KeyError, TypeError, ValueError):
+            self.malformed += 1
+            return
+        self.account_ids.append(user_id)
+        self.balances.append(balance)
+
+    def add_transaction(self, tx):
+        try:
+            # The gateway passes recipientId and amount through from the request body: "2", "10.5"
+            self.pending.append((int(tx['transactionId']), int(tx['senderId']), int(tx['recipientId']),
+                                 float(tx['amount']), tx.get('timestamp'),
+                                 STATUS_CODES.get(tx.get('status'), UNKNOWN_STATUS)))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            self.malformed += 1
+            return
+        if len(self.pending) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        tx_ids, senders, recipients, amounts, raw_times, statuses = zip(*self.pending)
+        self.parsed += len(self.pending)
+        self.pending = []
+        columns = {'transaction_id': np.array(tx_ids, dtype=np.uint64), 'sender_id': np.array(senders, dtype=np.int64),
+                   'recipient_id': np.array(recipients, dtype=np.int64), 'amount': np.array(amounts),
+                   'timestamp': _timestamps(raw_times), 'status': np.array(statuses, dtype=np.uint8)}
+        if self.previous is not None and len(self.previous):
+            # Versions already exported with the same status are left out
+            rows = self.previous.find(columns['transaction_id'])
+            known = rows >= 0
+            previous_status = np.full(len(rows), UNKNOWN_STATUS, dtype=np.int16)
+            previous_status[known] = self.previous.columns['status'][rows[known]]
+            keep = ~known | (previous_status != columns['status'])
+            self.updated += int((keep & known).sum())
+            columns = {name: column[keep] for name, column in columns.items()}
+        for name, dtype in COLUMNS:
+            self.files[name].write(columns[name].astype(dtype, copy=False).tobytes())
+        self.appended += len(columns['status'])
+
+    def close(self, source=None):
+        """Flushes the columns, rebuilds the indexes and commits the new row count to meta.json"""
+        self.flush()
+        for f in self.files.values():
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+        self.rows += self.appended
+        self.previous = None
+        build_indexes(self.directory, self.rows)
+        order = np.argsort(np.array(self.account_ids, dtype=np.int64), kind='stable')
+        _save(self.directory, 'accounts-user_id', np.array(self.account_ids, dtype=np.int64)[order])
+        _save(self.directory, 'accounts-balance', np.array(self.balances, dtype=np.float64)[order])
+        self.meta['rows'] = self.rows
+        self.meta['accounts'] = len(self.account_ids)
+        self.meta['exports'].append({"at": time.time(), "source": source, "parsed": self.parsed,
+                                     "appended": self.appended, "updated": self.updated, "malformed": self.malformed})
+        _write_meta(self.directory, self.meta)
+
+
+def build_indexes(directory, rows):
+    """Sorted transactionId -> latest row, and senderId -> rows (CSR offsets into index-sender_rows)"""
+    if not rows:
+        return
+    meta = dict(COLUMNS)
+    ids = np.memmap(_column_path(directory, 'transaction_id'), dtype=meta['transaction_id'], mode='r', shape=(rows,))
+    # Rows are appended in about transactionId order, which the stable (merge) sort is quick on;
+    # versions of one transaction stay in row order, so the last of each run is the latest
+    order = np.argsort(ids, kind='stable')
+    sorted_ids = ids[order]
+    last = np.append(sorted_ids[1:] != sorted_ids[:-1], True)
+    latest = order[last]
+    _save(directory, 'index-transaction_id', sorted_ids[last])
+    _save(directory, 'index-transaction_row', latest)
+    del order, sorted_ids
+
+    senders = np.memmap(_column_path(directory, 'sender_id'), dtype=meta['sender_id'], mode='r', shape=(rows,))[latest]
+    by_sender = np.argsort(senders, kind='stable')
+    sender_ids, starts = np.unique(senders[by_sender], return_index=True)
+    _save(directory, 'index-sender_id', sender_ids)
+    _save(directory, 'index-sender_start', np.append(starts, len(senders)).astype(np.int64))
+    _save(directory, 'index-sender_rows', latest[by_sender])
+
+
+def export_ledger(path, directory, chunk_size=EXPORT_CHUNK, read_chunk=READ_CHUNK):
+    """Streams a ledger_db.json into an export directory; returns the export's meta.json entry"""
+    start = time.perf_counter()
+    export = LedgerExport(directory, chunk_size)
+    with open(path, encoding='utf-8') as f:
+        for section, record in iter_ledger(f, ('accounts', 'transactions'), read_chunk):
+            if section == 'transactions':
+                export.add_transaction(record)
+            else:
+                export.add_account(record)
+    export.close(os.path.abspath(path))
+    return dict(export.meta['exports'][-1], rows=export.rows, seconds=time.perf_counter() - start,
+                peak_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+
+
+def opening_balances(account_ids, default=OPENING_BALANCE, overrides=None):
+    """Opening balance of each account: `default`, except the seeded accounts and `overrides` {userId: balance}"""
+    openings = np.full(len(account_ids), float(default))
+    for user_id, balance in {**SEED_BALANCES, **(overrides or {})}.items():
+        i = np.searchsorted(account_ids, user_id)
+        if i < len(account_ids) and account_ids[i] == user_id:
+            openings[i] = balance
+    return openings
+
+
+def reconcile(ledger, openings=None, chunk_size=EXPORT_CHUNK * 10, top=20):
+    """Checks every balance against opening + received (COMPLETED) - sent (PENDING, COMPLETED).
+
+    The ledger debits the sender when the transfer is made, refunds it on REJECTED and credits the
+    recipient on COMPLETED, so a REJECTED transaction nets to zero and a PENDING one is money in
+    flight. `openings` defaults to opening_balances() of the exported accounts.
+    """
+    start = time.perf_counter()
+    accounts, balances = np.asarray(ledger.account_ids), np.asarray(ledger.balances, dtype=np.float64)
+    n = len(accounts)
+    openings = opening_balances(accounts) if openings is None else np.asarray(openings, dtype=np.float64)
+    sent, received = np.zeros(n), np.zeros(n)
+    counts, volumes = np.zeros(UNKNOWN_STATUS + 1, dtype=np.int64), np.zeros(UNKNOWN_STATUS + 1)
+    unknown_senders = unknown_recipients = 0
+    lost = 0.0   # COMPLETED amounts whose recipient has no account: debited, never credited
+    c = ledger.columns
+    for begin in range(0, len(ledger.latest), chunk_size):
+        rows = np.sort(ledger.latest[begin:begin + chunk_size])  # sequential reads of the memory map
+        senders, recipients, amounts = c['sender_id'][rows], c['recipient_id'][rows], c['amount'][rows]
+        statuses = c['status'][rows]
+        counts += np.bincount(statuses, minlength=UNKNOWN_STATUS + 1)
+        volumes += np.bincount(statuses, weights=amounts, minlength=UNKNOWN_STATUS + 1)
+
+        s = np.minimum(np.searchsorted(accounts, senders), max(n - 1, 0))
+        r = np.minimum(np.searchsorted(accounts, recipients), max(n - 1, 0))
+        s_known = accounts[s] == senders if n else np.zeros(len(rows), dtype=bool)
+        r_known = accounts[r] == recipients if n else np.zeros(len(rows), dtype=bool)
+        debited = s_known & ((statuses == PENDING) | (statuses == COMPLETED))
+        credited = r_known & (statuses == COMPLETED)
+        sent += np.bincount(s[debited], weights=amounts[debited], minlength=n)
+        received += np.bincount(r[credited], weights=amounts[credited], minlength=n)
+        unknown_senders += int((~s_known).sum())
+        unknown_recipients += int((~r_known).sum())
+        lost += float(amounts[~r_known & (statuses == COMPLETED)].sum())
+
+    expected = openings + received - sent
+    difference = balances - expected
+    off = np.flatnonzero(np.abs(difference) > TOLERANCE * np.maximum(1.0, np.abs(balances)))
+    worst = off[np.argsort(-np.abs(difference[off]), kind='stable')][:top]
+    return {
+        "transactions": len(ledger),
+        "versions": ledger.rows,
+        "accounts": n,
+        "statuses": {status: {"count": int(counts[code]), "amount": float(volumes[code])}
+                     for code, status in enumerate(STATUSES)},
+        "unknown_statuses": int(counts[UNKNOWN_STATUS]),
+        "in_flight": float(volumes[PENDING]),
+        "unknown_senders": unknown_senders,
+        "unknown_recipients": unknown_recipients,
+        "lost_credits": lost,
+        "negative_balances": int((balances < 0).sum()),
+        "mismatched": len(off),
+        "discrepancy": float(difference[off].sum()),
+        "worst": [{"userId": int(accounts[i]), "balance": float(balances[i]), "expected": float(expected[i]),
+                   "difference": float(difference[i]), "opening": float(openings[i]),
+                   "sent": float(sent[i]), "received": float(received[i])} for i in worst],
+        "elapsed_seconds": time.perf_counter() - start,
+    }
+
+
+def print_export(report):
+    print(f" ✅ Exported {report['parsed']} transactions in {report['seconds']:.2f}s: {report['appended']} rows appended"
+          f" ({report['updated']} status updates), {report['malformed']} malformed; {report['rows']} rows in total,"
+          f" peak RSS {report['peak_rss_mb']:.0f} MB")
+
+
+def print_reconciliation(report):
+    print(f" [*] Reconciled {report['accounts']} accounts against {report['transactions']} transactions"
+          f" in {report['elapsed_seconds']:.2f}s")
+    for status, stats in report['statuses'].items():
+        print(f"     {status:<10} {stats['count']:>10}  {stats['amount']:>16,.2f}")
+    if report['unknown_statuses'] or report['unknown_senders'] or report['unknown_recipients']:
+        print(f" ⚠️ {report['unknown_statuses']} unknown statuses, {report['unknown_senders']} unknown senders,"
+              f" {report['unknown_recipients']} unknown recipients ({report['lost_credits']:,.2f} credited to nobody)")
+    if report['negative_balances']:
+        print(f" ⚠️ {report['negative_balances']} negative balances")
+    if not report['mismatched']:
+        print(" ✅ Every balance matches its transactions")
+        return
+    print(f" 🛑 {report['mismatched']} balances off by {report['discrepancy']:,.2f} in total; worst:")
+    for account in report['worst']:
+        print(f"     user {account['userId']:<10} balance {account['balance']:>14,.2f}"
+              f"  expected {account['expected']:>14,.2f}  ({account['difference']:+,.2f})")
+
+
+def parse_opening(value):
+    user_id, _, balance = value.partition('=')
+    try:
+        return int(user_id), float(balance)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected USER=AMOUNT, got {value!r}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Export ledger_db.json to memory-mapped columns and reconcile balances")
+    commands = parser.add_subparsers(dest='command', required=True)
+    export = commands.add_parser('export', help="append a ledger dump to an export directory")
+    export.add_argument('ledger', help="ledger_db.json")
+    export.add_argument('directory')
+    export.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK, help="transactions parsed per column write")
+    export.add_argument('--reconcile', action='store_true', help="reconcile the balances once exported")
+    check = commands.add_parser('reconcile', help="check every balance against the net of its transactions")
+    check.add_argument('directory')
+    show = commands.add_parser('show', help="print transactions from an export directory")
+    show.add_argument('directory')
+    which = show.add_mutually_exclusive_group(required=True)
+    which.add_argument('--transaction', type=int, help="a transactionId")
+    which.add_argument('--sender', type=int, help="every transaction of a senderId")
+    for command in (export, check):
+        command.add_argument('--opening-balance', type=float, default=OPENING_BALANCE,
+                             help="opening balance of accounts not seeded by the ledger service")
+        command.add_argument('--opening', type=parse_opening, action='append', default=[], metavar='USER=AMOUNT',
+                             help="opening balance of one account (repeatable)")
+        command.add_argument('--top', type=int, default=20, help="mismatched accounts to list")
+    for command in (export, check, show):
+        command.add_argument('--json', action='store_true', help="print JSON")
+    return parser
+
+
+def show(ledger, transaction_id=None, sender_id=None):
+    """The latest version of one transaction, or of every transaction of a sender"""
+    if transaction_id is not None:
+        rows = ledger.find([transaction_id])
+        rows = rows[rows >= 0]
+    else:
+        rows = ledger.sent_by(sender_id)
+    return [ledger.record(row) for row in rows]
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    output = {}
+    if args.command == 'export':
+        output['export'] = export_ledger(args.ledger, args.directory, args.chunk_size)
+        if not args.json:
+            print_export(output['export'])
+    ledger = LedgerColumns(args.directory)
+    if args.command == 'reconcile' or args.command == 'export' and args.reconcile:
+        openings = opening_balances(ledger.account_ids, args.opening_balance, dict(args.opening))
+        output['reconciliation'] = reconcile(ledger, openings, top=args.top)
+        if not args.json:
+            print_reconciliation(output['reconciliation'])
+    if args.command == 'show':
+        output['transactions'] = show(ledger, args.transaction, args.sender)
+        if not args.json:
+            for record in output['transactions']:
+                print(f"     {record['transactionId']:>10}  {record['senderId']:>8} -> {record['recipientId']:<8}"
+                      f" {record['amount']:>12,.2f}  {record['status']}")
+    if args.json:
+        print(json.dumps(output if len(output) > 1 else next(iter(output.values())), indent=2))
@@ -1,105 +1,374 @@
 import pika
 import json
 import time
-import requests
 import os
+import math
+import signal
+import importlib
+import logging
+import resource
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from collections import Counter
+from types import SimpleNamespace
 import numpy as np
-from collections import deque
+from profiles import ProfileStore, RemoteProfileStore, PROFILE_COLUMNS
+from resp import RespClient
+from callbacks import LedgerClient, Outbox
+from rules import compile_rules
+from wire import decode_event, decode_batch, is_binary
+from snapshots import ProfileSnapshots
+from backpressure import Backpressure, DegradedLog
+from verdicts import VerdictCache
+import logs
+from logs import log, fields, sampled
+import metrics
+from metrics import REGISTRY
 
 # --- CONFIGURATION ---
 RABBITMQ_HOST = os.getenv('RABBITMQ_HOST', 'localhost')
 QUEUE_NAME = 'transaction_events'
 LEDGER_URL = os.getenv('LEDGER_URL', 'http://localhost:3002/transaction/update')
 
-# --- IN-MEMORY STATE (Simulating a Redis Cache) ---
-# In production HFT, this would be Redis Cluster
-# Structure: { user_id: { 'history': deque([amounts]), 'timestamps': deque([times]) } }
-user_profiles = {}
+# Ledger Callbacks (see callbacks.py)
+LEDGER_BULK_URL = os.getenv('LEDGER_BULK_URL', '')                   # e.g. .../transaction/update/bulk ('' = one POST per update)
+CALLBACK_WORKERS = int(os.getenv('CALLBACK_WORKERS', '4'))           # delivery threads (= pooled connections)
+CALLBACK_OUTBOX = os.getenv('CALLBACK_OUTBOX', 'ledger_outbox.jsonl')  # durable log of undelivered updates
+
+# Consumer Mode: 'single' acks one message at a time, 'batch' scores micro-batches,
+# 'adaptive' scores micro-batches sized by the backlog (see below)
+CONSUMER_MODE = os.getenv('CONSUMER_MODE', 'single')
+BATCH_SIZE = int(os.getenv('BATCH_SIZE', '100'))          # max events per micro-batch
+BATCH_LINGER = float(os.getenv('BATCH_LINGER', '0.05'))   # max seconds to wait for a batch to fill
+PREFETCH_COUNT = int(os.getenv('PREFETCH_COUNT', '0'))    # 0 = pick a sensible default for the mode
+
+# Adaptive Mode (CONSUMER_MODE=adaptive, see backpressure.py): batches grow and low-risk events take a
+# cheap fast path when the queue backs up, to keep the time from transfer to verdict bounded
+MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', '1000'))              # largest micro-batch under backlog
+SCORING_PARALLELISM = int(os.getenv('SCORING_PARALLELISM', '8'))       # most concurrent model calls per batch
+BACKLOG_DEPTH = int(os.getenv('BACKLOG_DEPTH', '1000'))                # queued messages that count as a backlog
+VERDICT_SLO = float(os.getenv('VERDICT_SLO', '2'))                     # target p99 seconds from event timestamp to verdict
+FAST_PATH_MAX_COST = int(os.getenv('FAST_PATH_MAX_COST', '1'))         # fast path keeps rules up to this cost (see rules.py)
+FAST_PATH_MAX_AMOUNT = float(os.getenv('FAST_PATH_MAX_AMOUNT', '1000'))  # only smaller amounts may take the fast path
+DEGRADED_LOG = os.getenv('DEGRADED_LOG', 'degraded_decisions.jsonl')   # fast-path verdicts, for re-scoring
+
+# Scoring Cost Model: stands in for the "complex computation" of a real model (see simulate_scoring_cost)
+SCORING_COST = os.getenv('SCORING_COST', 'sleep')  # 'sleep' (I/O-bound, e.g. a remote model), 'cpu' (busy work), 'none' or 'module:function'
+PROCESSING_DELAY = float(os.getenv('PROCESSING_DELAY', '0.5'))                 # seconds per call (one message, or one whole batch)
+SCORING_COST_PER_EVENT = float(os.getenv('SCORING_COST_PER_EVENT', '0'))       # additional seconds per scored event
+
+# Velocity Rule: comma-separated "window_seconds:max_tx" limits, all checked per user (e.g. "1:3,10:5,60:20")
+VELOCITY_LIMITS = os.getenv('VELOCITY_LIMITS', '10:5')
+
+# Anomaly Statistics: 'window' = mean/std of the last 50 amounts, 'ewm' = exponentially weighted
+ANOMALY_STATS = os.getenv('ANOMALY_STATS', 'window')
+EWM_ALPHA = float(os.getenv('EWM_ALPHA', '0.1'))
+
+# Rule Pipeline: JSON list of rule specs (see rules.py), e.g. '[{"rule": "structuring", "limit": 5000}, {"rule": "velocity"}]'
+# Empty = structuring, velocity (VELOCITY_LIMITS) and anomaly with their default thresholds
+RULES = os.getenv('RULES', '')
+
+# Profile Store: 'memory' keeps profiles in this process, 'redis' shares them between replicas
+PROFILE_BACKEND = os.getenv('PROFILE_BACKEND', 'memory')
+REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
+REDIS_PORT = int(os.getenv('REDIS_PORT', '6379'))
+
+# Profile Store sizing (see profiles.py)
+PROFILE_CAPACITY = int(os.getenv('PROFILE_CAPACITY', '1024'))  # rows preallocated up front
+MAX_PROFILES = int(os.getenv('MAX_PROFILES', '0'))             # LRU-evict beyond this many users (0 = unbounded)
+PROFILE_TTL = float(os.getenv('PROFILE_TTL', '0'))             # evict users idle for this many seconds (0 = never)
+
+# Profile Snapshots (memory backend, see snapshots.py): warm restarts from a local directory
+PROFILE_SNAPSHOT_DIR = os.getenv('PROFILE_SNAPSHOT_DIR', '')           # '' = profiles start empty after a restart
+SNAPSHOT_INTERVAL = float(os.getenv('SNAPSHOT_INTERVAL', '60'))        # seconds between background snapshots
+
+# Observability (see metrics.py and logs.py; LOG_LEVEL, LOG_FORMAT and LOG_SAMPLE_RATE are read by logs.py)
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))  # Prometheus /metrics endpoint of this process (0 = off)
+
+# Verdict Cache (see verdicts.py): redelivered transactions reuse their verdict instead of being scored again
+VERDICT_CACHE_SIZE = int(os.getenv('VERDICT_CACHE_SIZE', '100000'))   # transactions remembered (0 = no cache)
+VERDICT_CACHE_TTL = float(os.getenv('VERDICT_CACHE_TTL', '3600'))     # seconds a verdict is remembered
+VERDICT_CACHE_PATH = os.getenv('VERDICT_CACHE_PATH', '')             # JSONL file keeping them across restarts ('' = memory only)
+
+# Seconds to wait before connecting (connect_rabbitmq retries anyway)
+STARTUP_DELAY = float(os.getenv('STARTUP_DELAY', '0'))
+
+# --- PROFILE STATE ---
+# Structure: one row of preallocated NumPy ring buffers + running stats per user (see profiles.py)
+# With PROFILE_BACKEND=redis the rows are shared through Redis so several replicas can run
+def new_profile_store():
+    if PROFILE_BACKEND == 'redis':
+        client = RespClient(REDIS_HOST, REDIS_PORT)
+        return RemoteProfileStore(client, capacity=PROFILE_CAPACITY, max_users=MAX_PROFILES, ttl=PROFILE_TTL)
+    return ProfileStore(capacity=PROFILE_CAPACITY, max_users=MAX_PROFILES, ttl=PROFILE_TTL)
+
+user_profiles = new_profile_store()
+
+def new_verdict_cache(path=None):
+    if VERDICT_CACHE_SIZE <= 0:
+        return None
+    return VerdictCache(VERDICT_CACHE_SIZE, VERDICT_CACHE_TTL, path)
+
+verdict_cache = new_verdict_cache()
 
 def reset_state():
-    """Helper for testing: Clears all user profiles"""
-    global user_profiles
-    user_profiles = {}
+    """Helper for testing: Clears all user profiles (and the verdicts remembered for them)"""
+    global user_profiles, verdict_cache
+    user_profiles = new_profile_store()
+    verdict_cache = new_verdict_cache()
 
 # --- FRAUD RULES ENGINE ---
 
+def rule_specs():
+    """Rule specs the engine is compiled from (RULES, or the built-in rules)"""
+    if RULES:
+        return json.loads(RULES)
+    return [{"rule": "structuring"}, {"rule": "velocity", "limits": VELOCITY_LIMITS}, {"rule": "anomaly"}]
+
+class BatchView(SimpleNamespace):
+    """Column arrays of one analyze_batch call, as seen by the rules' check_batch"""
+
 class RiskEngine:
-    def __init__(self):
-        # Configuration for HFT Rules
-        self.VELOCITY_WINDOW = 10  # look at last 10 seconds
-        self.VELOCITY_LIMIT = 5    # max 5 tx per 10 seconds
-        self.STRUCTURING_LIMIT = 10000
-        self.STRUCTURING_THRESHOLD = 0.95 # 95% of limit (e.g. 9500-9999)
+    def __init__(self, store=None, rules=None):
+        self._store = store
+        # Rules are declared as specs and compiled into an ordered plan (see rules.py)
+        self.plan = compile_rules(rule_specs() if rules is None else rules)
+        self.BATCH_CHUNK = 16384   # events per vectorized window gather (bounds analyze_batch memory)
+        self.ANOMALY_STATS = ANOMALY_STATS
+        self.EWM_ALPHA = EWM_ALPHA
+        self.STATS_RESYNC = 1000   # recompute window stats exactly every N updates to cancel float drift
+        self.journal = None        # ProfileJournal receiving every scored event (see snapshots.py)
+        self.FAST_PATH_MAX_COST = FAST_PATH_MAX_COST  # rules costlier than this are skipped for fast-path events
+        self.COMMIT_ATTEMPTS = 5   # scorings of one batch that may lose a commit race before the last one is forced
+
+    @property
+    def store(self):
+        """Profile store in use (the global user_profiles unless one was passed in)"""
+        return user_profiles if self._store is None else self._store
 
     def get_profile(self, user_id):
-        if user_id not in user_profiles:
-            user_profiles[user_id] = {
-                'amounts': deque(maxlen=50),      # Keep last 50 amounts
-                'timestamps': deque(maxlen=50)    # Keep last 50 timestamps
-            }
-        return user_profiles[user_id]
-
-    def check_velocity(self, timestamps):
-        """HFT Rule: Detect Bot-like speed"""
-        if len(timestamps) < 2:
-            return False
-        
-        current_time = time.time()
-        # Count transactions in the last VELOCITY_WINDOW seconds
-        recent_tx_count = sum(1 for t in timestamps if (current_time - t) < self.VELOCITY_WINDOW)
-        
-        if recent_tx_count > self.VELOCITY_LIMIT:
-            print(f" [!] HFT VELOCITY ALERT: {recent_tx_count} tx in {self.VELOCITY_WINDOW}s")
-            return True
-        return False
+        return self.store.get_profile(user_id)
 
-    def check_structuring(self, amount):
-        """Compliance Rule: Detect 'Smurfing' (just under reporting limits)"""
-        # If amount is between $9500 and $10000
-        if (self.STRUCTURING_LIMIT * self.STRUCTURING_THRESHOLD) <= amount < self.STRUCTURING_LIMIT:
-            print(f" [!] STRUCTURING ALERT: ${amount} is suspicious")
-            return True
-        return False
+    def record(self, profile, amount, timestamp):
+        """Appends a transaction to the profile, updating its statistics in O(1)"""
+        count = len(profile)
+        mean = profile.mean
+        if count == profile.store.history_size:
+            # Sliding Welford: the oldest amount leaves the window as the new one enters
+            oldest = profile.oldest_amount()
+            new_mean = mean + (amount - oldest) / count
+            profile.m2 = max(profile.m2 + (amount - oldest) * (amount - new_mean + oldest - mean), 0.0)
+        else:
+            new_mean = mean + (amount - mean) / (count + 1)
+            profile.m2 += (amount - mean) * (amount - new_mean)
+        profile.mean = new_mean
 
-    def check_anomaly(self, amounts, current_amount):
-        """Statistical Rule: Detect deviations from user's average"""
-        if len(amounts) < 5:
-            return False # Not enough history
-        
-        history = list(amounts)
-        avg = np.mean(history)
-        std_dev = np.std(history)
-        
-        # If transaction is > Average + 3 Standard Deviations (3-Sigma Rule)
-        if std_dev > 0 and current_amount > (avg + (3 * std_dev)):
-            print(f" [!] ANOMALY ALERT: ${current_amount} is > 3-Sigma from Avg ${avg:.2f}")
-            return True
-        return False
+        if count == 0:
+            profile.ewm_mean, profile.ewm_var = amount, 0.0
+        else:
+            delta = amount - profile.ewm_mean
+            increment = self.EWM_ALPHA * delta
+            profile.ewm_mean += increment
+            profile.ewm_var = (1 - self.EWM_ALPHA) * (profile.ewm_var + delta * increment)
 
-    def analyze(self, user_id, amount):
-        profile = self.get_profile(user_id)
-        current_time = time.time()
-        
-        # 1. Run Checks
-        is_velocity_fraud = self.check_velocity(profile['timestamps'])
-        is_structuring = self.check_structuring(amount)
-        is_anomaly = self.check_anomaly(profile['amounts'], amount)
-        
-        # 2. Update Profile (Store current tx for next time)
-        profile['timestamps'].append(current_time)
-        profile['amounts'].append(amount)
+        profile.push(amount, timestamp)
+
+        if profile.updates % self.STATS_RESYNC == 0:
+            history = profile.amounts
+            profile.mean = np.mean(history)
+            profile.m2 = np.var(history) * len(history)
+
+    def profile_stats(self, profile):
+        """Returns (mean, std_dev) of the profile according to ANOMALY_STATS"""
+        if self.ANOMALY_STATS == 'ewm':
+            return profile.ewm_mean, math.sqrt(profile.ewm_var)
+        return profile.mean, math.sqrt(profile.m2 / len(profile))
+
+    def rule_stats(self):
+        """Per-rule calls, hits and seconds spent since the engine was created"""
+        return self.plan.stats()
+
+    def analyze(self, user_id, amount, timestamp=None, tx_id=None):
+        current_time = event_time = time.time() if timestamp is None else timestamp
+        self.store.maybe_evict_idle(current_time)
+        for attempt in range(self.COMMIT_ATTEMPTS):
+            profile = self.get_profile(user_id)
+            # Event time is kept non-decreasing per user so late/replayed events don't rewind the windows
+            current_time = max(event_time, profile.last_seen)
+
+            # 1. Run Checks (cheapest first, stopping at the first rejection)
+            verdict = self.plan.evaluate(self, profile, amount, current_time)
+
+            # 2. Update Profile (Store current tx for next time, whatever the verdict)
+            self.record(profile, amount, current_time)
+            # A shared store refuses the commit if another scorer updated the user meanwhile: score again
+            if self.commit([profile.row], attempt):
+                break
         
-        # 3. Decision Logic
-        if is_velocity_fraud:
-            return "REJECTED", "High Frequency Trading Velocity Exceeded"
-        if is_structuring:
-            return "REJECTED", "Potential Structuring Detected"
-        if is_anomaly:
-            return "REJECTED", "Statistical Anomaly Detected"
-            
-        return "COMPLETED", "Verified"
+        # 3. Decision (journaled with the transactionId once committed, see snapshots.py)
+        decision = self.plan.verdicts[verdict]
+        if self.journal is not None:
+            self.journal.append([user_id], [amount], [event_time], None if tx_id is None else [tx_id], [decision])
+        return decision
+
+    def analyze_batch(self, user_ids, amounts, timestamps=None, fast=None, tx_ids=None):
+        """Vectorized analyze: scores column arrays of events at once.
+
+        Events are treated in arrival order, so several events from the same user
+        in one batch see each other exactly like sequential analyze calls would.
+        Events flagged in the optional `fast` mask skip the rules costlier than
+        FAST_PATH_MAX_COST (their profiles are updated all the same). Optional
+        tx_ids are journaled with the verdicts.
+        """
+        amounts = np.asarray(amounts, dtype=float)
+        n = len(amounts)
+        if n == 0:
+            return []
+        if timestamps is None:
+            timestamps = np.full(n, time.time())
+        else:
+            timestamps = np.asarray(timestamps, dtype=float)
+
+        self.store.maybe_evict_idle(timestamps.max())
+        for attempt in range(self.COMMIT_ATTEMPTS):
+            codes, rows = self._score_batch(user_ids, amounts, timestamps, fast)
+            # A shared store refuses the commit if another scorer updated one of the users meanwhile
+            if self.commit(rows, attempt):
+                break
+
+        # 5. Decision (same plan order as analyze)
+        verdicts = [self.plan.verdicts[code] for code in codes.tolist()]
+        if self.journal is not None:
+            self.journal.append(user_ids, amounts, timestamps, tx_ids, verdicts)
+        return verdicts
+
+    def commit(self, rows, attempt):
+        """store.commit(), forced on the last attempt (last writer wins rather than dropping the events)"""
+        force = attempt == self.COMMIT_ATTEMPTS - 1
+        if force:
+            log.warning(f" ⚠️ Profiles of {len(rows)} users still contended after {attempt} retries, overwriting")
+        return self.store.commit(rows, force=force)
+
+    def _score_batch(self, user_ids, amounts, timestamps, fast):
+        """Rules and profile updates of one batch on freshly read rows; returns (verdict codes, rows)"""
+        n = len(amounts)
+        store = self.store
+        history_size = store.history_size
+
+        # 1. Group events by user (dict keys keep the exact same user_id semantics as analyze)
+        index = {}
+        group = np.fromiter((index.setdefault(u, len(index)) for u in user_ids), dtype=np.intp, count=n)
+        rows = store.rows_for(list(index))
+        order = np.argsort(group, kind='stable')  # events sorted by user, arrival order within a user
+        batch_len = np.bincount(group, minlength=len(rows))
+        # Event time is kept non-decreasing per user (same clamp as analyze)
+        timestamps = self._running_max(store.last_seen[rows], order, batch_len, timestamps)
+
+        # 2. Lay out every user's [stored history..., batch events...] back to back in flat arrays
+        hist_len = store.count[rows].astype(np.intp)
+        seg_len = hist_len + batch_len
+        seg_start = np.cumsum(seg_len) - seg_len
+        offset = np.arange(seg_len.sum()) - np.repeat(seg_start, seg_len)
+        is_hist = offset < np.repeat(hist_len, seg_len)
+
+        # Stored history is gathered straight out of the ring buffers, oldest first
+        hist_rows = np.repeat(rows, hist_len)
+        hist_slots = (np.repeat(store.head[rows] - hist_len, hist_len) + offset[is_hist]) % history_size
+        flat_amounts = np.empty(len(offset))
+        flat_times = np.empty(len(offset))
+        flat_amounts[is_hist] = store.amounts[hist_rows, hist_slots]
+        flat_times[is_hist] = store.timestamps[hist_rows, hist_slots]
+        flat_amounts[~is_hist] = amounts[order]
+        flat_times[~is_hist] = timestamps[order]
+
+        position = np.empty(n, dtype=np.intp)
+        position[order] = np.flatnonzero(~is_hist)
+        window_len = np.minimum(position - seg_start[group], history_size)
+
+        ewm_before, ewm_mean, ewm_var = self._ewm_batch(store.ewm_mean[rows], store.ewm_var[rows], hist_len, order, batch_len, amounts)
+
+        # 3. Rules, in plan order, each over the events no earlier rule rejected
+        last = order[np.cumsum(batch_len) - 1]
+        batch = BatchView(store=store, rows=rows, history_size=history_size, amounts=amounts, timestamps=timestamps,
+                          flat_amounts=flat_amounts, flat_times=flat_times, position=position,
+                          window_len=window_len, ewm_before=ewm_before, last=last)
+        codes = self.plan.evaluate_batch(self, batch, fast, self.FAST_PATH_MAX_COST)
+
+        # 4. Update Profiles: each user's final window is written back into its ring buffer
+        final_len = np.minimum(seg_len, history_size)
+        ends = seg_start + seg_len
+        final_mean, final_var = self._window_stats(flat_amounts, ends, final_len, 1)
+        updates = store.updates[rows] + batch_len
+        back = np.arange(-history_size, 0)
+        for lo in range(0, len(rows), self.BATCH_CHUNK):
+            chunk = slice(lo, lo + self.BATCH_CHUNK)
+            window = np.maximum(ends[chunk, None] + back, 0)
+            # Entry with absolute index i goes to slot i % history_size (keeps head == updates % history_size)
+            slots = (updates[chunk, None] + np.arange(history_size)) % history_size
+            store.amounts[rows[chunk, None], slots] = flat_amounts[window]
+            store.timestamps[rows[chunk, None], slots] = flat_times[window]
+        store.head[rows] = updates % history_size
+        store.count[rows] = final_len
+        store.mean[rows] = final_mean
+        store.m2[rows] = final_var * final_len
+        store.ewm_mean[rows] = ewm_mean
+        store.ewm_var[rows] = ewm_var
+        store.updates[rows] = updates
+        store.last_seen[rows] = timestamps[last]
+        self.plan.commit_batch(self, batch)
+        return codes, rows
+
+    def _window_stats(self, flat_amounts, ends, lengths, min_length):
+        """Mean/variance of the windows flat_amounts[end - length:end] (NaN where length < min_length)"""
+        avg = np.full(len(ends), np.nan)
+        var = np.full(len(ends), np.nan)
+        # Same-length windows are gathered into one 2D block and reduced together
+        for length in np.unique(lengths[lengths >= min_length]):
+            rows = np.flatnonzero(lengths == length)
+            for lo in range(0, len(rows), self.BATCH_CHUNK):
+                chunk = rows[lo:lo + self.BATCH_CHUNK]
+                window = flat_amounts[ends[chunk, None] + np.arange(-length, 0)]
+                avg[chunk] = np.mean(window, axis=1)
+                var[chunk] = np.var(window, axis=1)
+        return avg, var
+
+    def _running_max(self, start, order, batch_len, values):
+        """Per-user running maximum of `values` in arrival order, seeded with `start` (vectorized across users)"""
+        current = start.copy()
+        result = np.empty(len(values))
+        first = np.cumsum(batch_len) - batch_len
+        for rank in range(int(batch_len.max())):
+            users = np.flatnonzero(batch_len > rank)
+            events = order[first[users] + rank]
+            current[users] = np.maximum(current[users], values[events])
+            result[events] = current[users]
+        return result
+
+    def _ewm_batch(self, mean, var, hist_len, order, batch_len, amounts):
+        """Runs the EWM recurrence for a batch, one step per event rank and vectorized across users.
+
+        Returns the (mean, var) seen by each event before it is recorded, plus the final per-user state.
+        """
+        before_mean = np.empty(len(amounts))
+        before_var = np.empty(len(amounts))
+        first = np.cumsum(batch_len) - batch_len
+        for rank in range(int(batch_len.max())):
+            users = np.flatnonzero(batch_len > rank)
+            events = order[first[users] + rank]
+            before_mean[events] = mean[users]
+            before_var[events] = var[users]
+
+            x = amounts[events]
+            delta = x - mean[users]
+            increment = self.EWM_ALPHA * delta
+            fresh = (hist_len[users] + rank) == 0
+            mean[users] = np.where(fresh, x, mean[users] + increment)
+            var[users] = np.where(fresh, 0.0, (1 - self.EWM_ALPHA) * (var[users] + delta * increment))
+        return (before_mean, before_var), mean, var
 
 engine = RiskEngine()
+metrics_engine = engine  # scorer behind the rule and profile metrics (a PartitionWorker registers its own)
 
 # --- INFRASTRUCTURE ---
 
@@ -109,50 +378,464 @@ def connect_rabbitmq():
             connection = pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST))
             channel = connection.channel()
             channel.queue_declare(queue=QUEUE_NAME, durable=True)
-            print(f"✅ Connected to RabbitMQ at {RABBITMQ_HOST}")
+            log.info(f"✅ Connected to RabbitMQ at {RABBITMQ_HOST}")
             return channel
         except Exception as e:
-            print(f"❌ Connection to {RABBITMQ_HOST} failed: {e}. Retrying in 5s...")
+            log.error(f"❌ Connection to {RABBITMQ_HOST} failed: {e}. Retrying in 5s...")
             time.sleep(5)
 
-def process_transaction(ch, method, properties, body):
+# --- SCORING COST MODEL ---
+
+def burn_cpu(seconds):
+    """Keeps one core busy for the given time, like an in-process model would"""
+    deadline = time.perf_counter() + seconds
+    result, i = 0.0, 0
+    while time.perf_counter() < deadline:
+        for _ in range(1000):
+            result += math.sqrt(i)
+            i += 1
+    return result
+
+COST_MODELS = {
+    'sleep': time.sleep,
+    'cpu': burn_cpu,
+    'none': lambda seconds: None,
+}
+
+@lru_cache(maxsize=None)
+def load_cost_model(name):
+    """A built-in cost model, or any callable(seconds) given as 'module:function'"""
+    if name in COST_MODELS:
+        return COST_MODELS[name]
+    module, _, function = name.partition(':')
+    if not function:
+        raise ValueError(f"Unknown scoring cost model {name!r}: use {', '.join(COST_MODELS)} or 'module:function'")
+    return getattr(importlib.import_module(module), function)
+
+def simulate_scoring_cost(events, parallelism=1):
+    """Artificial Processing Delay (Simulate complex computation): PROCESSING_DELAY per call plus a per-event cost.
+
+    With parallelism > 1 the events are split over that many concurrent calls, like fanning a batch out
+    to several model replicas (this only shortens I/O-bound cost models such as 'sleep').
+    """
+    calls = max(1, min(parallelism, events))
+    if calls == 1:
+        seconds = PROCESSING_DELAY + events * SCORING_COST_PER_EVENT
+        if seconds > 0:
+            load_cost_model(SCORING_COST)(seconds)
+        return
+    shares = [events // calls + (i < events % calls) for i in range(calls)]
+    list(scoring_pool(SCORING_PARALLELISM).map(simulate_scoring_cost, shares))
+
+@lru_cache(maxsize=None)
+def scoring_pool(workers):
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='scoring')
+
+def new_ledger_client():
+    """Ledger callback client on the CALLBACK_OUTBOX of this process (no file is opened before it starts)"""
+    return LedgerClient(LEDGER_URL, bulk_url=LEDGER_BULK_URL or None, workers=CALLBACK_WORKERS,
+                        outbox=Outbox(CALLBACK_OUTBOX))
+
+# supervisor.py rebuilds it in each worker process once CALLBACK_OUTBOX points at the worker's own file
+ledger = new_ledger_client()
+
+# Set by SIGTERM/SIGINT: consumers finish the message or batch in hand, then stop
+shutdown = threading.Event()
+
+# Optional multiprocessing.Value shared with supervisor.py, which reports aggregate throughput
+events_processed = None
+
+# ProfileSnapshots of the engine's store, when PROFILE_SNAPSHOT_DIR is set
+profile_snapshots = None
+
+def open_snapshots(scorer, directory=None):
+    """Warm restart: maps the latest profile snapshot, replays the journal after it, then keeps snapshotting"""
+    directory = directory or PROFILE_SNAPSHOT_DIR
+    if not directory or PROFILE_BACKEND != 'memory':
+        return None  # the redis backend already outlives the pod
+    snapshots = ProfileSnapshots(directory, SNAPSHOT_INTERVAL)
+    info = snapshots.restore(scorer)
+    log.info(f" [*] Profiles ready in {info['seconds'] * 1000:.0f} ms ({info['users']} users mapped, "
+          f"{info['replayed_events']} events replayed)")
+    # Replayed events may also be redelivered (never acked): answer those from the cache, not the profiles
+    if verdict_cache is not None and info['verdicts']:
+        tx_ids, verdicts = zip(*info['verdicts'])
+        verdict_cache.put_missing(tx_ids, verdicts)
+    return snapshots
+
+# Adaptive mode: Backpressure controller and DegradedLog of fast-path verdicts (see backpressure.py)
+backpressure = None
+degraded_log = None
+
+def open_backpressure():
+    global backpressure, degraded_log
+    backpressure = Backpressure(BATCH_SIZE, MAX_BATCH_SIZE, SCORING_PARALLELISM, BACKLOG_DEPTH, VERDICT_SLO,
+                                FAST_PATH_MAX_AMOUNT, resize_prefetch=not PREFETCH_COUNT)
+    degraded_log = DegradedLog(DEGRADED_LOG)
+
+def close_backpressure():
+    global backpressure, degraded_log
+    if degraded_log is not None:
+        degraded_log.close()
+    backpressure = degraded_log = None
+
+def record_degraded(events, verdicts, fast):
+    """Fast-path verdicts go to the degraded log before the batch is acked, so none escapes re-scoring"""
+    index = np.flatnonzero(fast)
+    DEGRADED.inc(len(index))
+    if degraded_log is not None:
+        degraded_log.append([events.transaction_ids[i] for i in index], [events.user_ids[i] for i in index],
+                            events.amounts[index], events.timestamps[index], [verdicts[i] for i in index],
+                            engine.plan.skipped(engine.FAST_PATH_MAX_COST), backpressure.age)
+
+def maybe_snapshot():
+    if profile_snapshots is not None:
+        profile_snapshots.maybe_snapshot(engine)
+
+# --- METRICS (see metrics.py) ---
+DECISIONS = REGISTRY.counter('fraud_engine_decisions_total', "Verdicts by status and reason.", labels=('status', 'reason'))
+MALFORMED = REGISTRY.counter('fraud_engine_malformed_messages_total', "Queue messages that could not be decoded.")
+REQUEUED = REGISTRY.counter('fraud_engine_requeued_messages_total',
+                            "Deliveries handed back to RabbitMQ because their verdicts could not be queued.")
+QUEUE_TO_VERDICT = REGISTRY.histogram('fraud_engine_queue_to_verdict_seconds',
+                                      "Time from the event's timestamp (published by the ledger) to its verdict.")
+SCORING_SECONDS = REGISTRY.histogram('fraud_engine_scoring_seconds',
+                                     "RiskEngine time per call: one event (single) or one micro-batch (batch).",
+                                     labels=('mode',))
+BATCH_EVENTS = REGISTRY.histogram('fraud_engine_batch_events', "Events per scored micro-batch.",
+                                  buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500))
+QUEUE_LAG = REGISTRY.gauge('fraud_engine_queue_lag_seconds',
+                           "Smoothed queue-to-verdict time of recent events (worst worker).", merge='max')
+QUEUE_LAG_SMOOTHING = 0.2
+DEGRADED = REGISTRY.counter('fraud_engine_degraded_decisions_total',
+                            "Verdicts decided on the fast path (recorded in DEGRADED_LOG for re-scoring).")
+REGISTRY.gauge('fraud_engine_backpressure_level', "Adaptive mode level: 0 normal, 1 backlog, 2 shedding.",
+               function=lambda: backpressure.level if backpressure is not None else 0, merge='max')
+REGISTRY.gauge('fraud_engine_batch_size', "Current micro-batch size limit.",
+               function=lambda: backpressure.batch_size if backpressure is not None else BATCH_SIZE, merge='max')
+REGISTRY.gauge('fraud_engine_queue_depth', "Messages waiting in the queue at the last poll (adaptive mode).",
+               function=lambda: backpressure.depth if backpressure is not None else 0, merge='max')
+
+def rule_counter(key):
+    return lambda: {(name,): stats[key] for name, stats in metrics_engine.rule_stats().items()}
+
+REGISTRY.counter('fraud_engine_rule_evaluations_total', "Events each rule was evaluated on.",
+                 labels=('rule',), function=rule_counter('calls'))
+REGISTRY.counter('fraud_engine_rule_hits_total', "Events each rule rejected.", labels=('rule',), function=rule_counter('hits'))
+REGISTRY.counter('fraud_engine_rule_seconds_total', "Time spent evaluating each rule.", labels=('rule',),
+                 function=rule_counter('seconds'))
+REGISTRY.gauge('fraud_engine_profiles', "User profiles held in memory.", function=lambda: len(metrics_engine.store))
+REGISTRY.gauge('fraud_engine_profile_capacity', "Preallocated profile rows.", function=lambda: metrics_engine.store.capacity)
+REGISTRY.gauge('fraud_engine_profile_column_bytes', "Bytes of preallocated profile columns.",
+               function=lambda: sum(getattr(metrics_engine.store, name).nbytes for name in PROFILE_COLUMNS))
+REGISTRY.counter('fraud_engine_profile_commit_conflicts_total',
+                 "Shared-store commits refused because another scorer updated the same users (batch scored again).",
+                 function=lambda: getattr(metrics_engine.store, 'conflicts', 0))
+REGISTRY.counter('fraud_engine_ledger_updates_delivered_total', "Verdicts delivered to the ledger.",
+                 function=lambda: ledger.delivered)
+REGISTRY.counter('fraud_engine_ledger_retries_total', "Failed ledger callbacks that were retried.",
+                 function=lambda: ledger.retries)
+REGISTRY.counter('fraud_engine_ledger_updates_dropped_total', "Verdicts the ledger refused (4xx).",
+                 function=lambda: ledger.dropped)
+REGISTRY.gauge('fraud_engine_ledger_outbox_pending', "Verdicts queued in the outbox but not delivered yet.",
+               function=lambda: len(ledger.outbox.pending))
+REGISTRY.gauge('fraud_engine_verdict_cache_entries', "Transactions remembered by the verdict cache.",
+               function=lambda: len(verdict_cache) if verdict_cache is not None else 0)
+REGISTRY.gauge('fraud_engine_resident_memory_bytes', "Resident set size of the consumer process.",
+               function=lambda: resident_memory())
+
+def resident_memory():
+    """Current RSS in bytes (Linux), falling back to the peak RSS"""
     try:
-        event = json.loads(body)
-        tx_id = event.get('transactionId')
-        user_id = event.get('senderId')
-        amount = float(event.get('amount'))
-        
-        print(f" [>] Analyzing Tx {tx_id}: User {user_id} -> ${amount}...")
-        
-        # Artificial Processing Delay (Simulate complex computation)
-        time.sleep(0.5) 
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
 
-        # Run the Risk Engine
-        status, reason = engine.analyze(user_id, amount)
-        
-        if status == "REJECTED":
-            print(f" 🛑 BLOCKED: {reason}")
+queue_lag = None
+
+def record_decisions(timestamps, verdicts):
+    """Decision counters plus queue-to-verdict latency of events scored just now"""
+    global queue_lag
+    for (status, reason), count in Counter(verdicts).items():
+        DECISIONS.inc(count, (status, reason))
+    lags = time.time() - np.asarray(timestamps, dtype=float)
+    QUEUE_TO_VERDICT.observe_many(lags)
+    lag = float(lags.mean())
+    queue_lag = lag if queue_lag is None else queue_lag + QUEUE_LAG_SMOOTHING * (lag - queue_lag)
+    QUEUE_LAG.set(queue_lag)
+
+def record_decision(timestamp, status, reason):
+    """record_decisions() for the one event of single mode, without the array round trip"""
+    global queue_lag
+    DECISIONS.inc(1, (status, reason))
+    lag = time.time() - timestamp
+    QUEUE_TO_VERDICT.observe(lag)
+    queue_lag = lag if queue_lag is None else queue_lag + QUEUE_LAG_SMOOTHING * (lag - queue_lag)
+    QUEUE_LAG.set(queue_lag)
+
+def count_processed(count):
+    if events_processed is not None and count:
+        with events_processed.get_lock():
+            events_processed.value += count
+
+def post_verdicts(ch, delivery_tag, updates, multiple=False, remember=None):
+    """Callback to Ledger with final statuses: acks only once they are durably queued, otherwise requeues.
+
+    remember(queued) caches the verdicts before the ack or nack is sent, so a redelivery after a
+    dropped channel is answered from the cache. Returns True once the updates are queued.
+    """
+    try:
+        ledger.enqueue(updates)
+        queued = True
+    except OSError as e:
+        log.error(f" ❌ Cannot queue Ledger updates, requeueing: {e}")
+        queued = False
+    if remember is not None:
+        remember(queued)
+    if not queued:
+        REQUEUED.inc()
+        ch.basic_nack(delivery_tag=delivery_tag, multiple=multiple, requeue=True)
+        return False
+    ch.basic_ack(delivery_tag=delivery_tag, multiple=multiple)
+    count_processed(len(updates))
+    return True
+
+def cached_verdicts(tx_ids):
+    """(cached, fresh) split of a batch by the verdict cache; without a cache every event is fresh"""
+    if verdict_cache is None:
+        return {}, list(range(len(tx_ids)))
+    return verdict_cache.lookup(tx_ids)
+
+def unqueued_updates(tx_ids, cached):
+    """Ledger updates of cached verdicts that never made it to the outbox (the others were already sent)"""
+    return [(tx_ids[i], verdict[0]) for i, (verdict, queued) in sorted(cached.items())
+            if verdict != 'repeat' and not queued]
+
+def remember_verdicts(tx_ids, verdicts, queued=False):
+    if verdict_cache is not None:
+        verdict_cache.put(tx_ids, verdicts, queued=queued)
+
+def mark_queued(tx_ids):
+    if verdict_cache is not None:
+        verdict_cache.mark_queued(tx_ids)
+
+def remember_outcome(tx_ids, verdicts, cached_ids, queued):
+    """One cache update per message: the new verdicts, and the cached ones that are now in the outbox"""
+    if tx_ids:
+        remember_verdicts(tx_ids, verdicts, queued)
+    if queued and cached_ids:
+        mark_queued(cached_ids)
+
+def process_transaction(ch, method, properties, body):
+    updates = []
+    scored_ids, verdicts, cached_updates = [], [], 0
+    try:
+        # One JSON event, or any number of them packed in a binary message (see wire.py)
+        if is_binary(properties):
+            events = decode_batch([(method, properties, body)])
+            if events.errors:
+                raise events.errors[0][1]
+            events, tx_ids = list(events), events.transaction_ids
         else:
-            print(f" ✅ VERIFIED")
+            events = [decode_event(body)]
+            tx_ids = [events[0][0]]
 
-        # Callback to Ledger
-        payload = {"transactionId": str(tx_id), "status": status}
-        try:
-            requests.post(LEDGER_URL, json=payload, timeout=5)
-        except Exception as api_err:
-            print(f" ⚠️ Failed to update Ledger: {api_err}")
+        # Redeliveries already decided are not scored again (see verdicts.py)
+        cached, fresh = cached_verdicts(tx_ids)
+        updates.extend(unqueued_updates(tx_ids, cached))
+        cached_updates = len(updates)
+
+        for tx_id, user_id, amount, timestamp in ([events[i] for i in fresh] if cached else events):
+            if log.isEnabledFor(logging.DEBUG) and sampled():
+                log.debug(f" [>] Analyzing Tx {tx_id}: User {user_id} -> ${amount}...")
+            
+            simulate_scoring_cost(1)
+
+            # Run the Risk Engine
+            start = time.perf_counter()
+            status, reason = engine.analyze(user_id, amount, timestamp, tx_id)
+            SCORING_SECONDS.observe(time.perf_counter() - start, ('single',))
+            record_decision(timestamp, status, reason)
+            scored_ids.append(tx_id)
+            verdicts.append((status, reason))
+            
+            if status == "REJECTED" and sampled():
+                log.info(f" 🛑 BLOCKED: {reason}", extra=fields(transactionId=tx_id, userId=user_id, amount=amount,
+                                                                 status=status, reason=reason))
+            elif log.isEnabledFor(logging.DEBUG) and sampled():
+                log.debug(f" ✅ VERIFIED", extra=fields(transactionId=tx_id, userId=user_id, status=status))
+
+            updates.append((tx_id, status))
 
     except Exception as e:
-        print(f" ❌ Error processing message: {e}")
+        MALFORMED.inc()
+        log.warning(f" ❌ Error processing message: {e}")
 
-    ch.basic_ack(delivery_tag=method.delivery_tag)
+    post_verdicts(ch, method.delivery_tag, updates,
+                  remember=partial(remember_outcome, scored_ids, verdicts,
+                                   [tx_id for tx_id, _ in updates[:cached_updates]]))
+    maybe_snapshot()
 
-if __name__ == "__main__":
-    print(" [*] Starting High-Frequency Fraud Detection Engine...")
-    # Delay for sidecars to start up
-    time.sleep(5)
+def process_batch(ch, messages, scorer=None):
+    """Batch Mode: Score a list of (method, properties, body) messages together, then ack them all at once"""
+    scorer = scorer or engine
+    updates = []
+    # Straight into column arrays, JSON and binary messages alike
+    events = decode_batch(messages)
+    for _, e in events.errors:
+        MALFORMED.inc()
+        log.warning(f" ❌ Error processing message: {e}")
+
+    # Redeliveries already decided are not scored again (see verdicts.py)
+    cached, fresh = cached_verdicts(events.transaction_ids)
+    updates.extend(unqueued_updates(events.transaction_ids, cached))
+    cached_updates = len(updates)
+    if cached:
+        log.debug(f" [=] {len(cached)} redelivered transactions answered from the verdict cache")
+    scored = events.take(fresh) if cached else events
+
+    if len(scored):
+        log.debug(f" [>] Analyzing batch of {len(scored)} transactions...")
+        fast, parallelism = None, 1
+        if backpressure is not None and scorer is engine:
+            backpressure.observe(scored.timestamps)
+            fast, parallelism = backpressure.fast_path(scored.amounts), backpressure.parallelism
+
+        # The fixed part of the simulated computation is paid once per batch instead of once per message,
+        # and not at all by fast-path events
+        modeled = len(scored) - (int(fast.sum()) if fast is not None else 0)
+        if modeled:
+            simulate_scoring_cost(modeled, parallelism)
+
+        start = time.perf_counter()
+        verdicts = scorer.analyze_batch(scored.user_ids, scored.amounts, scored.timestamps, fast,
+                                        scored.transaction_ids)
+        SCORING_SECONDS.observe(time.perf_counter() - start, ('batch',))
+        BATCH_EVENTS.observe(len(scored))
+        record_decisions(scored.timestamps, verdicts)
+        if fast is not None and fast.any():
+            record_degraded(scored, verdicts, fast)
+        rejected = 0
+        for tx_id, user_id, (status, reason) in zip(scored.transaction_ids, scored.user_ids, verdicts):
+            if status == "REJECTED":
+                rejected += 1
+                if sampled():
+                    log.info(f" 🛑 BLOCKED Tx {tx_id}: {reason}",
+                             extra=fields(transactionId=tx_id, userId=user_id, status=status, reason=reason))
+            updates.append((tx_id, status))
+        log.debug(f" ✅ Batch done: {len(scored) - rejected} verified, {rejected} blocked",
+                  extra=fields(events=len(scored), rejected=rejected))
+
+    # Acking the last delivery tag with multiple=True acks every earlier message of the batch too
+    post_verdicts(ch, messages[-1][0].delivery_tag, updates, multiple=True,
+                  remember=partial(remember_outcome, scored.transaction_ids, verdicts if len(scored) else [],
+                                   [tx_id for tx_id, _ in updates[:cached_updates]]))
+    if scorer is engine:
+        maybe_snapshot()
+
+def consume_batches(channel, queue=QUEUE_NAME, handler=process_batch):
+    """Batch Mode: Collects up to BATCH_SIZE messages, waiting at most BATCH_LINGER seconds for a batch to fill"""
+    batch = []
+    deadline = 0
+    for method, properties, body in channel.consume(queue, inactivity_timeout=BATCH_LINGER):
+        if method is not None:
+            if not batch:
+                deadline = time.monotonic() + BATCH_LINGER
+            batch.append((method, properties, body))
+        size = backpressure.batch_size if backpressure is not None else BATCH_SIZE
+        if batch and (method is None or len(batch) >= size or shutdown.is_set()
+                      or time.monotonic() >= deadline):
+            handler(channel, batch)
+            batch = []
+        if backpressure is not None:
+            backpressure.adjust(channel, queue)
+        if shutdown.is_set():
+            # Hands the prefetched but unprocessed messages back to the queue
+            channel.cancel()
+            break
+
+def install_shutdown_handler(channel, batches=None):
+    """SIGTERM (pod stop) / SIGINT: finish the in-flight message or batch, ack it, then stop consuming"""
+    if batches is None:
+        batches = CONSUMER_MODE in ('batch', 'adaptive')
+    def handle(signum, frame):
+        log.info(f" [*] Received {signal.Signals(signum).name}, shutting down after the current work...")
+        shutdown.set()
+        if not batches:
+            # consume_batches polls the flag itself; start_consuming has to be told from inside its loop
+            channel.connection.add_callback_threadsafe(channel.stop_consuming)
+    signal.signal(signal.SIGTERM, handle)
+    signal.signal(signal.SIGINT, handle)
+
+def open_verdict_cache(path=None):
+    """Swaps the in-memory verdict cache for one persisted at VERDICT_CACHE_PATH (if set)"""
+    global verdict_cache
+    path = path or VERDICT_CACHE_PATH
+    if path and VERDICT_CACHE_SIZE > 0:
+        verdict_cache = new_verdict_cache(path)
+        log.info(f" [*] Verdict cache: {len(verdict_cache)} recent verdicts reloaded from {path}")
+
+def close_verdict_cache():
+    if verdict_cache is not None:
+        verdict_cache.close()
+
+def close_snapshots():
+    global profile_snapshots
+    if profile_snapshots is not None:
+        profile_snapshots.close(engine)
+        profile_snapshots = None
+
+def run_consumer():
+    """Consumes until shutdown, then delivers (or keeps in the outbox) the pending Ledger updates"""
+    global profile_snapshots
+    open_verdict_cache()  # first: the journal replay adds to it
+    profile_snapshots = open_snapshots(engine)
     channel = connect_rabbitmq()
-    channel.basic_qos(prefetch_count=1)
-    channel.basic_consume(queue=QUEUE_NAME, on_message_callback=process_transaction)
-    print(' [*] Engine Active. Waiting for stream...')
-    channel.start_consuming()
\ No newline at end of file
+    install_shutdown_handler(channel)
+    if CONSUMER_MODE == 'batch':
+        # The prefetch window must cover at least one full batch, otherwise batches never fill up
+        channel.basic_qos(prefetch_count=PREFETCH_COUNT or BATCH_SIZE * 2)
+        log.info(f' [*] Engine Active (batch mode, up to {BATCH_SIZE} tx / {BATCH_LINGER}s). Waiting for stream...')
+        try:
+            consume_batches(channel)
+        finally:
+            ledger.close()
+            close_snapshots()
+            close_verdict_cache()
+    elif CONSUMER_MODE == 'adaptive':
+        # Batch size, prefetch window and scoring parallelism follow the backlog (see backpressure.py)
+        open_backpressure()
+        # Upper bound for the consumer, set before it starts; backpressure narrows it channel-wide
+        channel.basic_qos(prefetch_count=PREFETCH_COUNT or MAX_BATCH_SIZE * 2)
+        log.info(f' [*] Engine Active (adaptive mode, {BATCH_SIZE}-{MAX_BATCH_SIZE} tx per batch, '
+                 f'verdict SLO {VERDICT_SLO:g}s). Waiting for stream...')
+        try:
+            consume_batches(channel)
+        finally:
+            ledger.close()
+            close_snapshots()
+            close_verdict_cache()
+            close_backpressure()
+    else:
+        channel.basic_qos(prefetch_count=PREFETCH_COUNT or 1)
+        channel.basic_consume(queue=QUEUE_NAME, on_message_callback=process_transaction)
+        log.info(' [*] Engine Active. Waiting for stream...')
+        try:
+            channel.start_consuming()
+        finally:
+            ledger.close()
+            close_snapshots()
+            close_verdict_cache()
+    channel.connection.close()
+    log.info(" [*] Engine stopped.")
+
+if __name__ == "__main__":
+    logs.configure()
+    if METRICS_PORT:
+        metrics.serve(METRICS_PORT, {'/metrics': (REGISTRY.render, metrics.PROMETHEUS_TEXT)})
+        log.info(f" [*] Metrics on :{METRICS_PORT}/metrics")
+    log.info(" [*] Starting High-Frequency Fraud Detection Engine...")
+    # Optional delay for sidecars to start up
+    time.sleep(STARTUP_DELAY)
+    run_consumer()
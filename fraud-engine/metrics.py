@@ -0,0 +1,269 @@
+import bisect
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+# --- METRICS ---
+# Prometheus-style counters, gauges and histograms kept in-process (no client library needed):
+#   EVENTS = REGISTRY.counter('fraud_engine_x_total', "Help text.", labels=('status',))
+#   EVENTS.inc(1, ('COMPLETED',))
+# Instruments can also be backed by a function read at scrape time, so numbers the engine
+# already keeps (rule counters, profile count...) cost nothing on the hot path.
+#
+# A single process serves REGISTRY.render() itself (serve()). Under supervisor.py every worker
+# process writes its registry state as JSON into METRICS_DIR about once a second (Exporter)
+# and the supervisor merges them into one /metrics page: counters and histograms are summed,
+# gauges summed or maxed depending on what they measure.
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+EXPORT_INTERVAL = 1.0
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=(), function=None, merge='sum'):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.function = function  # () -> value, or {label values tuple: value}
+        self.merge = merge
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def series(self):
+        if self.function is None:
+            with self.lock:
+                return list(self.values.items())
+        value = self.function()
+        return list(value.items()) if isinstance(value, dict) else [((), value)]
+
+    def state(self):
+        return {"type": self.kind, "help": self.help, "labels": list(self.labels), "merge": self.merge,
+                "series": [[list(key), value] for key, value in self.series()]}
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, labels=()):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, labels=()):
+        self.values[labels] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        self.edges = np.asarray(self.buckets)
+
+    def _entry(self, labels):
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0}
+        return entry
+
+    def observe(self, value, labels=()):
+        index = bisect.bisect_left(self.buckets, value)  # first bucket whose upper bound is >= value
+        with self.lock:
+            entry = self.values.get(labels) or self._entry(labels)
+            entry["counts"][index] += 1
+            entry["sum"] += value
+
+    def observe_many(self, values, labels=()):
+        """observe() for an array of values, in one vectorized pass"""
+        values = np.asarray(values, dtype=float)
+        if not len(values):
+            return
+        counts = np.bincount(np.searchsorted(self.edges, values, side='left'), minlength=len(self.buckets) + 1)
+        with self.lock:
+            entry = self._entry(labels)
+            entry["counts"] = [a + b for a, b in zip(entry["counts"], counts.tolist())]
+            entry["sum"] += float(values.sum())
+
+    def series(self):
+        with self.lock:
+            return [(key, {"counts": list(entry["counts"]), "sum": entry["sum"]}) for key, entry in self.values.items()]
+
+    def state(self):
+        return dict(super().state(), buckets=list(self.buckets))
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        # Re-registering a name returns the existing instrument (modules may be imported twice)
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, labels=(), function=None):
+        return self.register(Counter(name, help, labels, function))
+
+    def gauge(self, name, help, labels=(), function=None, merge='sum'):
+        return self.register(Gauge(name, help, labels, function, merge))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def state(self):
+        """JSON-serializable values of every instrument (what workers export)"""
+        states = {}
+        for name, metric in list(self.metrics.items()):
+            try:
+                states[name] = metric.state()
+            except Exception as e:
+                # A broken collector must not take the whole page down
+                states[name] = dict(type=metric.kind, help=metric.help, labels=list(metric.labels), merge=metric.merge,
+                                    series=[], error=str(e))
+        return states
+
+    def render(self):
+        return render([self.state()])
+
+
+REGISTRY = Registry()
+
+
+def merge(states):
+    """Combines the registry states of several processes into one"""
+    merged = {}
+    for state in states:
+        for name, metric in state.items():
+            target = merged.setdefault(name, dict(metric, series={}))
+            for key, value in metric["series"]:
+                key = tuple(key)
+                if key not in target["series"]:
+                    target["series"][key] = value
+                elif metric["type"] == 'histogram':
+                    current = target["series"][key]
+                    target["series"][key] = {"counts": [a + b for a, b in zip(current["counts"], value["counts"])],
+                                             "sum": current["sum"] + value["sum"]}
+                elif metric["type"] == 'gauge' and metric.get("merge") == 'max':
+                    target["series"][key] = max(target["series"][key], value)
+                else:
+                    target["series"][key] += value
+    return merged
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(names, values)] + list(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(states):
+    """Prometheus text exposition format (version 0.0.4) of one or more registry states"""
+    lines = []
+    for name, metric in sorted(merge(states).items()):
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for key, value in sorted(metric["series"].items(), key=lambda item: [str(v) for v in item[0]]):
+            if metric["type"] != 'histogram':
+                lines.append(f"{name}{_labels(metric['labels'], key)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(list(metric["buckets"]) + [float('inf')], value["counts"]):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound}"'
+                lines.append(f"{name}_bucket{_labels(metric['labels'], key, [le])} {cumulative}")
+            lines.append(f"{name}_sum{_labels(metric['labels'], key)} {_number(value['sum'])}")
+            lines.append(f"{name}_count{_labels(metric['labels'], key)} {cumulative}")
+    return ''.join(line + '\n' for line in lines)
+
+
+# --- Multi-process export ---
+
+def write_state(registry, path):
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(registry.state(), f)
+    os.replace(tmp, path)
+
+
+def read_states(directory):
+    """Registry states exported by every worker into `directory` (unreadable files are skipped)"""
+    states = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.json'):
+            try:
+                with open(os.path.join(directory, name), encoding='utf-8') as f:
+                    states.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+    return states
+
+
+class Exporter:
+    """Writes a registry's state to a file every `interval` seconds from a daemon thread"""
+
+    def __init__(self, path, registry=REGISTRY, interval=EXPORT_INTERVAL):
+        self.path = path
+        self.registry = registry
+        self.interval = interval
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='metrics-exporter', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def _run(self):
+        while not self.stopping.wait(self.interval):
+            self.export()
+
+    def export(self):
+        try:
+            write_state(self.registry, self.path)
+        except OSError:
+            pass  # metrics are best effort, scoring is not
+
+    def stop(self):
+        self.stopping.set()
+        self.export()
+
+
+# --- HTTP endpoint ---
+
+def serve(port, routes, host='0.0.0.0'):
+    """Serves {path: (function returning str, content type)} on a daemon thread; returns the server"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            route = routes.get(self.path.split('?', 1)[0])
+            if route is None:
+                self.send_error(404)
+                return
+            function, kind = route
+            body = function().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', kind)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # scrapes every few seconds would drown the engine's own output
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+PROMETHEUS_TEXT = 'text/plain; version=0.0.4'
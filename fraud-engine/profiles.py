@@ -0,0 +1,362 @@
+import sys
+import numpy as np
+
+# --- PROFILE STORE ---
+# Every user owns one row of preallocated NumPy columns instead of a dict of two deques.
+# The last HISTORY_SIZE amounts/timestamps live in per-row ring buffers:
+#   head[row]  = next slot to write, count[row] = number of valid entries (<= HISTORY_SIZE)
+# so the entries of a row, oldest first, are the slots (head - count ... head - 1) % HISTORY_SIZE.
+# head always equals updates % HISTORY_SIZE, so the entry with absolute index i lives in slot i % HISTORY_SIZE.
+
+HISTORY_SIZE = 50
+MAX_VELOCITY_WINDOWS = 4
+
+# name -> (dtype, shape per row)
+PROFILE_COLUMNS = {
+    'amounts': (np.float64, (HISTORY_SIZE,)),
+    'timestamps': (np.float64, (HISTORY_SIZE,)),
+    'head': (np.int32, ()),
+    'count': (np.int32, ()),
+    'mean': (np.float64, ()),       # mean of the window (Welford)
+    'm2': (np.float64, ()),         # sum of squared deviations of the window (Welford)
+    'ewm_mean': (np.float64, ()),   # exponentially weighted mean of all amounts
+    'ewm_var': (np.float64, ()),    # exponentially weighted variance of all amounts
+    'updates': (np.int64, ()),      # transactions recorded since the row was created
+    'last_seen': (np.float64, ()),  # timestamp of the latest transaction (LRU/TTL eviction)
+    'window_start': (np.int64, (MAX_VELOCITY_WINDOWS,)),  # absolute index of the oldest entry inside each velocity window
+}
+
+
+class Profile:
+    """View of one user's row in a ProfileStore (what RiskEngine.get_profile returns)"""
+    __slots__ = ('store', 'row')
+
+    def __init__(self, store, row):
+        self.store = store
+        self.row = row
+
+    def __len__(self):
+        return int(self.store.count[self.row])
+
+    def _slots(self):
+        count = self.store.count[self.row]
+        return (self.store.head[self.row] - count + np.arange(count)) % self.store.history_size
+
+    @property
+    def amounts(self):
+        """Stored amounts, oldest first"""
+        return self.store.amounts[self.row, self._slots()]
+
+    @property
+    def timestamps(self):
+        """Stored timestamps, oldest first"""
+        return self.store.timestamps[self.row, self._slots()]
+
+    def oldest_amount(self):
+        """Amount that the next push() will overwrite once the ring is full"""
+        return self.store.amounts[self.row, self.store.head[self.row]]
+
+    def count_recent(self, window, current_time, length):
+        """Sliding window: stored entries less than `length` seconds old, popping expired ones in amortized O(1)"""
+        store, row = self.store, self.row
+        end = int(store.updates[row])
+        start = max(int(store.window_start[row, window]), end - int(store.count[row]))
+        timestamps = store.timestamps[row]
+        # Timestamps are non-decreasing per user, so expired entries always sit at the front
+        while start < end and (current_time - timestamps[start % store.history_size]) >= length:
+            start += 1
+        store.window_start[row, window] = start
+        return end - start
+
+    def push(self, amount, timestamp):
+        """Writes a transaction into the ring buffer"""
+        store, row = self.store, self.row
+        head = store.head[row]
+        store.amounts[row, head] = amount
+        store.timestamps[row, head] = timestamp
+        store.head[row] = (head + 1) % store.history_size
+        if store.count[row] < store.history_size:
+            store.count[row] += 1
+        store.updates[row] += 1
+        if timestamp > store.last_seen[row]:
+            store.last_seen[row] = timestamp
+
+
+def _column_property(name):
+    def getter(self):
+        return getattr(self.store, name)[self.row]
+
+    def setter(self, value):
+        getattr(self.store, name)[self.row] = value
+
+    return property(getter, setter)
+
+
+for _name in ('mean', 'm2', 'ewm_mean', 'ewm_var', 'updates', 'last_seen'):
+    setattr(Profile, _name, _column_property(_name))
+
+
+class ProfileStore:
+    """Array-backed profile store: user index -> row of preallocated NumPy columns.
+
+    max_users bounds the store (least recently seen users are evicted when it is full),
+    ttl evicts users idle for more than ttl seconds of event time. 0 disables either.
+    """
+
+    def __init__(self, capacity=1024, max_users=0, ttl=0, history_size=HISTORY_SIZE):
+        self.history_size = history_size
+        self.max_users = max_users
+        self.ttl = ttl
+        self.index = {}      # user_id -> row
+        self.users = []      # row -> user_id (None for free rows)
+        self.free = []       # released rows, reused before growing
+        self.capacity = 0
+        self.last_sweep = None
+        # Fixed-size record layout of one row (used to ship rows over the network)
+        self.row_dtype = np.dtype([(name, dtype, (history_size,) if name in ('amounts', 'timestamps') else shape)
+                                   for name, (dtype, shape) in PROFILE_COLUMNS.items()])
+        self._grow(max(1, min(capacity, max_users) if max_users else capacity))
+
+    # --- Allocation ---
+
+    def _grow(self, capacity):
+        for name, (dtype, shape) in PROFILE_COLUMNS.items():
+            if name in ('amounts', 'timestamps'):
+                shape = (self.history_size,)
+            column = np.zeros((capacity,) + shape, dtype=dtype)
+            if self.capacity:
+                column[:self.capacity] = getattr(self, name)
+            setattr(self, name, column)
+        self.capacity = capacity
+
+    def _allocate(self, count, protect=()):
+        """Returns `count` fresh rows, growing or evicting idle users when needed"""
+        rows = [self.free.pop() for _ in range(min(count, len(self.free)))]
+        needed = count - len(rows)
+        if needed:
+            start = len(self.users)
+            limit = self.max_users or float('inf')
+            if start + needed > self.capacity and self.capacity < limit:
+                self._grow(int(min(max(self.capacity * 2, start + needed), limit)))
+            fit = max(0, min(needed, self.capacity - start))
+            rows.extend(range(start, start + fit))
+            self.users.extend([None] * fit)
+            self.last_seen[start:start + fit] = np.inf  # not evictable while being handed out
+            if needed > fit:
+                # Full: evict a slice of idle users at once so the next new users don't rescan the store
+                self.evict_lru(needed - fit, protect, extra=self.capacity // 64)
+                rows.extend(self.free.pop() for _ in range(needed - fit))
+
+        rows = np.asarray(rows, dtype=np.intp)
+        self.reset_rows(rows)
+        return rows
+
+    def reset_rows(self, rows):
+        """Turns rows back into empty profiles"""
+        for name in PROFILE_COLUMNS:
+            getattr(self, name)[rows] = 0
+        self.last_seen[rows] = -np.inf
+
+    def row_for(self, user_id):
+        """Row of a single user, creating an empty profile if needed"""
+        row = self.index.get(user_id)
+        if row is None:
+            row = int(self._allocate(1)[0])
+            self.index[user_id] = row
+            self.users[row] = user_id
+        return row
+
+    def rows_for(self, user_ids):
+        """Rows for a sequence of distinct users, creating empty profiles in bulk"""
+        rows = np.fromiter((self.index.get(u, -1) for u in user_ids), dtype=np.intp, count=len(user_ids))
+        missing = np.flatnonzero(rows < 0)
+        if len(missing):
+            fresh = self._allocate(len(missing), protect=rows[rows >= 0])
+            rows[missing] = fresh
+            for i, row in zip(missing.tolist(), fresh.tolist()):
+                self.index[user_ids[i]] = row
+                self.users[row] = user_ids[i]
+        return rows
+
+    def get_profile(self, user_id):
+        return Profile(self, self.row_for(user_id))
+
+    def history(self, rows):
+        """Ordered, right-aligned (len(rows), history_size) amounts/timestamps plus the valid counts"""
+        slots = (self.head[rows, None] - self.history_size + np.arange(self.history_size)) % self.history_size
+        return self.amounts[rows[:, None], slots], self.timestamps[rows[:, None], slots], self.count[rows]
+
+    def commit(self, rows, force=False):
+        """Called by RiskEngine once rows were updated (nothing to do for an in-memory store).
+
+        Returns False if the rows changed elsewhere since rows_for() read them: the events must then
+        be scored again on fresh rows. force=True writes them regardless.
+        """
+        return True
+
+    # --- Serialization ---
+
+    def pack_rows(self, rows):
+        """Copies rows into a structured array of fixed-size records (row_dtype)"""
+        packed = np.empty(len(rows), dtype=self.row_dtype)
+        for name in PROFILE_COLUMNS:
+            packed[name] = getattr(self, name)[rows]
+        return packed
+
+    def unpack_rows(self, rows, packed):
+        """Overwrites rows with records produced by pack_rows"""
+        for name in PROFILE_COLUMNS:
+            getattr(self, name)[rows] = packed[name]
+
+    def snapshot_state(self):
+        """Point-in-time copy of the columns and the index, safe to write out from another thread"""
+        return {
+            'columns': {name: getattr(self, name).copy() for name in PROFILE_COLUMNS},
+            'users': list(self.users),
+            'free': list(self.free),
+            'last_sweep': self.last_sweep,
+            'history_size': self.history_size,
+        }
+
+    def restore_state(self, columns, users, free, last_sweep=None):
+        """Adopts columns written by snapshot_state (e.g. copy-on-write memmaps) and the index that goes with them"""
+        capacity = len(columns['head'])
+        if columns['amounts'].shape[1:] != (self.history_size,):
+            raise ValueError(f"Snapshot keeps {columns['amounts'].shape[1]} transactions per user, "
+                             f"this store {self.history_size}")
+        if len(users) > capacity:
+            raise ValueError(f"Snapshot lists {len(users)} rows but its columns hold {capacity}")
+        for name in PROFILE_COLUMNS:
+            setattr(self, name, columns[name])
+        self.capacity = capacity
+        self.users = list(users)
+        self.index = {user_id: row for row, user_id in enumerate(self.users) if user_id is not None}
+        self.free = list(free)
+        self.last_sweep = last_sweep
+
+    # --- Eviction ---
+
+    def _release(self, rows):
+        for row in rows:
+            del self.index[self.users[row]]
+            self.users[row] = None
+        self.last_seen[rows] = np.inf  # free rows are never eviction candidates
+        self.free.extend(rows)
+
+    def drop(self, user_ids):
+        """Removes users from the store (e.g. after handing them to another partition)"""
+        self._release([self.index[u] for u in user_ids if u in self.index])
+
+    def evict_lru(self, count, protect=(), extra=0):
+        """Evicts the `count` (plus up to `extra`) least recently seen users, never touching `protect` rows"""
+        last_seen = self.last_seen[:len(self.users)].copy()
+        last_seen[np.asarray(protect, dtype=np.intp)] = np.inf
+        candidates = np.flatnonzero(last_seen != np.inf)
+        if len(candidates) < count:
+            raise MemoryError(f"ProfileStore full: cannot evict {count} of {len(self.index)} users")
+        count = min(count + extra, len(candidates))
+        if count < len(candidates):
+            candidates = candidates[np.argpartition(last_seen[candidates], count - 1)[:count]]
+        self._release(candidates.tolist())
+
+    def evict_idle(self, now):
+        """TTL sweep: drops users with no transaction in the last `ttl` seconds. Returns how many were evicted"""
+        self.last_sweep = now
+        if not self.ttl:
+            return 0
+        idle = np.flatnonzero(self.last_seen[:len(self.users)] < now - self.ttl).tolist()
+        self._release(idle)
+        return len(idle)
+
+    def maybe_evict_idle(self, now):
+        """Runs the TTL sweep at most once every ttl/4 seconds of event time"""
+        if self.ttl and (self.last_sweep is None or now - self.last_sweep >= self.ttl / 4):
+            return self.evict_idle(now)
+        return 0
+
+    # --- Introspection ---
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, user_id):
+        return user_id in self.index
+
+    def memory_usage(self):
+        """Approximate bytes held by the store, so pods can be sized by user count"""
+        columns = sum(getattr(self, name).nbytes for name in PROFILE_COLUMNS)
+        index = sys.getsizeof(self.index) + sys.getsizeof(self.users) + sys.getsizeof(self.free)
+        index += sum(sys.getsizeof(u) for u in self.index)
+        users = len(self.index)
+        return {
+            'users': users,
+            'capacity': self.capacity,
+            'column_bytes': columns,
+            'index_bytes': index,
+            'total_bytes': columns + index,
+            'bytes_per_user': (columns + index) / users if users else 0,
+        }
+
+
+class RemoteProfileStore(ProfileStore):
+    """Shared profile store: rows live in a Redis-protocol server, each replica keeps a local working copy.
+
+    rows_for() WATCHes a whole batch of users and refreshes them with one pipelined MGET; commit()
+    writes them back in one MULTI/SET.../EXEC round-trip. If another replica wrote one of those users
+    in between, EXEC applies nothing and commit() returns False, so RiskEngine scores the batch
+    again on fresh rows: concurrent scorers never overwrite each other's events.
+    """
+
+    def __init__(self, client, capacity=1024, max_users=0, ttl=0, history_size=HISTORY_SIZE, key_prefix='profile:'):
+        # The local copy is only a cache: remote keys expire through Redis (EX ttl) instead of local sweeps
+        super().__init__(capacity=capacity, max_users=max_users, ttl=0, history_size=history_size)
+        self.client = client
+        self.remote_ttl = ttl
+        self.key_prefix = key_prefix
+        self.watched_on = None   # client.connections when the rows were read (WATCH is per connection)
+        self.conflicts = 0       # commits rejected because another replica got there first
+
+    def key(self, user_id):
+        return f"{self.key_prefix}{user_id}"
+
+    def rows_for(self, user_ids):
+        rows = super().rows_for(user_ids)
+        keys = [self.key(u) for u in user_ids]
+        _, values = self.client.pipeline([('WATCH', *keys), ('MGET', *keys)])
+        self.watched_on = self.client.connections
+        found = [i for i, value in enumerate(values) if value is not None]
+        missing = [i for i, value in enumerate(values) if value is None]
+        if found:
+            packed = np.frombuffer(b''.join(values[i] for i in found), dtype=self.row_dtype)
+            self.unpack_rows(rows[found], packed)
+        if missing:
+            self.reset_rows(rows[missing])
+        return rows
+
+    def row_for(self, user_id):
+        return int(self.rows_for([user_id])[0])
+
+    def commit(self, rows, force=False):
+        rows = np.asarray(rows, dtype=np.intp)
+        data = self.pack_rows(rows).tobytes()
+        size = self.row_dtype.itemsize
+        expiry = ('EX', int(self.remote_ttl)) if self.remote_ttl else ()
+        sets = [('SET', self.key(self.users[row]), data[i * size:(i + 1) * size]) + expiry
+                for i, row in enumerate(rows.tolist())]
+        if force:
+            self.client.pipeline([('UNWATCH',)] + sets)
+            return True
+        if self.watched_on != self.client.connections:
+            # Reconnected since the read: the WATCH is gone, read again
+            self.conflicts += 1
+            return False
+        try:
+            replies = self.client.pipeline([('MULTI',)] + sets + [('EXEC',)], retry=False)
+        except (ConnectionError, OSError):
+            # Unknown outcome: the rows are read again (if EXEC did go through, at-least-once like redeliveries)
+            self.conflicts += 1
+            return False
+        if replies[-1] is None:
+            self.conflicts += 1
+            return False
+        return True
@@ -0,0 +1,265 @@
+import socket
+import socketserver
+import threading
+import time
+import argparse
+
+# --- REDIS PROTOCOL (RESP2) ---
+# Just enough of the Redis wire protocol for the shared profile store:
+# a pipelining client, plus a small in-process server that stands in for Redis
+# in tests and local development (python resp.py --port 6379).
+
+
+class RespError(Exception):
+    """Error reply (-ERR ...) sent back by the server"""
+
+
+def encode_command(args):
+    """Encodes one command as a RESP array of bulk strings"""
+    parts = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        if isinstance(arg, str):
+            arg = arg.encode()
+        elif isinstance(arg, (int, float)):
+            arg = str(arg).encode()
+        parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+    return b''.join(parts)
+
+
+def read_reply(stream):
+    """Reads one RESP value from a buffered binary stream"""
+    line = stream.readline()
+    if not line:
+        raise ConnectionError("Connection closed by server")
+    kind, payload = line[:1], line[1:-2]
+    if kind == b'+':
+        return payload.decode()
+    if kind == b'-':
+        return RespError(payload.decode())
+    if kind == b':':
+        return int(payload)
+    if kind == b'$':
+        length = int(payload)
+        if length < 0:
+            return None
+        data = stream.read(length + 2)
+        return data[:-2]
+    if kind == b'*':
+        count = int(payload)
+        if count < 0:
+            return None
+        return [read_reply(stream) for _ in range(count)]
+    raise RespError(f"Unknown reply type {kind!r}")
+
+
+class RespClient:
+    """Minimal Redis client: every pipeline() call is a single network round-trip"""
+
+    def __init__(self, host='localhost', port=6379, timeout=5):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.sock = None
+        self.stream = None
+        self.connections = 0   # connections opened so far: WATCHes do not survive a reconnect
+
+    def connect(self):
+        self.connections += 1
+        self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.stream = self.sock.makefile('rb')
+
+    def close(self):
+        if self.sock is not None:
+            self.stream.close()
+            self.sock.close()
+            self.sock = self.stream = None
+
+    def pipeline(self, commands, retry=True):
+        """Sends all commands at once, then reads all replies. Raises the first error reply.
+
+        With retry=False a broken connection is not retried on a new one (transactions, whose
+        WATCHes were on the old connection).
+        """
+        if not commands:
+            return []
+        payload = b''.join(encode_command(args) for args in commands)
+        for attempt in range(2 if retry else 1):
+            try:
+                if self.sock is None:
+                    self.connect()
+                self.sock.sendall(payload)
+                replies = [read_reply(self.stream) for _ in commands]
+                break
+            except (ConnectionError, OSError):
+                # Reconnect once (e.g. the server restarted), then give up
+                self.close()
+                if attempt or not retry:
+                    raise
+        for reply in replies:
+            if isinstance(reply, RespError):
+                raise reply
+        return replies
+
+    def execute(self, *args):
+        return self.pipeline([args])[0]
+
+
+# --- IN-PROCESS STAND-IN SERVER ---
+
+class _Handler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        # Replies are written one by one: without this, Nagle holds back all but the first of a pipeline
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def handle(self):
+        session = {"watched": {}, "queued": None}  # per connection, like Redis transactions
+        while True:
+            try:
+                command = read_reply(self.rfile)
+            except (ConnectionError, OSError):
+                return
+            try:
+                reply = self.server.dispatch(command, session)
+            except Exception as e:
+                reply = RespError(f"ERR {e}")
+            self.wfile.write(encode_reply(reply))
+
+
+def encode_reply(value):
+    if value is None:
+        return b'$-1\r\n'
+    if isinstance(value, RespError):
+        return b'-%s\r\n' % str(value).encode()
+    if isinstance(value, bool):
+        return b':%d\r\n' % int(value)
+    if isinstance(value, int):
+        return b':%d\r\n' % value
+    if isinstance(value, str):
+        return b'+%s\r\n' % value.encode()
+    if isinstance(value, bytes):
+        return b'$%d\r\n%s\r\n' % (len(value), value)
+    return b'*%d\r\n' % len(value) + b''.join(encode_reply(v) for v in value)
+
+
+class LocalRedisServer(socketserver.ThreadingTCPServer):
+    """Tiny Redis stand-in (PING, GET, SET [EX/PX], MGET, DEL, EXISTS, DBSIZE, FLUSHDB, WATCH/MULTI/EXEC)"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0):
+        super().__init__((host, port), _Handler)
+        self.data = {}
+        self.expires = {}
+        self.versions = {}   # key -> number of writes, checked by EXEC against the WATCHed value
+        self.lock = threading.Lock()
+        self.commands_served = 0
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        """Serves from a background thread (returns self so tests can chain)"""
+        self.thread = threading.Thread(target=self.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def _touch(self, key):
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def _get(self, key):
+        deadline = self.expires.get(key)
+        if deadline is not None and deadline <= time.time():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+            self._touch(key)
+        return self.data.get(key)
+
+    def _version(self, key):
+        self._get(key)  # an expiry counts as a write
+        return self.versions.get(key, 0)
+
+    def dispatch(self, command, session=None):
+        name = command[0].upper()
+        args = command[1:]
+        session = {"watched": {}, "queued": None} if session is None else session
+        with self.lock:
+            self.commands_served += 1
+            if name == b'MULTI':
+                session["queued"] = []
+                return 'OK'
+            if name == b'EXEC':
+                queued, watched = session["queued"], session["watched"]
+                session["queued"], session["watched"] = None, {}
+                if queued is None:
+                    return RespError("ERR EXEC without MULTI")
+                if any(self._version(key) != version for key, version in watched.items()):
+                    return None  # a watched key was written since WATCH: nothing is applied
+                return [self._run(queued_command[0].upper(), queued_command[1:]) for queued_command in queued]
+            if name == b'DISCARD':
+                session["queued"], session["watched"] = None, {}
+                return 'OK'
+            if session["queued"] is not None:
+                session["queued"].append(command)
+                return 'QUEUED'
+            if name == b'WATCH':
+                session["watched"].update((key, self._version(key)) for key in args)
+                return 'OK'
+            if name == b'UNWATCH':
+                session["watched"] = {}
+                return 'OK'
+            return self._run(name, args)
+
+    def _run(self, name, args):
+        if name == b'PING':
+            return 'PONG'
+        if name == b'GET':
+            return self._get(args[0])
+        if name == b'MGET':
+            return [self._get(key) for key in args]
+        if name == b'SET':
+            key, value = args[0], args[1]
+            self.data[key] = value
+            self.expires.pop(key, None)
+            self._touch(key)
+            options = [a.upper() for a in args[2:]]
+            if b'EX' in options:
+                self.expires[key] = time.time() + float(args[2 + options.index(b'EX') + 1])
+            elif b'PX' in options:
+                self.expires[key] = time.time() + float(args[2 + options.index(b'PX') + 1]) / 1000
+            return 'OK'
+        if name == b'DEL':
+            removed = 0
+            for key in args:
+                removed += self.data.pop(key, None) is not None
+                self.expires.pop(key, None)
+                self._touch(key)
+            return removed
+        if name == b'EXISTS':
+            return sum(self._get(key) is not None for key in args)
+        if name == b'DBSIZE':
+            return len(self.data)
+        if name == b'FLUSHDB':
+            for key in self.data:
+                self._touch(key)
+            self.data.clear()
+            self.expires.clear()
+            return 'OK'
+        return RespError(f"ERR unknown command '{name.decode()}'")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Redis-protocol stand-in for the fraud engine")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6379)
+    args = parser.parse_args()
+    server = LocalRedisServer(args.host, args.port)
+    print(f" [*] Local Redis stand-in listening on {args.host}:{server.port}")
+    server.serve_forever()
@@ -0,0 +1,246 @@
+import logging
+import time
+import numpy as np
+from logs import log
+from profiles import HISTORY_SIZE, MAX_VELOCITY_WINDOWS
+
+# --- RULE REGISTRY ---
+# Every fraud rule is a class registered under a name. An engine is configured with a list of
+# rule specs such as {"rule": "structuring", "limit": 10000, "threshold": 0.95}, which
+# compile_rules() turns into a RulePlan: rules ordered by cost (cheap stateless ones first),
+# evaluated until the first one rejects. Profile state is updated by the engine whatever the
+# outcome, so a short-circuited rule never misses history.
+#
+# A rule implements check() for one event and check_batch() for the vectorized batch path;
+# both must agree. Adding a rule = subclass Rule, decorate it with @register_rule, list it in RULES.
+
+RULE_TYPES = {}
+
+
+def register_rule(cls):
+    RULE_TYPES[cls.name] = cls
+    return cls
+
+
+def parse_velocity_limits(spec):
+    """Parses "1:3,10:5" into [(1.0, 3), (10.0, 5)]"""
+    limits = []
+    for part in spec.split(','):
+        window, limit = part.split(':')
+        limits.append((float(window), int(limit)))
+    return limits
+
+
+class Rule:
+    name = None
+    reason = None
+    cost = 0            # evaluation order: lower runs first
+    stateful = False    # reads the user's profile
+
+    def __init__(self, cost=None):
+        if cost is not None:
+            self.cost = cost
+
+    def check(self, engine, profile, amount, current_time):
+        """True if this event must be rejected"""
+        raise NotImplementedError
+
+    def check_batch(self, engine, batch, events):
+        """Boolean mask over `events` (indices into the batch) that must be rejected"""
+        raise NotImplementedError
+
+    def commit_batch(self, engine, batch):
+        """Writes back any per-user rule state once the batch has been decided"""
+
+
+@register_rule
+class StructuringRule(Rule):
+    """Compliance Rule: Detect 'Smurfing' (just under reporting limits)"""
+    name = 'structuring'
+    reason = "Potential Structuring Detected"
+    cost = 0
+
+    def __init__(self, limit=10000, threshold=0.95, cost=None):
+        super().__init__(cost)
+        self.limit = limit
+        self.threshold = threshold  # 95% of limit (e.g. 9500-9999)
+
+    def check(self, engine, profile, amount, current_time):
+        # If amount is between $9500 and $10000
+        if (self.limit * self.threshold) <= amount < self.limit:
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug(f" [!] STRUCTURING ALERT: ${amount} is suspicious")
+            return True
+        return False
+
+    def check_batch(self, engine, batch, events):
+        amounts = batch.amounts[events]
+        return ((self.limit * self.threshold) <= amounts) & (amounts < self.limit)
+
+
+@register_rule
+class VelocityRule(Rule):
+    """HFT Rule: Detect Bot-like speed"""
+    name = 'velocity'
+    reason = "High Frequency Trading Velocity Exceeded"
+    cost = 1
+    stateful = True
+
+    def __init__(self, limits='10:5', cost=None):
+        super().__init__(cost)
+        # "window_seconds:max_tx" pairs, all enforced (default: max 5 tx per 10 seconds)
+        self.limits = parse_velocity_limits(limits) if isinstance(limits, str) else [tuple(l) for l in limits]
+        if len(self.limits) > MAX_VELOCITY_WINDOWS:
+            raise ValueError(f"At most {MAX_VELOCITY_WINDOWS} velocity windows are supported")
+        if any(limit >= HISTORY_SIZE for _, limit in self.limits):
+            raise ValueError(f"Velocity limits must be below the {HISTORY_SIZE} stored transactions per user")
+
+    def check(self, engine, profile, amount, current_time):
+        if len(profile) < 2:
+            return False
+
+        # Count transactions in the last `window` seconds, for every configured window
+        for i, (window, limit) in enumerate(self.limits):
+            recent_tx_count = profile.count_recent(i, current_time, window)
+            if recent_tx_count > limit:
+                if log.isEnabledFor(logging.DEBUG):
+                    log.debug(f" [!] HFT VELOCITY ALERT: {recent_tx_count} tx in {window:g}s")
+                return True
+        return False
+
+    def check_batch(self, engine, batch, events):
+        history_size = batch.history_size
+        back = np.arange(-history_size, 0)
+        # -1 marks events this rule never looked at (an earlier rule already rejected them)
+        batch.recent_counts = np.full((len(self.limits), len(batch.amounts)), -1, dtype=np.intp)
+        for lo in range(0, len(events), engine.BATCH_CHUNK):
+            chunk = events[lo:lo + engine.BATCH_CHUNK]
+            idx = batch.position[chunk, None] + back
+            valid = back >= -batch.window_len[chunk, None]
+            np.maximum(idx, 0, out=idx)
+
+            age = batch.timestamps[chunk, None] - batch.flat_times[idx]
+            for i, (window, _) in enumerate(self.limits):
+                batch.recent_counts[i, chunk] = (valid & (age < window)).sum(axis=1)
+        limits = np.array([limit for _, limit in self.limits])
+        counts = batch.recent_counts[:, events]
+        return (batch.window_len[events] >= 2) & (counts > limits[:, None]).any(axis=0)
+
+    def commit_batch(self, engine, batch):
+        # Velocity windows resume from where each user's last event left them. Users whose last
+        # event was never counted keep their old pointers: count_recent catches up lazily.
+        if getattr(batch, 'recent_counts', None) is None:
+            return
+        counts = batch.recent_counts[:, batch.last]
+        seen = counts[0] >= 0
+        rows = batch.rows[seen]
+        batch.store.window_start[rows, :len(self.limits)] = (batch.store.updates[rows] - 1 - counts[:, seen]).T
+
+
+@register_rule
+class AnomalyRule(Rule):
+    """Statistical Rule: Detect deviations from user's average"""
+    name = 'anomaly'
+    reason = "Statistical Anomaly Detected"
+    cost = 2
+    stateful = True
+
+    def __init__(self, sigma=3.0, min_history=5, cost=None):
+        super().__init__(cost)
+        self.sigma = sigma                # 3-Sigma Rule
+        self.min_history = min_history    # needs at least 5 past amounts
+
+    def check(self, engine, profile, amount, current_time):
+        if len(profile) < self.min_history:
+            return False # Not enough history
+
+        # O(1): running stats are kept up to date by RiskEngine.record()
+        avg, std_dev = engine.profile_stats(profile)
+
+        # If transaction is > Average + 3 Standard Deviations (3-Sigma Rule)
+        if std_dev > 0 and amount > (avg + (self.sigma * std_dev)):
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug(f" [!] ANOMALY ALERT: ${amount} is > {self.sigma:g}-Sigma from Avg ${avg:.2f}")
+            return True
+        return False
+
+    def check_batch(self, engine, batch, events):
+        window_len = batch.window_len[events]
+        if engine.ANOMALY_STATS == 'ewm':
+            avg, var = batch.ewm_before[0][events], batch.ewm_before[1][events]
+        else:
+            avg, var = engine._window_stats(batch.flat_amounts, batch.position[events], window_len, self.min_history)
+        std_dev = np.sqrt(var)
+        return (window_len >= self.min_history) & (std_dev > 0) & (batch.amounts[events] > (avg + (self.sigma * std_dev)))
+
+
+class RulePlan:
+    """Rules in evaluation order, with per-rule call/hit counters and time spent"""
+
+    def __init__(self, rules):
+        # Stable sort: rules of equal cost keep their declared order
+        self.rules = sorted(rules, key=lambda rule: rule.cost)
+        self.verdicts = [("COMPLETED", "Verified")] + [("REJECTED", rule.reason) for rule in self.rules]
+        self.calls = [0] * len(self.rules)
+        self.hits = [0] * len(self.rules)
+        self.seconds = [0.0] * len(self.rules)
+
+    def evaluate(self, engine, profile, amount, current_time):
+        """Index into verdicts of the first rule that rejects the event (0 = none did)"""
+        for i, rule in enumerate(self.rules):
+            start = time.perf_counter()
+            hit = rule.check(engine, profile, amount, current_time)
+            self.seconds[i] += time.perf_counter() - start
+            self.calls[i] += 1
+            if hit:
+                self.hits[i] += 1
+                return i + 1
+        return 0
+
+    def evaluate_batch(self, engine, batch, fast=None, max_cost=None):
+        """evaluate() for a whole batch: each rule only sees events that no earlier rule rejected.
+
+        Events flagged in the `fast` mask are only checked by the rules costing at most `max_cost`.
+        """
+        codes = np.zeros(len(batch.amounts), dtype=np.intp)
+        pending = np.arange(len(batch.amounts))
+        for i, rule in enumerate(self.rules):
+            if fast is not None and rule.cost > max_cost:
+                pending = pending[~fast[pending]]
+            if len(pending) == 0:
+                break
+            start = time.perf_counter()
+            hit = rule.check_batch(engine, batch, pending)
+            self.seconds[i] += time.perf_counter() - start
+            self.calls[i] += len(pending)
+            self.hits[i] += int(hit.sum())
+            codes[pending[hit]] = i + 1
+            pending = pending[~hit]
+        return codes
+
+    def skipped(self, max_cost):
+        """Names of the rules the fast path leaves out"""
+        return [rule.name for rule in self.rules if rule.cost > max_cost]
+
+    def commit_batch(self, engine, batch):
+        for rule in self.rules:
+            rule.commit_batch(engine, batch)
+
+    def stats(self):
+        """{rule name: {"calls", "hits", "seconds"}} in evaluation order"""
+        return {rule.name: {"calls": calls, "hits": hits, "seconds": seconds}
+                for rule, calls, hits, seconds in zip(self.rules, self.calls, self.hits, self.seconds)}
+
+
+def compile_rules(specs):
+    """Builds a RulePlan from [{"rule": name, **config}, ...]"""
+    rules = []
+    for spec in specs:
+        spec = dict(spec)
+        name = spec.pop('rule', None)
+        if name not in RULE_TYPES:
+            raise ValueError(f"Unknown rule {name!r}, expected one of: {', '.join(RULE_TYPES)}")
+        if any(rule.name == name for rule in rules):
+            raise ValueError(f"Rule {name!r} is declared twice")
+        rules.append(RULE_TYPES[name](**spec))
+    return RulePlan(rules)
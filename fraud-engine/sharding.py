@@ -0,0 +1,324 @@
+import bisect
+import hashlib
+import json
+import os
+import socket
+import sys
+import time
+import pika
+import numpy as np
+import main
+from main import RiskEngine, process_batch, consume_batches, connect_rabbitmq, QUEUE_NAME, BATCH_SIZE, PREFETCH_COUNT
+from profiles import ProfileStore
+from wire import is_binary, decode_records, sender_key
+import logs
+import metrics
+from logs import log
+
+# --- SHARDED CONSUMPTION ---
+# The ledger publishes every event to one queue. A single router hashes each event's senderId
+# onto a consistent-hash ring of N partitions and republishes it to 'transaction_events.p<k>'.
+# Exactly one worker consumes each partition queue, so it owns its users' profiles locally
+# (no shared cache) and sees each user's events in order.
+#
+# Rebalancing (N -> M partitions) is a barrier that travels through the queues themselves:
+#   1. the router stops routing and sends a 'rebalance' message to every current partition,
+#   2. each worker, having scored everything before it, ships the profiles of the users it no
+#      longer owns to their new partition queues ('profile_handoff') and confirms,
+#   3. once all workers confirmed, the router switches to the new ring and resumes.
+# Handoffs are therefore queued ahead of any event routed under the new ring.
+#
+# The active partition count is kept as a durable message in 'transaction_events.ring', which
+# the router holds unacked while it runs: a restarted router routes with the ring the workers
+# actually own, not with PARTITION_COUNT (that only seeds the first deployment).
+
+PARTITION_COUNT = int(os.getenv('PARTITION_COUNT', '4'))
+CONTROL_QUEUE = f'{QUEUE_NAME}.control'
+RING_QUEUE = f'{QUEUE_NAME}.ring'
+VIRTUAL_NODES = 64
+HANDOFF_CHUNK = 10000  # profiles per handoff message
+
+
+def partition_queue(partition):
+    return f'{QUEUE_NAME}.p{partition}'
+
+
+def stable_hash(key):
+    """Process-independent 64-bit hash (Python's hash() is salted per process)"""
+    return int.from_bytes(hashlib.md5(str(key).encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent hash ring over partition ids. Growing from N to M partitions moves ~(M-N)/M of the users"""
+
+    def __init__(self, partitions, vnodes=VIRTUAL_NODES):
+        self.partitions = partitions
+        points = sorted((stable_hash(f'partition-{p}#{v}'), p) for p in range(partitions) for v in range(vnodes))
+        self.hashes = [h for h, _ in points]
+        self.owners = [p for _, p in points]
+
+    def partition_for(self, key):
+        i = bisect.bisect(self.hashes, stable_hash(key)) % len(self.hashes)
+        return self.owners[i]
+
+
+def sender_of(body):
+    """Routing key of an event (its senderId, typed like the binary records' so both route alike)"""
+    return sender_key(json.loads(body).get('senderId'))
+
+
+class ShardRouter:
+    """Moves events from the shared queue to their partition queue, keeping per-user order"""
+
+    def __init__(self, channel, partitions=PARTITION_COUNT):
+        self.channel = channel
+        self.ring_state = None  # delivery tag of the RING_QUEUE message describing self.ring
+        self.ring = HashRing(self.load_ring(partitions))
+        self.next_ring = None
+        self.pending = set()
+        self.held = []  # events received while a rebalance is in progress
+        self.reply_queue = None
+        self.declare_partitions(self.ring.partitions)
+
+    def load_ring(self, partitions):
+        """Partition count of the last ring a router switched to, or `partitions` on a fresh deployment"""
+        self.channel.queue_declare(queue=RING_QUEUE, durable=True)
+        latest = None
+        while True:
+            method, _, body = self.channel.basic_get(queue=RING_QUEUE)
+            if method is None:
+                break
+            if latest is not None:
+                # A router died between saving a new ring and dropping the old one: the last one wins
+                self.channel.basic_ack(delivery_tag=latest[0].delivery_tag)
+            latest = (method, body)
+        if latest is None:
+            self.save_ring(partitions)
+            return partitions
+        self.ring_state = latest[0].delivery_tag
+        try:
+            saved = int(json.loads(latest[1])['partitions'])
+        except Exception as e:
+            log.error(f" ❌ Bad ring state, starting with {partitions} partitions: {e}")
+            self.save_ring(partitions)
+            return partitions
+        if saved != partitions:
+            log.warning(f" ⚠️ Keeping the saved ring of {saved} partitions (PARTITION_COUNT={partitions}); "
+                        f"resize with 'sharding.py rebalance'")
+        return saved
+
+    def save_ring(self, partitions):
+        """Publishes the new ring before dropping the old one, so a crash in between keeps at least one"""
+        self.channel.basic_publish(exchange='', routing_key=RING_QUEUE, body=json.dumps({"partitions": partitions}),
+                                   properties=pika.BasicProperties(delivery_mode=2))
+        if self.ring_state is not None:
+            self.channel.basic_ack(delivery_tag=self.ring_state)
+        method, _, _ = self.channel.basic_get(queue=RING_QUEUE)
+        self.ring_state = method.delivery_tag if method is not None else None
+
+    def declare_partitions(self, partitions):
+        for p in range(partitions):
+            self.channel.queue_declare(queue=partition_queue(p), durable=True)
+
+    @property
+    def rebalancing(self):
+        return self.next_ring is not None
+
+    def route(self, properties, body):
+        if is_binary(properties):
+            self.route_records(properties, body)
+            return
+        try:
+            partition = self.ring.partition_for(sender_of(body))
+        except Exception as e:
+            # Unroutable messages still reach a worker, which logs and acks them like any bad message
+            log.error(f" ❌ Cannot route message: {e}")
+            partition = 0
+        self.publish(partition, properties, body)
+
+    def route_records(self, properties, body):
+        """A binary message may hold events of many users: each partition gets its own records, in order"""
+        try:
+            records = decode_records(body)
+        except ValueError as e:
+            log.error(f" ❌ Cannot route message: {e}")
+            self.publish(0, properties, body)
+            return
+        partitions = np.array([self.ring.partition_for(u) for u in records['sender_id'].tolist()], dtype=np.intp)
+        for partition in np.unique(partitions).tolist():
+            self.publish(partition, properties, records[partitions == partition].tobytes())
+
+    def publish(self, partition, properties, body):
+        self.channel.basic_publish(exchange='', routing_key=partition_queue(partition), body=body,
+                                   properties=pika.BasicProperties(delivery_mode=2,
+                                                                   content_type=getattr(properties, 'content_type', None),
+                                                                   headers=getattr(properties, 'headers', None)))
+
+    def on_event(self, ch, method, properties, body):
+        if self.rebalancing:
+            self.held.append((method, properties, body))
+            return
+        self.route(properties, body)
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    def start_rebalance(self, partitions, reply_queue):
+        """Step 1: freeze routing and put a barrier at the tail of every current partition queue"""
+        if self.rebalancing:
+            log.warning(" ⚠️ Rebalance already in progress, ignoring request")
+            return
+        log.info(f" [*] Rebalancing {self.ring.partitions} -> {partitions} partitions...")
+        self.declare_partitions(partitions)
+        self.next_ring = HashRing(partitions)
+        self.pending = set(range(self.ring.partitions))
+        barrier = json.dumps({"partitions": partitions})
+        for p in range(self.ring.partitions):
+            self.channel.basic_publish(exchange='', routing_key=partition_queue(p), body=barrier,
+                                       properties=pika.BasicProperties(type='rebalance', reply_to=reply_queue,
+                                                                       delivery_mode=2))
+
+    def on_confirm(self, partition):
+        """Step 3: once every old partition handed off its users, switch rings and flush held events"""
+        self.pending.discard(partition)
+        if self.rebalancing and not self.pending:
+            self.save_ring(self.next_ring.partitions)
+            self.ring, self.next_ring = self.next_ring, None
+            log.info(f" ✅ Rebalance done: {self.ring.partitions} partitions")
+            held, self.held = self.held, []
+            for method, properties, body in held:
+                self.on_event(self.channel, method, properties, body)
+
+    def on_control(self, ch, method, properties, body):
+        try:
+            self.start_rebalance(int(json.loads(body)['partitions']), self.reply_queue)
+        except Exception as e:
+            log.error(f" ❌ Bad control message: {e}")
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    def on_reply(self, ch, method, properties, body):
+        self.on_confirm(int(json.loads(body)['partition']))
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    def run(self):
+        self.channel.queue_declare(queue=CONTROL_QUEUE, durable=True)
+        self.reply_queue = self.channel.queue_declare(queue='', exclusive=True).method.queue
+        self.channel.basic_qos(prefetch_count=PREFETCH_COUNT or BATCH_SIZE * 2)
+        self.channel.basic_consume(queue=QUEUE_NAME, on_message_callback=self.on_event)
+        self.channel.basic_consume(queue=CONTROL_QUEUE, on_message_callback=self.on_control)
+        self.channel.basic_consume(queue=self.reply_queue, on_message_callback=self.on_reply)
+        log.info(f' [*] Router Active: {QUEUE_NAME} -> {self.ring.partitions} partitions')
+        self.channel.start_consuming()
+
+
+class PartitionWorker:
+    """Scores one partition with a private profile store and takes part in rebalances"""
+
+    def __init__(self, partition, scorer=None, snapshots=None):
+        self.partition = partition
+        self.scorer = scorer or RiskEngine(store=ProfileStore(capacity=main.PROFILE_CAPACITY,
+                                                              max_users=main.MAX_PROFILES, ttl=main.PROFILE_TTL))
+        self.queue = partition_queue(partition)
+        self.snapshots = snapshots  # ProfileSnapshots of this partition's store (see snapshots.py)
+
+    def handle_batch(self, ch, messages):
+        """Scores runs of events with process_batch, handling control messages in queue order"""
+        events = []
+        for message in messages:
+            kind = getattr(message[1], 'type', None)
+            if kind in ('rebalance', 'profile_handoff'):
+                if events:
+                    process_batch(ch, events, self.scorer)
+                    events = []
+                if kind == 'rebalance':
+                    self.hand_off(ch, message[1], message[2])
+                else:
+                    self.accept_handoff(message[1], message[2])
+                if self.snapshots is not None:
+                    # Handoffs change the store outside the journal: snapshot before acking them
+                    self.snapshots.snapshot(self.scorer, wait=True)
+                ch.basic_ack(delivery_tag=message[0].delivery_tag)
+            else:
+                events.append(message)
+        if events:
+            process_batch(ch, events, self.scorer)
+        if self.snapshots is not None:
+            self.snapshots.maybe_snapshot(self.scorer)
+
+    def hand_off(self, ch, properties, body):
+        """Step 2: ship every profile this partition no longer owns to its new owner, then confirm"""
+        ring = HashRing(int(json.loads(body)['partitions']))
+        store = self.scorer.store
+        moving = {}
+        for user_id in store.index:
+            owner = ring.partition_for(user_id)
+            if owner != self.partition:
+                moving.setdefault(owner, []).append(user_id)
+
+        for owner, user_ids in moving.items():
+            for lo in range(0, len(user_ids), HANDOFF_CHUNK):
+                chunk = user_ids[lo:lo + HANDOFF_CHUNK]
+                rows = np.array([store.index[u] for u in chunk], dtype=np.intp)
+                ch.basic_publish(exchange='', routing_key=partition_queue(owner), body=store.pack_rows(rows).tobytes(),
+                                 properties=pika.BasicProperties(type='profile_handoff', delivery_mode=2,
+                                                                 headers={'users': json.dumps(chunk)}))
+            store.drop(user_ids)
+        log.info(f" 🔀 Partition {self.partition}: handed off {sum(map(len, moving.values()))} profiles")
+        ch.basic_publish(exchange='', routing_key=properties.reply_to, body=json.dumps({"partition": self.partition}))
+
+    def accept_handoff(self, properties, body):
+        store = self.scorer.store
+        user_ids = json.loads(properties.headers['users'])
+        rows = store.rows_for(user_ids)
+        store.unpack_rows(rows, np.frombuffer(body, dtype=store.row_dtype))
+        log.info(f" 🔀 Partition {self.partition}: received {len(user_ids)} profiles")
+
+    def run(self, channel):
+        main.metrics_engine = self.scorer
+        if self.snapshots is None:
+            self.snapshots = main.open_snapshots(self.scorer)
+        channel.queue_declare(queue=self.queue, durable=True)
+        channel.basic_qos(prefetch_count=PREFETCH_COUNT or BATCH_SIZE * 2)
+        main.install_shutdown_handler(channel, batches=True)
+        log.info(f' [*] Partition worker {self.partition} Active on {self.queue}')
+        try:
+            consume_batches(channel, self.queue, self.handle_batch)
+        finally:
+            main.ledger.close()
+            if self.snapshots is not None:
+                self.snapshots.close(self.scorer)
+        channel.connection.close()
+        log.info(f" [*] Partition worker {self.partition} stopped.")
+
+
+def partition_id():
+    """PARTITION_ID, or the ordinal of a StatefulSet pod name (fraud-engine-3 -> 3)"""
+    value = os.getenv('PARTITION_ID')
+    if value is None:
+        value = socket.gethostname().rsplit('-', 1)[-1]
+    return int(value)
+
+
+def request_rebalance(channel, partitions):
+    """Asks the router to move to a new partition count"""
+    channel.queue_declare(queue=CONTROL_QUEUE, durable=True)
+    channel.basic_publish(exchange='', routing_key=CONTROL_QUEUE, body=json.dumps({"partitions": partitions}),
+                          properties=pika.BasicProperties(delivery_mode=2))
+
+
+if __name__ == "__main__":
+    logs.configure()
+    if main.METRICS_PORT:
+        metrics.serve(main.METRICS_PORT, {'/metrics': (metrics.REGISTRY.render, metrics.PROMETHEUS_TEXT)})
+    role = sys.argv[1] if len(sys.argv) > 1 else 'worker'
+    if role == 'rebalance':
+        request_rebalance(connect_rabbitmq(), int(sys.argv[2]))
+        log.info(f" [*] Requested rebalance to {sys.argv[2]} partitions")
+        sys.exit()
+
+    log.info(f" [*] Starting Sharded Fraud Detection Engine ({role})...")
+    # Optional delay for sidecars to start up
+    time.sleep(main.STARTUP_DELAY)
+    channel = connect_rabbitmq()
+    if role == 'router':
+        ShardRouter(channel).run()
+    else:
+        PartitionWorker(partition_id()).run(channel)
@@ -0,0 +1,228 @@
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import numpy as np
+from logs import log
+
+# --- PROFILE SNAPSHOTS ---
+# The in-memory profile store survives restarts through a directory of:
+#   snapshot-<k>/      one .npy file per ProfileStore column + meta.json (user index, free rows)
+#   journal-<k>.jsonl  every analyze/analyze_batch call made after snapshot-<k> was taken,
+#                      one JSON line of columns {"u": [...], "a": [...], "t": [...]} per call, plus
+#                      the transactionIds and verdicts {"x": [...], "v": [[status, reason], ...]}
+#                      when the caller passed them
+#
+# A snapshot is captured between two batches (a memcpy of the columns, so it is consistent) and
+# written out by a background thread while scoring goes on; the journal is rotated at the same
+# moment, so snapshot-<k> + journal-<k>, journal-<k+1>... always rebuild the current state.
+# Older snapshots and journals are deleted once a newer snapshot is complete on disk.
+#
+# On start the latest snapshot is opened as copy-on-write memory maps: no column is read up
+# front, pages are faulted in as users show up. The journal tail is then replayed through the
+# engine (analyze_batch gives the same state as the original calls), and RabbitMQ redelivers
+# whatever was never acked. An event is journaled once scored, before its message is acked: a
+# crash in between replays it *and* redelivers it. restore() therefore returns the journaled
+# verdicts, which main.py puts in the verdict cache so the redelivery is answered from there
+# instead of being recorded twice in its sender's history (see verdicts.py).
+
+SNAPSHOT_DIR = re.compile(r'snapshot-(\d+)$')
+JOURNAL_FILE = re.compile(r'journal-(\d+)\.jsonl$')
+
+
+def _plain(value):
+    """json.dumps fallback for NumPy scalars used as user ids"""
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Cannot journal a user id of type {type(value).__name__}")
+
+
+class ProfileJournal:
+    """Append-only log of the events applied to a profile store, flushed on every call"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'a', encoding='utf-8')
+        self.events = 0
+
+    def append(self, user_ids, amounts, timestamps, tx_ids=None, verdicts=None):
+        entry = {"u": list(user_ids), "a": np.asarray(amounts, dtype=float).tolist(),
+                 "t": np.asarray(timestamps, dtype=float).tolist()}
+        if tx_ids is not None:
+            entry["x"], entry["v"] = list(tx_ids), [list(verdict) for verdict in verdicts]
+        self.file.write(json.dumps(entry, default=_plain) + '\n')
+        # No fsync: the page cache outlives the process, which is what a pod restart loses
+        self.file.flush()
+        self.events += len(user_ids)
+
+    def close(self):
+        self.file.close()
+
+
+def read_journal(path):
+    """(user_ids, amounts, timestamps, tx_ids, verdicts) of every complete line, the last two None when
+    not journaled; a torn last line (crash mid-write) is ignored"""
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.endswith('\n'):
+                break
+            entry = json.loads(line)
+            yield entry['u'], entry['a'], entry['t'], entry.get('x'), entry.get('v')
+
+
+def write_snapshot(state, path):
+    """Writes a ProfileStore.snapshot_state() as a snapshot directory, atomically (tmp dir + rename)"""
+    tmp = f'{path}.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for name, column in state['columns'].items():
+        np.save(os.path.join(tmp, f'{name}.npy'), column)
+    meta = {key: state[key] for key in ('users', 'free', 'last_sweep', 'history_size')}
+    meta['created'] = time.time()
+    if all(type(user_id) is int or user_id is None for user_id in state['users']):
+        # The usual case (ledger user ids) loads several times faster as an array than as JSON
+        np.save(os.path.join(tmp, 'user_ids.npy'), np.array([u or 0 for u in state['users']], dtype=np.int64))
+        meta['users'] = len(state['users'])
+    with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, default=_plain)
+    for name in os.listdir(tmp):
+        with open(os.path.join(tmp, name), 'rb') as f:
+            os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def load_snapshot(path, store):
+    """Points `store` at a snapshot directory: columns become copy-on-write memory maps (read lazily)"""
+    with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+        meta = json.load(f)
+    users = meta['users']
+    if isinstance(users, int):
+        users = np.load(os.path.join(path, 'user_ids.npy')).tolist()
+        for row in meta['free']:
+            users[row] = None
+    columns = {name[:-4]: np.load(os.path.join(path, name), mmap_mode='c')
+               for name in os.listdir(path) if name.endswith('.npy') and name != 'user_ids.npy'}
+    store.restore_state(columns, users, meta['free'], meta['last_sweep'])
+    return meta
+
+
+class ProfileSnapshots:
+    """Periodic background snapshots + journal of one engine's profile store, and warm restart from them"""
+
+    def __init__(self, directory, interval=60.0):
+        self.directory = directory
+        self.interval = interval
+        self.journal = None
+        self.generation = 0       # k of the journal being written
+        self.last_snapshot = time.monotonic()
+        self.writer = None
+        self.lock = threading.Lock()
+        self.snapshots_written = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _numbered(self, pattern):
+        found = {}
+        for name in os.listdir(self.directory):
+            match = pattern.match(name)
+            if match:
+                found[int(match.group(1))] = os.path.join(self.directory, name)
+        return found
+
+    def restore(self, engine):
+        """Loads the latest snapshot into engine.store, replays the journal after it, starts journaling.
+
+        The returned info includes the replayed (transactionId, (status, reason)) pairs as 'verdicts'.
+        """
+        start = time.perf_counter()
+        snapshots = self._numbered(SNAPSHOT_DIR)
+        base = max(snapshots, default=0)
+        users = 0
+        if snapshots:
+            try:
+                meta = load_snapshot(snapshots[base], engine.store)
+                users = len(engine.store)
+                log.info(f" [*] Profile snapshot {base} mapped: {users} users ({time.time() - meta['created']:.0f}s old)")
+            except (OSError, ValueError, KeyError) as e:
+                log.warning(f" ⚠️ Cannot load profile snapshot {base}, starting from the journal only: {e}")
+        loaded = time.perf_counter() - start
+
+        replayed, verdicts = 0, []
+        journals = self._numbered(JOURNAL_FILE)
+        for k in sorted(k for k in journals if k >= base):
+            for user_ids, amounts, timestamps, tx_ids, journaled in read_journal(journals[k]):
+                engine.analyze_batch(user_ids, amounts, timestamps)
+                replayed += len(user_ids)
+                if tx_ids is not None:
+                    verdicts.extend(zip(tx_ids, map(tuple, journaled)))
+        self.generation = max([base] + list(journals)) + 1
+        self.journal = ProfileJournal(self._journal_path(self.generation))
+        engine.journal = self.journal
+        self.last_snapshot = time.monotonic()
+        if replayed:
+            log.info(f" [*] Replayed {replayed} journaled events into the profiles")
+        return {"snapshot": base if snapshots else None, "users": users, "load_seconds": loaded,
+                "replayed_events": replayed, "verdicts": verdicts, "seconds": time.perf_counter() - start}
+
+    def _journal_path(self, k):
+        return os.path.join(self.directory, f'journal-{k:06d}.jsonl')
+
+    def _snapshot_path(self, k):
+        return os.path.join(self.directory, f'snapshot-{k:06d}')
+
+    @property
+    def writing(self):
+        return self.writer is not None and self.writer.is_alive()
+
+    def maybe_snapshot(self, engine, now=None):
+        """Takes a snapshot once `interval` seconds passed since the last one (call between batches)"""
+        now = time.monotonic() if now is None else now
+        if self.journal is not None and now - self.last_snapshot >= self.interval and not self.writing:
+            self.snapshot(engine)
+
+    def snapshot(self, engine, wait=False):
+        """Captures the store and rotates the journal now; the files are written in the background"""
+        if self.writer is not None:
+            self.writer.join()  # one snapshot on disk at a time
+        state = engine.store.snapshot_state()
+        self.generation += 1
+        k = self.generation
+        old = self.journal
+        self.journal = ProfileJournal(self._journal_path(k))
+        engine.journal = self.journal
+        if old is not None:
+            old.close()
+        self.last_snapshot = time.monotonic()
+        self.writer = threading.Thread(target=self._write, args=(state, k), name='profile-snapshot', daemon=True)
+        self.writer.start()
+        if wait:
+            self.writer.join()
+
+    def _write(self, state, k):
+        try:
+            start = time.perf_counter()
+            write_snapshot(state, self._snapshot_path(k))
+        except Exception as e:
+            # The previous snapshot and every journal since are still there
+            log.error(f" ❌ Profile snapshot {k} failed: {e}")
+            return
+        with self.lock:
+            self.snapshots_written += 1
+        for older, path in self._numbered(SNAPSHOT_DIR).items():
+            if older < k:
+                shutil.rmtree(path, ignore_errors=True)
+        for older, path in self._numbered(JOURNAL_FILE).items():
+            if older < k:
+                os.remove(path)
+        log.info(f" [*] Profile snapshot {k}: {len(state['users']) - len(state['free'])} users "
+                 f"in {time.perf_counter() - start:.2f}s")
+
+    def close(self, engine):
+        """Final snapshot on shutdown, so the next start has no journal to replay"""
+        if self.journal is None:
+            return
+        self.snapshot(engine, wait=True)
+        self.journal.close()
+        self.journal = None
+        engine.journal = None
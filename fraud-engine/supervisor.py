@@ -0,0 +1,228 @@
+import json
+import multiprocessing
+import os
+import shutil
+import signal
+import tempfile
+import time
+from collections import deque
+import threading
+import main
+import logs
+import metrics
+from logs import log
+
+# --- MULTI-PROCESS SUPERVISOR ---
+# Runs ENGINE_WORKERS consumer processes (main.run_consumer) on the same queue so a pod uses all of
+# its cores, restarts any that crash, and relays SIGTERM so each one finishes its in-flight batch.
+# Throughput summed over all workers is served on METRICS_PORT for scraping and the engine's HPA:
+#   GET /metrics  Prometheus text format
+#   GET /stats    the same numbers as JSON
+# Each worker also exports its own engine metrics (decisions, rules, latencies... see main.py) to a
+# JSON file in METRICS_DIR once a second; /metrics merges them into one page (see metrics.py).
+#
+# Worker processes only share profiles through PROFILE_BACKEND=redis; with the in-memory store each
+# process would see a different slice of every user's history, so the default is then 1 worker.
+# Several scorers on the same Redis are safe: a commit that races another one on the same users is
+# refused (WATCH/MULTI/EXEC, see profiles.py) and the batch is scored again on the fresh rows.
+
+ENGINE_WORKERS = int(os.getenv('ENGINE_WORKERS', '0'))      # 0 = one per core (redis backend) or 1 (memory backend)
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9100'))       # 0 = don't serve metrics
+SHUTDOWN_GRACE = float(os.getenv('SHUTDOWN_GRACE', '25'))   # seconds workers get to drain (k8s waits 30 by default)
+RATE_WINDOW = 10                                            # seconds averaged by the events/sec gauge
+RESTART_DELAY = 1.0
+METRICS_DIR = os.getenv('METRICS_DIR', '')                  # '' = a temporary directory per supervisor
+
+
+def worker_count():
+    if ENGINE_WORKERS > 0:
+        return ENGINE_WORKERS
+    if main.PROFILE_BACKEND == 'redis':
+        return os.cpu_count() or 1
+    return 1
+
+
+def worker_path(path, index):
+    """Per-worker variant of a file path: verdicts.jsonl -> verdicts.worker-2.jsonl"""
+    root, ext = os.path.splitext(path)
+    return f'{root}.worker-{index}{ext}'
+
+
+def configure_worker(index):
+    """Points the state files of a worker process at its own copies: processes must never share them"""
+    if main.PROFILE_SNAPSHOT_DIR:
+        # Each process snapshots its own store
+        main.PROFILE_SNAPSHOT_DIR = os.path.join(main.PROFILE_SNAPSHOT_DIR, f'worker-{index}')
+    if main.VERDICT_CACHE_PATH:
+        # Each process keeps its own verdict cache (a redelivery picked up by another worker is scored again)
+        main.VERDICT_CACHE_PATH = worker_path(main.VERDICT_CACHE_PATH, index)
+    if main.CALLBACK_OUTBOX:
+        # The outbox is rewritten on load and truncated once its own updates are delivered, and its
+        # sequence numbers are per process: a shared file would lose other workers' undelivered updates
+        main.CALLBACK_OUTBOX = worker_path(main.CALLBACK_OUTBOX, index)
+        main.ledger = main.new_ledger_client()
+
+
+def adopt_shared_outbox():
+    """Hands the outbox of a single-process engine (before workers had their own) over to worker 0"""
+    if main.CALLBACK_OUTBOX and os.path.exists(main.CALLBACK_OUTBOX):
+        target = worker_path(main.CALLBACK_OUTBOX, 0)
+        if os.path.exists(target):
+            log.warning(f" ⚠️ Both {main.CALLBACK_OUTBOX} and {target} exist, leaving the former alone")
+        else:
+            os.rename(main.CALLBACK_OUTBOX, target)
+            log.info(f" [*] Undelivered ledger updates of {main.CALLBACK_OUTBOX} moved to {target}")
+
+
+def run_worker(index, counter):
+    """Entry point of one consumer process"""
+    # The supervisor relays Ctrl-C as SIGTERM; ignore the terminal's copy until the handler is installed
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logs.configure()
+    main.events_processed = counter
+    configure_worker(index)
+    log.info(f" [*] Worker {index} (pid {os.getpid()}) starting")
+    exporter = None
+    if os.getenv('METRICS_DIR'):
+        exporter = metrics.Exporter(os.path.join(os.environ['METRICS_DIR'], f'worker-{index}.json')).start()
+    try:
+        main.run_consumer()
+    finally:
+        if exporter is not None:
+            exporter.stop()
+
+
+class ThroughputMeter:
+    """Events/sec over the last RATE_WINDOW seconds, from a shared monotonically increasing counter"""
+
+    def __init__(self, counter, window=RATE_WINDOW):
+        self.counter = counter
+        self.samples = deque()
+        self.window = window
+        self.lock = threading.Lock()
+
+    def sample(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self.samples.append((now, self.counter.value))
+            while len(self.samples) > 2 and now - self.samples[1][0] >= self.window:
+                self.samples.popleft()
+
+    def total(self):
+        return self.counter.value
+
+    def rate(self):
+        with self.lock:
+            if len(self.samples) < 2:
+                return 0.0
+            (t0, c0), (t1, c1) = self.samples[0], self.samples[-1]
+        return (c1 - c0) / (t1 - t0) if t1 > t0 else 0.0
+
+
+class Supervisor:
+    def __init__(self, workers=None, target=run_worker):
+        self.workers = workers or worker_count()
+        self.target = target
+        # spawn: children start from a clean interpreter instead of a fork of this one
+        self.context = multiprocessing.get_context('spawn')
+        self.counter = self.context.Value('q', 0)
+        self.meter = ThroughputMeter(self.counter)
+        self.processes = {}
+        self.restarts = 0
+        self.stopping = threading.Event()
+        self.http = None
+        self.metrics_dir = METRICS_DIR or tempfile.mkdtemp(prefix='fraud-engine-metrics-')
+        os.makedirs(self.metrics_dir, exist_ok=True)
+
+    def spawn(self, index):
+        # Spawned children inherit the environment, that's how workers find where to export
+        os.environ['METRICS_DIR'] = self.metrics_dir
+        process = self.context.Process(target=self.target, args=(index, self.counter),
+                                       name=f'fraud-engine-{index}', daemon=False)
+        process.start()
+        self.processes[index] = process
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "workers_alive": sum(p.is_alive() for p in self.processes.values()),
+            "restarts": self.restarts,
+            "events_total": self.meter.total(),
+            "events_per_second": round(self.meter.rate(), 3),
+        }
+
+    def metrics(self):
+        stats = self.stats()
+        return ''.join([
+            "# HELP fraud_engine_events_total Transactions scored by all worker processes.\n",
+            "# TYPE fraud_engine_events_total counter\n",
+            f"fraud_engine_events_total {stats['events_total']}\n",
+            f"# HELP fraud_engine_events_per_second Scoring throughput over the last {RATE_WINDOW}s.\n",
+            "# TYPE fraud_engine_events_per_second gauge\n",
+            f"fraud_engine_events_per_second {stats['events_per_second']}\n",
+            "# HELP fraud_engine_workers_alive Consumer processes currently running.\n",
+            "# TYPE fraud_engine_workers_alive gauge\n",
+            f"fraud_engine_workers_alive {stats['workers_alive']}\n",
+            "# HELP fraud_engine_worker_restarts_total Consumer processes restarted after crashing.\n",
+            "# TYPE fraud_engine_worker_restarts_total counter\n",
+            f"fraud_engine_worker_restarts_total {stats['restarts']}\n",
+            metrics.render(metrics.read_states(self.metrics_dir)),
+        ])
+
+    def serve_metrics(self, port=METRICS_PORT):
+        self.http = metrics.serve(port, {
+            '/metrics': (self.metrics, metrics.PROMETHEUS_TEXT),
+            '/stats': (lambda: json.dumps(self.stats()), 'application/json'),
+        })
+        log.info(f" [*] Metrics on :{self.http.server_address[1]}/metrics")
+
+    def request_stop(self, signum=None, frame=None):
+        if not self.stopping.is_set():
+            log.info(" [*] Supervisor stopping: letting workers finish their current batch...")
+        self.stopping.set()
+
+    def run(self, poll_interval=1.0):
+        signal.signal(signal.SIGTERM, self.request_stop)
+        signal.signal(signal.SIGINT, self.request_stop)
+        log.info(f" [*] Supervisor starting {self.workers} worker process(es)")
+        adopt_shared_outbox()
+        for index in range(self.workers):
+            self.spawn(index)
+        while not self.stopping.wait(poll_interval):
+            self.meter.sample()
+            for index, process in list(self.processes.items()):
+                if not process.is_alive():
+                    log.warning(f" ⚠️ Worker {index} exited with code {process.exitcode}, restarting")
+                    self.restarts += 1
+                    time.sleep(RESTART_DELAY)
+                    self.spawn(index)
+        self.shutdown()
+
+    def shutdown(self, grace=SHUTDOWN_GRACE):
+        """SIGTERM every worker, wait up to grace seconds for them to drain, then kill stragglers"""
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + grace
+        for process in self.processes.values():
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                log.warning(f" ⚠️ {process.name} did not stop in {grace}s, killing it")
+                process.kill()
+                process.join()
+        if self.http is not None:
+            self.http.shutdown()
+        if not METRICS_DIR:
+            shutil.rmtree(self.metrics_dir, ignore_errors=True)
+        log.info(f" [*] Supervisor stopped after {self.meter.total()} events.")
+
+
+if __name__ == "__main__":
+    logs.configure()
+    log.info(" [*] Starting High-Frequency Fraud Detection Engine (supervisor)...")
+    # Optional delay for sidecars to start up
+    time.sleep(main.STARTUP_DELAY)
+    supervisor = Supervisor()
+    if METRICS_PORT:
+        supervisor.serve_metrics()
+    supervisor.run()
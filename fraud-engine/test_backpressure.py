@@ -0,0 +1,152 @@
+import unittest
+import json
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+from unittest import mock
+import numpy as np
+import main
+from main import RiskEngine, reset_state
+from profiles import ProfileStore
+from backpressure import Backpressure, DegradedLog, read_degraded, NORMAL, BACKLOG, SHEDDING
+from backtest import Backtest
+from test_fraud import FakeChannel, make_messages, queued_updates
+
+class TestBackpressure(unittest.TestCase):
+    def test_levels_follow_depth_and_age(self):
+        control = Backpressure(batch_size=100, max_batch_size=800, max_parallelism=4, backlog_depth=1000, slo=2.0)
+        now = 1000.0
+        control.observe([now - 0.1] * 10, now=now)
+        self.assertEqual((control.level, control.batch_size, control.parallelism), (NORMAL, 100, 1))
+
+        # A deep queue grows batches and parallelism, up to their limits
+        control.observe_depth(5000)
+        for _ in range(5):
+            control.observe([now - 0.1] * 10, now=now)
+        self.assertEqual((control.level, control.batch_size, control.parallelism), (BACKLOG, 800, 4))
+        self.assertFalse(control.fast_path([10.0]).any())
+
+        # Old events: low amounts take the fast path, large ones are still fully scored
+        control.observe(np.full(10, now - 1.7), now=now)
+        self.assertEqual(control.level, SHEDDING)
+        self.assertEqual(control.fast_path([10.0, 999.0, 5000.0]).tolist(), [True, True, False])
+        # Hysteresis: still shedding just under the threshold that triggered it
+        control.observe(np.full(10, now - 1.2), now=now)
+        self.assertEqual(control.level, SHEDDING)
+
+        # Caught up: back to normal, batches shrink back step by step
+        control.observe_depth(0)
+        for _ in range(5):
+            control.observe([now - 0.1] * 10, now=now)
+        self.assertEqual((control.level, control.batch_size, control.parallelism), (NORMAL, 100, 1))
+
+    def test_adjust_polls_depth_and_prefetch(self):
+        control = Backpressure(batch_size=50, backlog_depth=10)
+        channel = mock.Mock()
+        channel.queue_declare.return_value = SimpleNamespace(method=SimpleNamespace(message_count=500))
+        control.adjust(channel, 'q', now=0.0)
+        channel.queue_declare.assert_called_once_with(queue='q', passive=True)
+        channel.basic_qos.assert_called_once_with(prefetch_count=100, global_qos=True)
+        control.adjust(channel, 'q', now=0.5)  # polled at most once per DEPTH_POLL_INTERVAL
+        self.assertEqual(channel.queue_declare.call_count, 1)
+        self.assertEqual(control.depth, 500)
+
+    def test_adaptive_consumer_bounds_prefetch_before_consuming(self):
+        """The consumer starts under MAX_BATCH_SIZE * 2; the batch-sized window is channel-wide, so it applies too"""
+        channel = mock.Mock()
+        channel.queue_declare.return_value = SimpleNamespace(method=SimpleNamespace(message_count=0))
+
+        def consume(queue, inactivity_timeout=None):
+            main.shutdown.set()
+            yield None, None, None
+        channel.consume.side_effect = consume
+        self.addCleanup(main.shutdown.clear)
+        with mock.patch.object(main, 'CONSUMER_MODE', 'adaptive'), mock.patch.object(main, 'BATCH_SIZE', 50), \
+                mock.patch.object(main, 'MAX_BATCH_SIZE', 400), mock.patch.object(main, 'PREFETCH_COUNT', 0), \
+                mock.patch.object(main, 'connect_rabbitmq', return_value=channel), \
+                mock.patch.object(main, 'install_shutdown_handler'), mock.patch.object(main, 'ledger'), \
+                mock.patch.object(main, 'DEGRADED_LOG', os.devnull):
+            main.run_consumer()
+        calls = [c for c in channel.method_calls if c[0] in ('basic_qos', 'consume')]
+        self.assertEqual(calls, [mock.call.basic_qos(prefetch_count=800),
+                                 mock.call.consume(main.QUEUE_NAME, inactivity_timeout=main.BATCH_LINGER),
+                                 mock.call.basic_qos(prefetch_count=100, global_qos=True)])
+
+class TestFastPath(unittest.TestCase):
+    def test_fast_path_skips_costly_rules_only(self):
+        engine = RiskEngine(store=ProfileStore())
+        users = [1] * 10 + [1, 1]
+        amounts = [10.0, 12.0] * 5 + [900.0, 9800.0]
+        times = np.arange(12) * 60.0
+        full = engine.analyze_batch(users, amounts, times)
+        self.assertEqual(full[-2][0], "REJECTED")  # anomaly
+
+        fast_engine = RiskEngine(store=ProfileStore())
+        fast = np.zeros(12, dtype=bool)
+        fast[-2:] = True
+        verdicts = fast_engine.analyze_batch(users, amounts, times, fast)
+        self.assertEqual(verdicts[-2], ("COMPLETED", "Verified"))       # anomaly (cost 2) skipped
+        self.assertEqual(verdicts[-1][1], "Potential Structuring Detected")  # structuring (cost 0) still runs
+        self.assertEqual(fast_engine.rule_stats()['anomaly']['calls'], 10)
+        self.assertEqual(fast_engine.plan.skipped(fast_engine.FAST_PATH_MAX_COST), ['anomaly'])
+        # Profiles are recorded the same either way
+        self.assertEqual(engine.get_profile(1).amounts.tolist(), fast_engine.get_profile(1).amounts.tolist())
+
+    def test_parallel_model_calls(self):
+        calls = []
+        main.load_cost_model.cache_clear()
+        self.addCleanup(main.load_cost_model.cache_clear)
+        with mock.patch.object(main, 'SCORING_COST', 'sleep'), mock.patch.object(main, 'PROCESSING_DELAY', 0.01), \
+                mock.patch.object(main, 'SCORING_COST_PER_EVENT', 0.001), \
+                mock.patch.dict(main.COST_MODELS, sleep=calls.append):
+            main.simulate_scoring_cost(10, parallelism=4)
+        self.assertEqual(sorted(round(c, 6) for c in calls), [0.012, 0.012, 0.013, 0.013])
+
+class TestAdaptiveConsumer(unittest.TestCase):
+    def setUp(self):
+        reset_state()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'degraded.jsonl')
+        self.addCleanup(main.close_backpressure)
+
+    def test_shedding_records_degraded_verdicts(self):
+        old = time.time() - 600
+        events = [{"transactionId": str(100 + i), "senderId": 7, "amount": 10 + i % 2, "timestamp": old + i * 30}
+                  for i in range(10)]
+        events += [{"transactionId": "200", "senderId": 7, "amount": 900, "timestamp": old + 400},
+                   {"transactionId": "201", "senderId": 8, "amount": 5000, "timestamp": old + 400}]
+        with mock.patch.object(main, 'DEGRADED_LOG', self.path), mock.patch.object(main, 'VERDICT_SLO', 1.0):
+            main.open_backpressure()
+        ch = FakeChannel()
+        with mock.patch.object(main, 'PROCESSING_DELAY', 0), mock.patch.object(main, 'ledger') as ledger:
+            main.process_batch(ch, make_messages(events))
+        self.assertEqual(main.backpressure.level, SHEDDING)
+        updates = queued_updates(ledger)
+        self.assertEqual(len(updates), 12)
+        self.assertEqual(ch.acks, [(12, True)])
+        # The anomalous 900 was let through on the fast path; the 5000 was not fast-pathed
+        self.assertIn({"transactionId": "200", "status": "COMPLETED"}, updates)
+        with open(self.path, encoding='utf-8') as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(len(records), 11)
+        self.assertEqual(records[-1]["skippedRules"], ["anomaly"])
+        self.assertNotIn("201", [r["transactionId"] for r in records])
+
+        # Re-scoring the history with every rule overturns the 900
+        backtest = Backtest(RiskEngine(store=ProfileStore()), rescore=read_degraded(self.path))
+        report = backtest.run(events)
+        self.assertEqual((report["rescored"], report["overturned"]), (11, 1))
+
+    def test_degraded_log_is_appended(self):
+        log = DegradedLog(self.path)
+        log.append([np.uint64(5)], [np.int64(3)], np.array([1.5]), np.array([2.0]), [("COMPLETED", "Verified")], [], 1.0)
+        log.close()
+        log = DegradedLog(self.path)
+        log.append(["6"], ["alice"], [2.5], [3.0], [("REJECTED", "x")], ["anomaly"], 2.0)
+        log.close()
+        self.assertEqual(read_degraded(self.path), {"5": "COMPLETED", "6": "REJECTED"})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import unittest
+import io
+import json
+import numpy as np
+from main import RiskEngine
+from profiles import ProfileStore
+from backtest import Backtest, iter_ledger_transactions, iter_jsonl, simulated_clock
+
+def ledger_dump(transactions):
+    """A ledger_db.json document (pretty-printed like the ledger service writes it)"""
+    return json.dumps({
+        "accounts": [{"userId": u, "balance": 1000, "note": "brace } and \"quote\" ["} for u in range(50)],
+        "transactions": {tx["transactionId"]: tx for tx in transactions},
+        "currentTransactionId": 1000 + len(transactions),
+    }, indent=2)
+
+class TestBacktest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(2)
+        n = 3000
+        self.transactions = [{"transactionId": str(1000 + i), "senderId": int(u), "recipientId": 1,
+                              "amount": float(a), "timestamp": float(t), "status": "COMPLETED"}
+                             for i, (u, a, t) in enumerate(zip(rng.integers(0, 50, n), np.round(rng.lognormal(3, 1, n), 2),
+                                                                np.cumsum(rng.exponential(0.2, n))))]
+        self.transactions[10]["amount"] = 9800.0
+
+    def expected(self):
+        engine = RiskEngine(store=ProfileStore())
+        return [engine.analyze(tx["senderId"], tx["amount"], tx["timestamp"]) for tx in self.transactions]
+
+    def test_streams_ledger_dump_in_small_chunks(self):
+        """The incremental reader yields every transaction, whatever the read size"""
+        text = ledger_dump(self.transactions)
+        for chunk_size in (7, 4096):
+            got = list(iter_ledger_transactions(io.StringIO(text), chunk_size=chunk_size))
+            self.assertEqual(got, self.transactions)
+        self.assertEqual(list(iter_ledger_transactions(io.StringIO('{"transactions": {}}'))), [])
+
+    def test_decisions_match_engine(self):
+        decisions = io.StringIO()
+        backtest = Backtest(RiskEngine(store=ProfileStore()), batch_size=256, decisions=decisions)
+        report = backtest.run(iter_ledger_transactions(io.StringIO(ledger_dump(self.transactions)), chunk_size=1000))
+        expected = self.expected()
+        got = [(d["status"], d["reason"]) for d in map(json.loads, decisions.getvalue().splitlines())]
+        self.assertEqual(got, expected)
+
+        rejected = sum(status == "REJECTED" for status, _ in expected)
+        self.assertEqual(report["events"], len(self.transactions))
+        self.assertEqual(report["decisions"].get("REJECTED", 0), rejected)
+        self.assertEqual(report["changed_vs_recorded"], rejected)
+        self.assertEqual(report["rules"]["structuring"]["calls"], len(self.transactions))
+        self.assertGreater(report["rules"]["structuring"]["hit_rate"], 0)
+        self.assertGreater(report["events_per_second"], 0)
+
+    def test_jsonl_with_malformed_lines_and_simulated_clock(self):
+        lines = [json.dumps({"transactionId": str(i), "senderId": "bot", "amount": 10}) for i in range(8)]
+        lines.insert(3, "not json")
+        lines.insert(5, json.dumps({"transactionId": "x", "senderId": "bot"}))
+        # No timestamps: 8 events at 10 per second trip the default 5-per-10s velocity limit
+        report = Backtest(RiskEngine(store=ProfileStore())).run(iter_jsonl(io.StringIO('\n'.join(lines))), rate=10)
+        self.assertEqual(report["events"], 8)
+        self.assertEqual(report["malformed"], 2)
+        self.assertEqual(report["reasons"]["High Frequency Trading Velocity Exceeded"], 2)
+
+        clock = [t for _, t in simulated_clock([{}, {}, {"timestamp": 100.0}, {}], rate=2)]
+        self.assertEqual(clock, [0.5, 1.0, 100.0, 100.5])
+
+    def test_ids_are_normalised_like_the_consumers(self):
+        """"7" and 7 are one sender, and integer transactionIds come out as strings (see wire.py)"""
+        events = [{"transactionId": 100 + i, "senderId": "7" if i % 2 else 7, "amount": 10, "timestamp": float(i)}
+                  for i in range(8)]
+        decisions = io.StringIO()
+        report = Backtest(RiskEngine(store=ProfileStore()), decisions=decisions).run(events)
+        self.assertEqual(report["reasons"]["High Frequency Trading Velocity Exceeded"], 2)
+        got = [d["transactionId"] for d in map(json.loads, decisions.getvalue().splitlines())]
+        self.assertEqual(got, [str(100 + i) for i in range(8)])
+
+if __name__ == '__main__':
+    unittest.main()
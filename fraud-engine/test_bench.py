@@ -0,0 +1,24 @@
+import unittest
+import bench
+
+class TestBench(unittest.TestCase):
+    def test_quick_run_reports_every_metric(self):
+        bench.register_get_profile([1000])
+        results = bench.run(['json_decode', 'get_profile_1e3', 'e2e_batch'], quick=True, isolate=False)
+        for name, result in results.items():
+            for key in ('p50_us', 'p99_us', 'events_per_second', 'peak_rss_mb'):
+                self.assertGreater(result[key], 0, f"{name}.{key}")
+            self.assertLessEqual(result['p50_us'], result['p99_us'])
+        self.assertEqual(results['get_profile_1e3']['users'], 1000)
+
+    def test_compare_flags_regressions(self):
+        baseline = {"results": {"analyze": {"events_per_second": 1000.0, "p99_us": 50.0, "peak_rss_mb": 100.0}}}
+        same = {"analyze": {"events_per_second": 900.0, "p99_us": 90.0, "peak_rss_mb": 110.0}}
+        self.assertEqual(bench.compare(same, baseline), [])
+        slower = {"analyze": {"events_per_second": 600.0, "p99_us": 120.0, "peak_rss_mb": 200.0}}
+        self.assertEqual(len(bench.compare(slower, baseline)), 3)
+        # Benchmarks missing from either side are not regressions
+        self.assertEqual(bench.compare({}, baseline), [])
+
+if __name__ == '__main__':
+    unittest.main()
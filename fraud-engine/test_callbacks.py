@@ -0,0 +1,93 @@
+import unittest
+import os
+import tempfile
+import threading
+from types import SimpleNamespace
+import requests
+from callbacks import LedgerClient, Outbox
+
+class FakeSession:
+    """Stands in for requests.Session: records posts, fails the first `failures` of them"""
+    def __init__(self, failures=0, status=200):
+        self.posts = []
+        self.failures = failures
+        self.status = status
+        self.lock = threading.Lock()
+
+    def post(self, url, json=None, timeout=None):
+        with self.lock:
+            if self.failures:
+                self.failures -= 1
+                raise requests.ConnectionError("ledger down")
+            self.posts.append((url, json))
+        return SimpleNamespace(status_code=self.status)
+
+class TestLedgerClient(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'outbox.jsonl')
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close(timeout=0)
+        self.dir.cleanup()
+
+    def client(self, session, **kwargs):
+        client = LedgerClient('http://ledger/update', outbox=Outbox(self.path), session=session, backoff=0.001, **kwargs)
+        self.clients.append(client)
+        return client
+
+    def test_delivers_every_update(self):
+        session = FakeSession()
+        client = self.client(session)
+        client.enqueue([(i, "COMPLETED") for i in range(50)])
+        self.assertTrue(client.flush(timeout=5))
+        self.assertEqual(sorted(int(body["transactionId"]) for _, body in session.posts), list(range(50)))
+        self.assertEqual(client.outbox.undelivered(), [])
+
+    def test_retries_with_backoff(self):
+        session = FakeSession(failures=3)
+        client = self.client(session, workers=1)
+        client.enqueue([("1001", "REJECTED")])
+        self.assertTrue(client.flush(timeout=5))
+        self.assertEqual(session.posts, [('http://ledger/update', {"transactionId": "1001", "status": "REJECTED"})])
+        self.assertEqual(client.retries, 3)
+
+    def test_outbox_survives_restart(self):
+        """Updates queued while the ledger is down are delivered by the next process"""
+        down = self.client(FakeSession(failures=10 ** 6), workers=1)
+        down.enqueue([("1", "COMPLETED"), ("2", "REJECTED")])
+        self.assertFalse(down.flush(timeout=0.05))
+        down.close(timeout=0)
+
+        session = FakeSession()
+        up = self.client(session)
+        up.start()
+        self.assertTrue(up.flush(timeout=5))
+        self.assertEqual(sorted(body["transactionId"] for _, body in session.posts), ["1", "2"])
+        up.close()
+        outbox = Outbox(self.path)
+        outbox.open()
+        self.assertEqual(outbox.undelivered(), [])
+        outbox.close()
+
+    def test_bulk_endpoint(self):
+        session = FakeSession()
+        client = self.client(session, workers=1, bulk_url='http://ledger/update/bulk', bulk_size=100)
+        client.enqueue([(i, "COMPLETED") for i in range(250)])
+        self.assertTrue(client.flush(timeout=5))
+        self.assertTrue(all(url == 'http://ledger/update/bulk' for url, _ in session.posts))
+        self.assertLessEqual(max(len(body["updates"]) for _, body in session.posts), 100)
+        self.assertEqual(sum(len(body["updates"]) for _, body in session.posts), 250)
+
+    def test_client_errors_are_not_retried(self):
+        session = FakeSession(status=404)
+        client = self.client(session)
+        client.enqueue([("missing", "COMPLETED")])
+        self.assertTrue(client.flush(timeout=5))
+        self.assertEqual(len(session.posts), 1)
+        self.assertEqual(client.dropped, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,32 @@
 import unittest
 import time
+import json
 from collections import deque
+from types import SimpleNamespace
+import numpy as np
+from unittest import mock
 # Import reset_state to clear global variables between tests
+import main
 from main import RiskEngine, reset_state
+from rules import Rule, register_rule
+from wire import EVENT_CONTENT_TYPE, encode_events, decode_event, parse_timestamp
+
+class FakeChannel:
+    """Records acks instead of talking to RabbitMQ"""
+    def __init__(self):
+        self.acks = []
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.acks.append((delivery_tag, multiple))
+
+def queued_updates(ledger):
+    """Ledger callbacks handed to a mocked main.ledger, as the JSON payloads they would be posted as"""
+    return [{"transactionId": str(tx_id), "status": status}
+            for c in ledger.enqueue.call_args_list for tx_id, status in c.args[0]]
+
+def make_messages(events):
+    """Wraps event dicts as (method, properties, body) tuples like pika delivers them"""
+    return [(SimpleNamespace(delivery_tag=i + 1), None, json.dumps(e).encode()) for i, e in enumerate(events)]
 
 class TestRiskEngine(unittest.TestCase):
     def setUp(self):
@@ -54,5 +78,343 @@ class TestRiskEngine(unittest.TestCase):
         self.assertEqual(status, "REJECTED")
         self.assertIn("Anomaly", reason)
 
+class TestAnalyzeBatch(unittest.TestCase):
+    def setUp(self):
+        reset_state()
+        self.engine = RiskEngine()
+
+    def sequential(self, user_ids, amounts, timestamps):
+        reset_state()
+        engine = RiskEngine()
+        return [engine.analyze(u, a, t) for u, a, t in zip(user_ids, amounts, timestamps)]
+
+    def test_matches_sequential_analyze(self):
+        """Vectorized batch scoring gives the same verdicts as one-by-one analyze calls"""
+        rng = np.random.default_rng(42)
+        n = 3000
+        user_ids = rng.integers(0, 40, n).tolist()
+        amounts = np.round(rng.lognormal(3, 1.2, n), 2)
+        amounts[rng.random(n) < 0.02] = 9700.0
+        timestamps = np.cumsum(rng.exponential(0.3, n))
+
+        expected = self.sequential(user_ids, amounts.tolist(), timestamps.tolist())
+        reset_state()
+        engine = RiskEngine()
+        # Split into uneven batches so history carries over between calls
+        got = engine.analyze_batch(user_ids[:1000], amounts[:1000], timestamps[:1000])
+        got += engine.analyze_batch(user_ids[1000:], amounts[1000:], timestamps[1000:])
+        self.assertEqual(got, expected)
+        self.assertTrue(any(status == "REJECTED" for status, _ in got))
+
+    def test_same_user_events_inside_one_batch(self):
+        """Velocity and anomaly see earlier events of the same batch"""
+        amounts = [10, 12, 10, 11, 10, 10, 5000]
+        verdicts = self.engine.analyze_batch(["u"] * 7, amounts, [100.0] * 7)
+        self.assertEqual(verdicts[-1], ("REJECTED", "High Frequency Trading Velocity Exceeded"))
+
+        verdicts = self.engine.analyze_batch(["v"] * 6, [10, 12, 10, 11, 10, 5000], [0, 20, 40, 60, 80, 100])
+        self.assertEqual(verdicts[-1], ("REJECTED", "Statistical Anomaly Detected"))
+
+    def test_empty_batch(self):
+        self.assertEqual(self.engine.analyze_batch([], [], []), [])
+
+class TestIncrementalStats(unittest.TestCase):
+    def setUp(self):
+        reset_state()
+        self.engine = RiskEngine()
+        self.rng = np.random.default_rng(7)
+
+    def test_window_stats_track_numpy(self):
+        """Running mean/std equal np.mean/np.std of the last 50 amounts, including after eviction"""
+        profile = self.engine.get_profile("u")
+        for i, amount in enumerate(self.rng.lognormal(4, 1, 180).tolist()):
+            self.engine.record(profile, amount, float(i))
+            history = list(profile.amounts)
+            avg, std_dev = self.engine.profile_stats(profile)
+            self.assertAlmostEqual(avg, np.mean(history), places=8)
+            self.assertAlmostEqual(std_dev, np.std(history), places=8)
+
+    def test_ewm_mode_batch_matches_sequential(self):
+        """Exponentially weighted stats give the same decisions in batch and sequential scoring"""
+        n = 2000
+        user_ids = self.rng.integers(0, 20, n).tolist()
+        amounts = np.round(self.rng.lognormal(3, 1.5, n), 2)
+        timestamps = np.arange(n) * 5.0
+        with mock.patch.object(main, 'ANOMALY_STATS', 'ewm'):
+            engine = RiskEngine()
+            expected = [engine.analyze(u, a, t) for u, a, t in zip(user_ids, amounts.tolist(), timestamps.tolist())]
+            reset_state()
+            got = RiskEngine().analyze_batch(user_ids, amounts, timestamps)
+        self.assertEqual(got, expected)
+        self.assertIn(("REJECTED", "Statistical Anomaly Detected"), got)
+
+    def test_batch_leaves_profile_stats_consistent(self):
+        """After a batch, the stored stats continue exactly like sequential updates"""
+        self.engine.analyze_batch(["u"] * 70, self.rng.lognormal(3, 1, 70), np.arange(70) * 20.0)
+        profile = self.engine.get_profile("u")
+        avg, std_dev = self.engine.profile_stats(profile)
+        self.assertAlmostEqual(avg, np.mean(list(profile.amounts)), places=8)
+        self.assertAlmostEqual(std_dev, np.std(list(profile.amounts)), places=8)
+
+class TestVelocityWindows(unittest.TestCase):
+    def setUp(self):
+        reset_state()
+
+    def test_event_timestamps_drive_velocity(self):
+        """A replayed backlog spaced 3s apart is not a burst, however fast it is scored"""
+        engine = RiskEngine()
+        verdicts = [engine.analyze("u", 10.0, 1000.0 + 3 * i) for i in range(10)]
+        self.assertTrue(all(status == "COMPLETED" for status, _ in verdicts))
+
+    def test_multiple_windows(self):
+        """Each configured window enforces its own limit"""
+        with mock.patch.object(main, 'VELOCITY_LIMITS', '1:2,60:8'):
+            engine = RiskEngine()
+        # 3 tx inside one second trips the 1s window
+        verdicts = [engine.analyze("fast", 10.0, 100.0 + 0.1 * i) for i in range(4)]
+        self.assertEqual(verdicts[-1][0], "REJECTED")
+        # 1 tx every 5s passes the 1s window but trips the 60s window on the 10th
+        verdicts = [engine.analyze("slow", 10.0, 100.0 + 5 * i) for i in range(10)]
+        self.assertEqual([v[0] for v in verdicts].index("REJECTED"), 9)
+
+    def test_window_expiry_pops_old_entries(self):
+        engine = RiskEngine()
+        for i in range(6):
+            engine.analyze("u", 10.0, 100.0 + i)
+        self.assertEqual(engine.analyze("u", 10.0, 106.0)[0], "REJECTED")
+        # 20s later every entry has left the 10s window
+        self.assertEqual(engine.analyze("u", 10.0, 126.0)[0], "COMPLETED")
+
+    def test_late_events_do_not_rewind_the_clock(self):
+        """An out-of-order event is scored at the user's latest event time"""
+        engine = RiskEngine()
+        for i in range(6):
+            engine.analyze("u", 10.0, 200.0 + i)
+        self.assertEqual(engine.analyze("u", 10.0, 50.0)[0], "REJECTED")
+
+    def test_batch_matches_sequential_with_several_windows(self):
+        rng = np.random.default_rng(3)
+        n = 2000
+        user_ids = rng.integers(0, 15, n).tolist()
+        amounts = rng.lognormal(3, 0.5, n)
+        timestamps = np.cumsum(rng.exponential(0.4, n))
+        timestamps[rng.random(n) < 0.05] -= 5  # a few late events
+        with mock.patch.object(main, 'VELOCITY_LIMITS', '1:2,10:5,60:20'):
+            engine = RiskEngine()
+            expected = [engine.analyze(u, a, t) for u, a, t in zip(user_ids, amounts.tolist(), timestamps.tolist())]
+            reset_state()
+            engine = RiskEngine()
+            got = engine.analyze_batch(user_ids[:700], amounts[:700], timestamps[:700])
+            got += engine.analyze_batch(user_ids[700:], amounts[700:], timestamps[700:])
+        self.assertEqual(got, expected)
+
+    def test_invalid_limits(self):
+        with mock.patch.object(main, 'VELOCITY_LIMITS', '10:60'):
+            with self.assertRaises(ValueError):
+                RiskEngine()
+
+    def test_parse_ledger_timestamp(self):
+        self.assertEqual(parse_timestamp("1970-01-01T00:01:40.500Z"), 100.5)
+        tx_id, user_id, amount, timestamp = decode_event(
+            b'{"transactionId": "1", "senderId": 4, "amount": 10, "timestamp": "2025-12-15T05:15:13.293Z"}')
+        self.assertAlmostEqual(timestamp, 1765775713.293, places=3)
+
+@register_rule
+class LargeAmountRule(Rule):
+    """Example custom rule: flat cap on the amount"""
+    name = 'large_amount'
+    reason = "Amount Above Hard Limit"
+    cost = 0
+
+    def __init__(self, cap=5000, cost=None):
+        super().__init__(cost)
+        self.cap = cap
+
+    def check(self, engine, profile, amount, current_time):
+        return amount > self.cap
+
+    def check_batch(self, engine, batch, events):
+        return batch.amounts[events] > self.cap
+
+class TestRulePlan(unittest.TestCase):
+    def setUp(self):
+        reset_state()
+
+    def test_cheap_rules_run_first(self):
+        engine = RiskEngine()
+        self.assertEqual([rule.name for rule in engine.plan.rules], ['structuring', 'velocity', 'anomaly'])
+
+    def test_short_circuit_still_records_history(self):
+        """A structuring hit skips the stateful rules, but the event still enters the profile"""
+        engine = RiskEngine()
+        velocity = engine.plan.rules[1]
+        with mock.patch.object(velocity, 'check', wraps=velocity.check) as check:
+            status, reason = engine.analyze("u", 9900.0, 1.0)
+        self.assertEqual((status, reason), ("REJECTED", "Potential Structuring Detected"))
+        check.assert_not_called()
+        self.assertEqual(len(engine.get_profile("u")), 1)
+        self.assertEqual(engine.rule_stats()['structuring'], {"calls": 1, "hits": 1, "seconds": mock.ANY})
+        self.assertEqual(engine.rule_stats()['velocity']['calls'], 0)
+
+    def test_batch_counters_match_sequential(self):
+        rng = np.random.default_rng(8)
+        n = 1500
+        user_ids = rng.integers(0, 20, n).tolist()
+        amounts = rng.lognormal(3, 1, n)
+        amounts[rng.random(n) < 0.03] = 9700.0
+        timestamps = np.cumsum(rng.exponential(0.3, n))
+        sequential = RiskEngine(store=main.ProfileStore())
+        expected = [sequential.analyze(u, a, t) for u, a, t in zip(user_ids, amounts.tolist(), timestamps.tolist())]
+        batched = RiskEngine(store=main.ProfileStore())
+        got = batched.analyze_batch(user_ids[:600], amounts[:600], timestamps[:600])
+        got += batched.analyze_batch(user_ids[600:], amounts[600:], timestamps[600:])
+        self.assertEqual(got, expected)
+        strip = lambda stats: {name: (s["calls"], s["hits"]) for name, s in stats.items()}
+        self.assertEqual(strip(batched.rule_stats()), strip(sequential.rule_stats()))
+        self.assertEqual(batched.rule_stats()['structuring']['calls'], n)
+        self.assertGreater(batched.rule_stats()['velocity']['hits'], 0)
+
+    def test_declared_config_and_custom_rules(self):
+        specs = [{"rule": "anomaly", "sigma": 2, "min_history": 3}, {"rule": "velocity", "limits": "1:2"},
+                 {"rule": "large_amount", "cap": 1000}]
+        rng = np.random.default_rng(4)
+        user_ids = rng.integers(0, 5, 400).tolist()
+        amounts = rng.lognormal(4, 1.2, 400)
+        timestamps = np.cumsum(rng.exponential(0.5, 400))
+        engine = RiskEngine(store=main.ProfileStore(), rules=specs)
+        self.assertEqual([rule.name for rule in engine.plan.rules], ['large_amount', 'velocity', 'anomaly'])
+        expected = [engine.analyze(u, a, t) for u, a, t in zip(user_ids, amounts.tolist(), timestamps.tolist())]
+        got = RiskEngine(store=main.ProfileStore(), rules=specs).analyze_batch(user_ids, amounts, timestamps)
+        self.assertEqual(got, expected)
+        self.assertIn(("REJECTED", "Amount Above Hard Limit"), got)
+
+    def test_invalid_specs(self):
+        with self.assertRaises(ValueError):
+            RiskEngine(rules=[{"rule": "nope"}])
+        with self.assertRaises(ValueError):
+            RiskEngine(rules=[{"rule": "velocity"}, {"rule": "velocity", "limits": "1:2"}])
+
+class TestBatchConsumer(unittest.TestCase):
+    def setUp(self):
+        reset_state()
+        self.events = [{"transactionId": str(1000 + i), "senderId": 7, "amount": amt}
+                       for i, amt in enumerate([10, 12, 10, 11, 10, 9900, 5000, 10])]
+        self.events.append({"transactionId": "2000", "senderId": 8, "amount": 25})
+
+    def run_consumer(self, batch):
+        """Feeds the events through one consumer mode and returns the ledger callbacks"""
+        reset_state()
+        ch = FakeChannel()
+        messages = make_messages(self.events)
+        with mock.patch.object(main, 'PROCESSING_DELAY', 0), mock.patch.object(main, 'ledger') as ledger:
+            if batch:
+                main.process_batch(ch, messages)
+            else:
+                for method, props, body in messages:
+                    main.process_transaction(ch, method, props, body)
+        return queued_updates(ledger), ch.acks
+
+    def test_batch_matches_single_mode(self):
+        """Batch mode must post exactly the same verdicts as single-message mode"""
+        single, _ = self.run_consumer(batch=False)
+        batched, _ = self.run_consumer(batch=True)
+        self.assertEqual(batched, single)
+        self.assertIn({"transactionId": "1005", "status": "REJECTED"}, batched)
+
+    def test_single_mode_records_the_same_metrics(self):
+        """Single mode counts decisions and queue-to-verdict latency per event, like batch mode per batch"""
+        def recorded(batch):
+            before = dict(main.DECISIONS.values), main.QUEUE_TO_VERDICT.series()[0][1]['counts']
+            self.run_consumer(batch)
+            after = main.QUEUE_TO_VERDICT.series()[0][1]['counts']
+            decisions = {key: value - before[0].get(key, 0) for key, value in main.DECISIONS.values.items()}
+            return {key: value for key, value in decisions.items() if value}, sum(after) - sum(before[1])
+        self.run_consumer(batch=True)  # creates the histogram series
+        self.assertEqual(recorded(batch=False), recorded(batch=True))
+        self.assertEqual(recorded(batch=False)[1], len(self.events))
+
+    def test_batch_acks_once_with_multiple(self):
+        """The whole batch is acked with one multiple=True ack on the last delivery tag"""
+        _, acks = self.run_consumer(batch=True)
+        self.assertEqual(acks, [(len(self.events), True)])
+
+    def test_binary_messages_match_json(self):
+        """One binary message carrying every event scores like the JSON messages, in both modes"""
+        expected, _ = self.run_consumer(batch=True)
+        body = encode_events([e["transactionId"] for e in self.events], [e["senderId"] for e in self.events],
+                             [e["amount"] for e in self.events], [time.time()] * len(self.events))
+        message = (SimpleNamespace(delivery_tag=1), SimpleNamespace(content_type=EVENT_CONTENT_TYPE), body)
+        for batch in (True, False):
+            reset_state()
+            ch = FakeChannel()
+            with mock.patch.object(main, 'PROCESSING_DELAY', 0), mock.patch.object(main, 'ledger') as ledger:
+                if batch:
+                    main.process_batch(ch, [message])
+                else:
+                    main.process_transaction(ch, *message)
+            self.assertEqual(queued_updates(ledger), expected)
+            self.assertEqual(len(ch.acks), 1)
+
+    def test_batch_skips_malformed_messages(self):
+        """A bad message is dropped but still acked with the rest of the batch"""
+        ch = FakeChannel()
+        messages = make_messages(self.events[:2]) + [(SimpleNamespace(delivery_tag=3), None, b'not json')]
+        with mock.patch.object(main, 'PROCESSING_DELAY', 0), mock.patch.object(main, 'ledger') as ledger:
+            main.process_batch(ch, messages)
+        self.assertEqual(len(queued_updates(ledger)), 2)
+        self.assertEqual(ch.acks, [(3, True)])
+
+    def test_no_ack_until_updates_are_queued(self):
+        """If the outbox cannot be written the batch is requeued instead of acked"""
+        ch = FakeChannel()
+        ch.basic_nack = mock.Mock()
+        with mock.patch.object(main, 'PROCESSING_DELAY', 0), mock.patch.object(main, 'ledger') as ledger:
+            ledger.enqueue.side_effect = OSError("disk full")
+            main.process_batch(ch, make_messages(self.events))
+        self.assertEqual(ch.acks, [])
+        ch.basic_nack.assert_called_once_with(delivery_tag=len(self.events), multiple=True, requeue=True)
+
+    def test_shutdown_finishes_batch_then_cancels(self):
+        """After SIGTERM the batch in hand is scored and acked, the rest goes back to the queue"""
+        ch = FakeChannel()
+        ch.cancel = mock.Mock()
+        messages = make_messages(self.events)
+
+        def consume(queue, inactivity_timeout=None):
+            for i, message in enumerate(messages):
+                if i == 3:
+                    main.shutdown.set()
+                yield message
+
+        ch.consume = consume
+        try:
+            with mock.patch.object(main, 'PROCESSING_DELAY', 0), mock.patch.object(main, 'ledger') as ledger:
+                main.consume_batches(ch)
+        finally:
+            main.shutdown.clear()
+        self.assertEqual(len(queued_updates(ledger)), 4)
+        self.assertEqual(ch.acks, [(4, True)])
+        ch.cancel.assert_called_once()
+
+class TestScoringCost(unittest.TestCase):
+    def test_cost_models(self):
+        with mock.patch.object(main, 'SCORING_COST', 'none'):
+            start = time.perf_counter()
+            main.simulate_scoring_cost(100)
+            self.assertLess(time.perf_counter() - start, 0.1)
+        with mock.patch.object(main, 'SCORING_COST', 'cpu'), mock.patch.object(main, 'PROCESSING_DELAY', 0), \
+                mock.patch.object(main, 'SCORING_COST_PER_EVENT', 0.001):
+            start = time.process_time()
+            main.simulate_scoring_cost(50)
+            self.assertGreaterEqual(time.process_time() - start, 0.04)
+
+    def test_custom_cost_model(self):
+        self.addCleanup(main.load_cost_model.cache_clear)
+        with mock.patch.object(main, 'SCORING_COST', 'time:sleep'), mock.patch.object(main.time, 'sleep') as sleep:
+            main.simulate_scoring_cost(10)
+        sleep.assert_called_once_with(main.PROCESSING_DELAY)
+        with self.assertRaises(ValueError):
+            main.load_cost_model('bogus')
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
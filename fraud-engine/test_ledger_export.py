@@ -0,0 +1,116 @@
+import unittest
+import io
+import json
+import os
+import tempfile
+import numpy as np
+from backtest import iter_ledger
+from ledger_export import LedgerColumns, export_ledger, reconcile, opening_balances, show
+
+def simulate_ledger(n, seed=3):
+    """A ledger the way the ledger service builds it: debit on transfer, refund on REJECTED, credit on COMPLETED"""
+    rng = np.random.default_rng(seed)
+    balances = {1: 10000.0, 2: 50000.0}
+    balances.update({u: 1000.0 for u in range(3, 40)})
+    transactions = {}
+    for i in range(n):
+        sender, recipient = (int(u) for u in rng.choice(list(balances), 2, replace=False))
+        amount = float(np.round(rng.uniform(1, 50), 2))
+        if balances[sender] < amount:
+            continue
+        balances[sender] -= amount
+        status = str(rng.choice(["PENDING", "COMPLETED", "REJECTED"], p=[0.1, 0.8, 0.1]))
+        if status == "REJECTED":
+            balances[sender] += amount
+        elif status == "COMPLETED":
+            balances[recipient] += amount
+        tx_id = str(1000 + i)
+        transactions[tx_id] = {"transactionId": tx_id, "senderId": sender, "recipientId": str(recipient),
+                               "amount": amount, "timestamp": "2025-12-15T05:15:13.293Z", "status": status}
+    return {"accounts": [{"userId": u, "balance": b} for u, b in balances.items()],
+            "transactions": transactions, "currentTransactionId": 1000 + n}
+
+def settle(ledger, tx_id, status):
+    """Applies a verdict to a PENDING transaction, like applyStatusUpdate()"""
+    tx = ledger["transactions"][tx_id]
+    tx["status"] = status
+    accounts = {a["userId"]: a for a in ledger["accounts"]}
+    user = tx["senderId"] if status == "REJECTED" else int(tx["recipientId"])
+    accounts[user]["balance"] += tx["amount"]
+
+class TestLedgerExport(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'ledger_db.json')
+        self.directory = os.path.join(tmp.name, 'columns')
+        self.ledger = simulate_ledger(2000)
+
+    def export(self, chunk_size=300):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump(self.ledger, f, indent=2)
+        return export_ledger(self.path, self.directory, chunk_size=chunk_size, read_chunk=4096)
+
+    def test_reads_accounts_and_transactions(self):
+        text = json.dumps({"accounts": [{"userId": 1, "note": "} ] \"{"}], "transactions": {"1000": {"x": "}, "}},
+                           "currentTransactionId": 1001}, indent=2)
+        for chunk_size in (5, 4096):
+            got = list(iter_ledger(io.StringIO(text), ('accounts', 'transactions'), chunk_size))
+            self.assertEqual(got, [('accounts', {"userId": 1, "note": "} ] \"{"}), ('transactions', {"x": "}, "})])
+
+    def test_export_and_reconcile(self):
+        report = self.export()
+        ledger = LedgerColumns(self.directory)
+        self.assertEqual((report['appended'], report['malformed']), (len(self.ledger["transactions"]), 0))
+        self.assertEqual(len(ledger), ledger.rows)
+        tx = self.ledger["transactions"]["1500"]
+        self.assertEqual(show(ledger, transaction_id=1500)[0], dict(tx, recipientId=int(tx["recipientId"]),
+                                                                    timestamp=1765775713.293))
+        self.assertEqual([r["transactionId"] for r in show(ledger, sender_id=7)],
+                         [t for t, tx in self.ledger["transactions"].items() if tx["senderId"] == 7])
+        self.assertEqual(ledger.find([999, 1000]).tolist()[0], -1)
+
+        result = reconcile(ledger)
+        self.assertEqual(result['mismatched'], 0)
+        pending = [tx["amount"] for tx in self.ledger["transactions"].values() if tx["status"] == "PENDING"]
+        self.assertAlmostEqual(result['in_flight'], sum(pending))
+
+        # A balance the transactions do not explain, and a wrong opening balance
+        self.ledger["accounts"][5]["balance"] += 25
+        self.export()
+        ledger = LedgerColumns(self.directory)
+        result = reconcile(ledger, opening_balances(ledger.account_ids, overrides={9: 900.0}))
+        self.assertEqual(result['mismatched'], 2)
+        worst = {account['userId']: account['difference'] for account in result['worst']}
+        self.assertAlmostEqual(worst[9], 100.0)
+        self.assertAlmostEqual(worst[self.ledger["accounts"][5]["userId"]], 25.0)
+
+    def test_reexport_appends_changes_only(self):
+        self.export()
+        rows = LedgerColumns(self.directory).rows
+        pending = [t for t, tx in self.ledger["transactions"].items() if tx["status"] == "PENDING"]
+        for tx_id in pending[:10]:
+            settle(self.ledger, tx_id, "COMPLETED")
+        settle(self.ledger, pending[10], "REJECTED")
+        self.ledger["transactions"]["9999"] = {"transactionId": "9999", "senderId": 3, "recipientId": "4",
+                                               "amount": "abc", "status": "PENDING"}
+        report = self.export()
+        self.assertEqual((report['appended'], report['updated'], report['malformed']), (11, 11, 1))
+
+        ledger = LedgerColumns(self.directory)
+        self.assertEqual(ledger.rows, rows + 11)
+        self.assertEqual(show(ledger, transaction_id=int(pending[10]))[0]["status"], "REJECTED")
+        self.assertEqual(ledger.record(ledger.find([int(pending[0])])[0])["status"], "COMPLETED")
+        self.assertEqual(reconcile(ledger)['mismatched'], 0)
+
+    def test_torn_tail_is_truncated(self):
+        self.export()
+        with open(os.path.join(self.directory, 'amount.bin'), 'ab') as f:
+            f.write(b'\x01\x02\x03')  # a crashed export
+        report = self.export()
+        self.assertEqual(report['appended'], 0)
+        self.assertEqual(os.path.getsize(os.path.join(self.directory, 'amount.bin')), report['rows'] * 8)
+        self.assertEqual(reconcile(LedgerColumns(self.directory))['mismatched'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import unittest
+import io
+import json
+import logging
+import numpy as np
+import logs
+from metrics import Registry, merge, render
+
+class TestMetrics(unittest.TestCase):
+    def test_counter_and_function_render(self):
+        registry = Registry()
+        decisions = registry.counter('fraud_engine_decisions_total', "Verdicts.", labels=('status', 'reason'))
+        decisions.inc(3, ('REJECTED', 'Structuring'))
+        decisions.inc(labels=('COMPLETED', 'OK'))
+        registry.gauge('fraud_engine_profiles', "Profiles.", function=lambda: 42)
+        text = registry.render()
+        self.assertIn('# TYPE fraud_engine_decisions_total counter\n', text)
+        self.assertIn('fraud_engine_decisions_total{status="REJECTED",reason="Structuring"} 3\n', text)
+        self.assertIn('fraud_engine_decisions_total{status="COMPLETED",reason="OK"} 1\n', text)
+        self.assertIn('fraud_engine_profiles 42\n', text)
+        # Registering the same name again returns the same instrument
+        self.assertIs(registry.counter('fraud_engine_decisions_total', "Verdicts."), decisions)
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = Registry()
+        latency = registry.histogram('latency_seconds', "Latency.", buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            latency.observe(value)
+        text = registry.render()
+        self.assertIn('latency_seconds_bucket{le="0.1"} 2\n', text)
+        self.assertIn('latency_seconds_bucket{le="1.0"} 3\n', text)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 4\n', text)
+        self.assertIn('latency_seconds_count 4\n', text)
+        self.assertIn('latency_seconds_sum 3.65\n', text)
+
+    def test_observe_many_matches_observe(self):
+        values = np.random.default_rng(1).exponential(0.05, 1000)
+        values[:3] = [0.001, 0.0025, 60.0]  # on bucket boundaries
+        one, many = Registry(), Registry()
+        for value in values:
+            one.histogram('h', "H.").observe(value)
+        many.histogram('h', "H.").observe_many(values)
+        a, b = one.state()['h']['series'][0][1], many.state()['h']['series'][0][1]
+        self.assertEqual(a['counts'], b['counts'])
+        self.assertAlmostEqual(a['sum'], b['sum'])
+
+    def test_worker_states_merge(self):
+        states = []
+        for worker in range(3):
+            registry = Registry()
+            registry.counter('events_total', "Events.").inc(10)
+            registry.gauge('lag_seconds', "Lag.", merge='max').set(float(worker))
+            registry.gauge('profiles', "Profiles.").set(100)
+            registry.histogram('latency_seconds', "Latency.", buckets=(1.0,)).observe(0.5)
+            states.append(json.loads(json.dumps(registry.state())))  # as read back from the export files
+        merged = merge(states)
+        self.assertEqual(merged['events_total']['series'][()], 30)
+        self.assertEqual(merged['lag_seconds']['series'][()], 2.0)
+        self.assertEqual(merged['profiles']['series'][()], 300)
+        self.assertEqual(merged['latency_seconds']['series'][()]['counts'], [3, 0])
+        self.assertIn('latency_seconds_count 3\n', render(states))
+
+    def test_broken_collector_does_not_break_the_page(self):
+        registry = Registry()
+        registry.gauge('broken', "Broken.", function=lambda: 1 / 0)
+        registry.counter('ok_total', "Fine.").inc()
+        self.assertIn('ok_total 1\n', registry.render())
+
+class TestLogs(unittest.TestCase):
+    def tearDown(self):
+        logs.configure(stream=io.StringIO())
+
+    def test_json_lines_carry_fields(self):
+        stream = io.StringIO()
+        logs.configure(level='INFO', format='json', stream=stream)
+        logs.log.info(" 🛑 BLOCKED", extra=logs.fields(transactionId=7, reason="Structuring"))
+        logs.log.debug("per-event noise")
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(len(lines), 1)
+        entry = json.loads(lines[0])
+        self.assertEqual((entry['level'], entry['transactionId'], entry['reason']), ('info', 7, 'Structuring'))
+        self.assertFalse(logs.log.isEnabledFor(logging.DEBUG))
+
+    def test_sampler(self):
+        sampled = logs.Sampler(0.01)
+        self.assertEqual(sum(sampled() for _ in range(1000)), 10)
+        self.assertTrue(all(logs.Sampler(1)() for _ in range(5)))
+        self.assertFalse(any(logs.Sampler(0)() for _ in range(5)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+import unittest
+import threading
+from unittest import mock
+import numpy as np
+from profiles import ProfileStore, RemoteProfileStore
+from resp import LocalRedisServer, RespClient, RespError
+from main import RiskEngine
+
+class TestProfileStore(unittest.TestCase):
+    def test_ring_buffer_keeps_last_entries_in_order(self):
+        """Only the newest history_size entries survive, oldest first"""
+        store = ProfileStore(capacity=4)
+        profile = store.get_profile("u")
+        for i in range(120):
+            profile.push(float(i), float(i))
+        self.assertEqual(len(profile), 50)
+        self.assertEqual(profile.amounts.tolist(), [float(i) for i in range(70, 120)])
+        self.assertEqual(profile.oldest_amount(), 70.0)
+
+    def test_grows_past_initial_capacity(self):
+        store = ProfileStore(capacity=2)
+        engine = RiskEngine(store=store)
+        for user in range(100):
+            engine.analyze(user, 10.0, 1.0)
+        self.assertEqual(len(store), 100)
+        self.assertGreaterEqual(store.capacity, 100)
+        self.assertEqual(len(store.get_profile(42)), 1)
+
+    def test_lru_eviction_when_full(self):
+        """A bounded store evicts the least recently seen users first"""
+        store = ProfileStore(capacity=8, max_users=8)
+        engine = RiskEngine(store=store)
+        for user in range(8):
+            engine.analyze(user, 10.0, float(user))
+        engine.analyze(0, 10.0, 100.0)  # user 0 becomes the most recent
+        engine.analyze("new", 10.0, 101.0)
+        self.assertEqual(len(store), 8)
+        self.assertIn(0, store)
+        self.assertIn("new", store)
+        self.assertNotIn(1, store)
+
+    def test_batch_never_evicts_its_own_users(self):
+        store = ProfileStore(capacity=4, max_users=4)
+        engine = RiskEngine(store=store)
+        engine.analyze_batch([1, 2, 3, 4], [10.0] * 4, [1.0] * 4)
+        verdicts = engine.analyze_batch([1, 5, 6], [10.0] * 3, [2.0] * 3)
+        self.assertEqual(len(verdicts), 3)
+        self.assertIn(1, store)
+        self.assertEqual(len(store.get_profile(1)), 2)
+
+    def test_ttl_eviction(self):
+        store = ProfileStore(ttl=60)
+        engine = RiskEngine(store=store)
+        engine.analyze("idle", 10.0, 0.0)
+        engine.analyze("busy", 10.0, 50.0)
+        engine.analyze("busy", 10.0, 100.0)
+        self.assertNotIn("idle", store)
+        self.assertIn("busy", store)
+
+    def test_memory_usage_is_compact(self):
+        store = ProfileStore(capacity=10000)
+        engine = RiskEngine(store=store)
+        engine.analyze_batch(np.arange(10000).tolist(), np.full(10000, 10.0), np.zeros(10000))
+        usage = store.memory_usage()
+        self.assertEqual(usage['users'], 10000)
+        self.assertLess(usage['bytes_per_user'], 1200)
+
+class TestRemoteProfileStore(unittest.TestCase):
+    def setUp(self):
+        self.server = LocalRedisServer().start()
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        self.server.stop()
+
+    def replica(self, **kwargs):
+        """A RiskEngine with its own connection, like one engine pod"""
+        client = RespClient('127.0.0.1', self.server.port)
+        self.clients.append(client)
+        return RiskEngine(store=RemoteProfileStore(client, **kwargs))
+
+    def test_replicas_share_history(self):
+        """Events spread over two replicas are scored as if one engine saw them all"""
+        rng = np.random.default_rng(5)
+        n = 600
+        user_ids = rng.integers(0, 10, n).tolist()
+        amounts = rng.lognormal(3, 1, n)
+        amounts[::97] = 9800.0
+        timestamps = np.cumsum(rng.exponential(0.5, n))
+        expected = RiskEngine(store=ProfileStore()).analyze_batch(user_ids, amounts, timestamps)
+
+        replicas = [self.replica(), self.replica()]
+        got = []
+        for i, lo in enumerate(range(0, n, 50)):
+            got += replicas[i % 2].analyze_batch(user_ids[lo:lo + 50], amounts[lo:lo + 50], timestamps[lo:lo + 50])
+        self.assertEqual(got, expected)
+
+        first, second = replicas
+        first.analyze("solo", 10.0, 1.0)
+        self.assertEqual(len(second.get_profile("solo")), 1)
+
+    def test_one_round_trip_per_direction(self):
+        """A batch reads all its users in one pipelined call and writes them back in another"""
+        engine = self.replica()
+        client = engine.store.client
+        with mock.patch.object(client, 'pipeline', wraps=client.pipeline) as pipeline:
+            engine.analyze_batch(list(range(200)), np.full(200, 10.0), np.zeros(200))
+        self.assertEqual(pipeline.call_count, 2)
+        self.assertEqual(self.server.dispatch([b'DBSIZE']), 200)
+
+    def test_concurrent_updates_are_not_lost(self):
+        """A replica whose users were updated by another one since it read them scores its batch again"""
+        first, second = self.replica(), self.replica()
+        read = first.store.rows_for
+
+        def interleaved(user_ids):
+            rows = read(user_ids)
+            if first.store.conflicts == 0:
+                second.analyze_batch([7, 7], [10.0, 10.0], [1.0, 2.0])  # lands between the read and the commit
+            return rows
+        with mock.patch.object(first.store, 'rows_for', side_effect=interleaved):
+            first.analyze_batch([7, 8, 7], [10.0, 10.0, 10.0], [3.0, 3.0, 4.0])
+        self.assertEqual(first.store.conflicts, 1)
+        self.assertEqual(self.replica().get_profile(7).amounts.tolist(), [10.0] * 4)
+
+    def test_concurrent_burst_counts_every_event(self):
+        """Scorers racing on one sender (a bot burst) keep every event in its history"""
+        replicas = [self.replica() for _ in range(4)]
+        for engine in replicas:
+            engine.COMMIT_ATTEMPTS = 100
+
+        def score(engine):
+            for i in range(10):
+                engine.analyze("bot", 10.0, float(i))
+        threads = [threading.Thread(target=score, args=(engine,)) for engine in replicas]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.replica().get_profile("bot").updates, 40)
+
+    def test_exec_aborts_on_watched_write(self):
+        clients = [RespClient('127.0.0.1', self.server.port) for _ in range(2)]
+        self.clients.extend(clients)
+        watcher, writer = clients
+        watcher.execute('WATCH', 'k')
+        writer.execute('SET', 'k', 'other')
+        self.assertIsNone(watcher.pipeline([('MULTI',), ('SET', 'k', 'mine'), ('EXEC',)])[-1])
+        self.assertEqual(writer.execute('GET', 'k'), b'other')
+        watcher.execute('WATCH', 'k')
+        self.assertEqual(watcher.pipeline([('MULTI',), ('SET', 'k', 'mine'), ('EXEC',)])[-1], ['OK'])
+
+    def test_remote_ttl(self):
+        engine = self.replica(ttl=30)
+        engine.analyze("u", 10.0, 1.0)
+        key = engine.store.key("u").encode()
+        self.assertIn(key, self.server.expires)
+
+    def test_error_replies_raise(self):
+        client = RespClient('127.0.0.1', self.server.port)
+        self.clients.append(client)
+        with self.assertRaises(RespError):
+            client.execute('NOPE')
+        self.assertEqual(client.execute('PING'), 'PONG')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+import unittest
+import json
+from types import SimpleNamespace
+from unittest import mock
+import numpy as np
+import main
+from main import RiskEngine
+from profiles import ProfileStore
+from sharding import HashRing, ShardRouter, PartitionWorker, partition_queue, RING_QUEUE
+from wire import EVENT_CONTENT_TYPE, encode_events, decode_records
+
+class FakeBroker:
+    """In-memory stand-in for a RabbitMQ channel: named FIFO queues, publish, get and ack"""
+    def __init__(self):
+        self.queues = {}
+        self.unacked = {}
+        self.tag = 0
+
+    def queue_declare(self, queue, **kwargs):
+        self.queues.setdefault(queue, [])
+        return SimpleNamespace(method=SimpleNamespace(queue=queue))
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        self.tag += 1
+        self.queues.setdefault(routing_key, []).append((SimpleNamespace(delivery_tag=self.tag), properties, body))
+
+    def basic_get(self, queue):
+        if not self.queues.get(queue):
+            return None, None, None
+        message = self.queues[queue].pop(0)
+        self.unacked[message[0].delivery_tag] = (queue, message)
+        return message
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.unacked.pop(delivery_tag, None)
+
+    def reconnect(self):
+        """The channel closed: unacked messages go back to the head of their queue"""
+        for queue, message in reversed(list(self.unacked.values())):
+            self.queues[queue].insert(0, message)
+        self.unacked = {}
+
+    def take(self, queue, limit):
+        pending = self.queues.get(queue, [])
+        messages, self.queues[queue] = pending[:limit], pending[limit:]
+        return messages
+
+class TestHashRing(unittest.TestCase):
+    def test_balanced_and_stable(self):
+        users = range(20000)
+        ring = HashRing(4)
+        counts = np.bincount([ring.partition_for(u) for u in users], minlength=4)
+        self.assertLess(counts.max() / counts.min(), 1.5)
+        # Same answer in every process (no salted hash)
+        self.assertEqual(ring.partition_for(42), HashRing(4).partition_for("42"))
+
+    def test_growing_moves_few_users(self):
+        """4 -> 5 partitions should move about 1/5 of the users, and only onto the new partition"""
+        old, new = HashRing(4), HashRing(5)
+        moved = [u for u in range(20000) if old.partition_for(u) != new.partition_for(u)]
+        self.assertLess(len(moved) / 20000, 0.3)
+        self.assertTrue(all(new.partition_for(u) == 4 for u in moved))
+
+class TestShardedConsumption(unittest.TestCase):
+    def setUp(self):
+        main.reset_state()  # also forgets the transactionIds other tests scored
+        rng = np.random.default_rng(11)
+        n = 1500
+        self.events = [{"transactionId": str(i), "senderId": int(u), "amount": float(a), "timestamp": float(t)}
+                       for i, (u, a, t) in enumerate(zip(rng.integers(0, 40, n), np.round(rng.lognormal(3, 1, n), 2),
+                                                          np.cumsum(rng.exponential(0.3, n))))]
+        reference = RiskEngine(store=ProfileStore())
+        verdicts = reference.analyze_batch([e["senderId"] for e in self.events], [e["amount"] for e in self.events],
+                                           [e["timestamp"] for e in self.events])
+        self.expected = {e["transactionId"]: status for e, (status, _) in zip(self.events, verdicts)}
+
+    def drain(self, broker, workers, router):
+        """Runs every worker until all partition queues are empty, delivering confirmations to the router"""
+        busy = True
+        while busy:
+            busy = False
+            for worker in workers:
+                batch = broker.take(worker.queue, 50)
+                if batch:
+                    busy = True
+                    worker.handle_batch(broker, batch)
+            for _, _, body in broker.take('replies', 1000):
+                router.on_confirm(json.loads(body)['partition'])
+
+    def test_rebalance_keeps_decisions(self):
+        """Routing to 3 partitions, then rebalancing to 5, scores exactly like one engine"""
+        broker = FakeBroker()
+        router = ShardRouter(broker, partitions=3)
+        workers = [PartitionWorker(p) for p in range(5)]
+        half = len(self.events) // 2
+
+        with mock.patch.object(main, 'PROCESSING_DELAY', 0), mock.patch.object(main, 'ledger') as ledger:
+            for i, event in enumerate(self.events[:half]):
+                router.on_event(broker, SimpleNamespace(delivery_tag=i), None, json.dumps(event))
+            self.drain(broker, workers[:3], router)
+
+            router.start_rebalance(5, 'replies')
+            for i, event in enumerate(self.events[half:]):
+                router.on_event(broker, SimpleNamespace(delivery_tag=i), None, json.dumps(event))
+            self.assertEqual(len(router.held), len(self.events) - half)
+            self.drain(broker, workers, router)
+            self.assertFalse(router.rebalancing)
+
+        posted = {tx_id: status for c in ledger.enqueue.call_args_list for tx_id, status in c.args[0]}
+        self.assertEqual(posted, self.expected)
+        # Every user now lives only on its new owner
+        ring = HashRing(5)
+        for worker in workers:
+            self.assertTrue(all(ring.partition_for(u) == worker.partition for u in worker.scorer.store.index))
+
+    def test_restarted_router_keeps_the_active_ring(self):
+        broker = FakeBroker()
+        router = ShardRouter(broker, partitions=3)
+        router.start_rebalance(5, 'replies')
+        for p in range(3):
+            router.on_confirm(p)
+        self.assertEqual(router.ring.partitions, 5)
+
+        broker.reconnect()
+        self.assertEqual(ShardRouter(broker, partitions=3).ring.partitions, 5)
+        self.assertEqual(len(broker.queues[RING_QUEUE]), 0)  # held by the running router
+        broker.reconnect()
+        self.assertEqual(len(broker.queues[RING_QUEUE]), 1)
+
+    def test_worker_shuts_down_cleanly(self):
+        channel = mock.Mock()
+        self.addCleanup(setattr, main, 'metrics_engine', main.engine)
+        worker = PartitionWorker(2)
+        worker.scorer.analyze_batch([7, 8, 9], [10.0, 20.0, 30.0], [1.0, 2.0, 3.0])
+        with mock.patch.object(main, 'ledger') as ledger, mock.patch.object(main, 'install_shutdown_handler') as handler, \
+                mock.patch('sharding.consume_batches') as consume:
+            worker.run(channel)
+        handler.assert_called_once_with(channel, batches=True)
+        consume.assert_called_once()
+        ledger.close.assert_called_once_with()
+        channel.connection.close.assert_called_once_with()
+        # The rule and profile metrics follow the worker's scorer, not main.engine
+        self.assertIn('fraud_engine_profiles 3\n', main.REGISTRY.render())
+
+    def test_events_land_on_owner_partition(self):
+        broker = FakeBroker()
+        router = ShardRouter(broker, partitions=4)
+        for i, event in enumerate(self.events[:200]):
+            router.on_event(broker, SimpleNamespace(delivery_tag=i), None, json.dumps(event))
+        for p in range(4):
+            senders = {json.loads(body)["senderId"] for _, _, body in broker.queues[partition_queue(p)]}
+            self.assertTrue(all(router.ring.partition_for(s) == p for s in senders))
+
+    def test_binary_messages_are_split_by_owner(self):
+        broker = FakeBroker()
+        router = ShardRouter(broker, partitions=4)
+        events = self.events[:200]
+        body = encode_events([e["transactionId"] for e in events], [e["senderId"] for e in events],
+                             [e["amount"] for e in events], [e["timestamp"] for e in events])
+        router.on_event(broker, SimpleNamespace(delivery_tag=1), SimpleNamespace(content_type=EVENT_CONTENT_TYPE), body)
+        routed = 0
+        for p in range(4):
+            for _, properties, part in broker.queues[partition_queue(p)]:
+                self.assertEqual(properties.content_type, EVENT_CONTENT_TYPE)
+                records = decode_records(part)
+                routed += len(records)
+                self.assertTrue(all(router.ring.partition_for(s) == p for s in records['sender_id'].tolist()))
+        self.assertEqual(routed, 200)
+
+if __name__ == '__main__':
+    unittest.main()
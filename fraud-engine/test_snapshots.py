@@ -0,0 +1,96 @@
+import unittest
+import os
+import tempfile
+import numpy as np
+from main import RiskEngine
+from profiles import ProfileStore
+from snapshots import ProfileSnapshots, read_journal
+
+def synthetic_batches(batches, size=50, users=30, seed=5):
+    rng = np.random.default_rng(seed)
+    clock = 1.7e9
+    for _ in range(batches):
+        times = clock + np.cumsum(rng.exponential(0.5, size))
+        clock = times[-1]
+        yield rng.integers(0, users, size).tolist(), np.round(rng.lognormal(3, 1, size), 2), times
+
+class TestProfileSnapshots(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = tmp.name
+
+    def assertSameProfiles(self, a, b):
+        """Same users with the same history and statistics (ring slots outside the history may differ)"""
+        self.assertEqual(set(a.index), set(b.index))
+        for user_id in a.index:
+            pa, pb = a.get_profile(user_id), b.get_profile(user_id)
+            self.assertEqual(pa.amounts.tolist(), pb.amounts.tolist())
+            self.assertEqual(pa.timestamps.tolist(), pb.timestamps.tolist())
+            for name in ('mean', 'm2', 'ewm_mean', 'ewm_var', 'updates', 'last_seen'):
+                self.assertEqual(getattr(pa, name), getattr(pb, name), name)
+            self.assertEqual(a.window_start[pa.row].tolist(), b.window_start[pb.row].tolist())
+
+    def test_snapshot_plus_journal_rebuilds_state(self):
+        """A 'crashed' engine (never closed) is rebuilt exactly from its last snapshot and journal tail"""
+        engine = RiskEngine(store=ProfileStore(capacity=4))
+        snapshots = ProfileSnapshots(self.directory, interval=0)
+        snapshots.restore(engine)
+        for i, (users, amounts, times) in enumerate(synthetic_batches(8)):
+            engine.analyze_batch(users, amounts, times)
+            if i == 4:
+                snapshots.maybe_snapshot(engine)
+        engine.analyze(7, 9800.0, 1.8e9)
+        snapshots.writer.join()
+
+        restored = RiskEngine(store=ProfileStore(capacity=4))
+        info = ProfileSnapshots(self.directory).restore(restored)
+        self.assertEqual(info['replayed_events'], 3 * 50 + 1)
+        self.assertSameProfiles(engine.store, restored.store)
+        # Both keep scoring identically
+        for users, amounts, times in synthetic_batches(3, seed=6):
+            times = times + 1e8
+            self.assertEqual(engine.analyze_batch(users, amounts, times), restored.analyze_batch(users, amounts, times))
+
+    def test_restart_maps_columns_lazily(self):
+        engine = RiskEngine(store=ProfileStore())
+        snapshots = ProfileSnapshots(self.directory)
+        snapshots.restore(engine)
+        for users, amounts, times in synthetic_batches(2):
+            engine.analyze_batch(users, amounts, times)
+        engine.analyze("alice", 25.0, 1.8e9)  # not every user id is an integer
+        snapshots.close(engine)
+
+        restored = RiskEngine(store=ProfileStore())
+        info = ProfileSnapshots(self.directory).restore(restored)
+        self.assertEqual(info['replayed_events'], 0)
+        self.assertIsInstance(restored.store.amounts, np.memmap)
+        self.assertSameProfiles(engine.store, restored.store)
+        # Copy-on-write: scoring after the restart never modifies the snapshot on disk
+        path = os.path.join(self.directory, 'snapshot-000002', 'amounts.npy')
+        with open(path, 'rb') as f:
+            before = f.read()
+        restored.analyze(0, 10.0, 1.9e9)
+        restored.store.amounts.flush()
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), before)
+
+    def test_old_generations_are_removed(self):
+        engine = RiskEngine(store=ProfileStore())
+        snapshots = ProfileSnapshots(self.directory)
+        snapshots.restore(engine)
+        for users, amounts, times in synthetic_batches(3):
+            engine.analyze_batch(users, amounts, times)
+            snapshots.snapshot(engine, wait=True)
+        names = sorted(os.listdir(self.directory))
+        self.assertEqual([n for n in names if n.startswith('snapshot-')], ['snapshot-000004'])
+        self.assertEqual([n for n in names if n.startswith('journal-')], ['journal-000004.jsonl'])
+
+    def test_torn_journal_line_is_ignored(self):
+        path = os.path.join(self.directory, 'journal-000001.jsonl')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('{"u": [1], "a": [5.0], "t": [1.0]}\n{"u": [2], "a"')
+        self.assertEqual(list(read_journal(path)), [([1], [5.0], [1.0], None, None)])
+
+if __name__ == '__main__':
+    unittest.main()
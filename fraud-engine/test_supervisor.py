@@ -0,0 +1,114 @@
+import unittest
+import os
+import signal
+import time
+import json
+import tempfile
+import urllib.request
+from types import SimpleNamespace
+import metrics
+import supervisor
+from callbacks import Outbox
+from supervisor import Supervisor, ThroughputMeter, worker_path
+
+def counting_worker(index, counter):
+    """Scores 'events' until SIGTERM, then finishes its current batch and exits cleanly"""
+    registry = metrics.Registry()
+    registry.counter('fraud_engine_decisions_total', "Verdicts.", labels=('status',)).inc(index + 1, ('COMPLETED',))
+    metrics.write_state(registry, os.path.join(os.environ['METRICS_DIR'], f'worker-{index}.json'))
+    stop = []
+    signal.signal(signal.SIGTERM, lambda *_: stop.append(True))
+    while not stop:
+        with counter.get_lock():
+            counter.value += 10
+        time.sleep(0.01)
+    with counter.get_lock():
+        counter.value += 1  # the in-flight batch still completes
+
+def outbox_worker(index, counter):
+    """Queues three ledger updates, has only the first delivered, and stops (twice, like a restart)"""
+    import main
+    supervisor.configure_worker(index)
+    main.ledger.outbox.open()
+    seqs = main.ledger.outbox.append([(f'{index}-{counter.value}-{k}', 'COMPLETED') for k in range(3)])
+    main.ledger.outbox.complete(seqs[:1])
+    main.ledger.outbox.close()
+
+def crashing_worker(index, counter):
+    with counter.get_lock():
+        counter.value += 1
+    os._exit(3)
+
+class TestThroughputMeter(unittest.TestCase):
+    def test_rate_over_window(self):
+        counter = SimpleNamespace(value=0)
+        meter = ThroughputMeter(counter, window=10)
+        for second in range(30):
+            counter.value = second * 100
+            meter.sample(now=float(second))
+        self.assertAlmostEqual(meter.rate(), 100.0)
+        self.assertEqual(meter.total(), 2900)
+
+class TestSupervisor(unittest.TestCase):
+    def test_graceful_shutdown_drains_workers(self):
+        sup = Supervisor(workers=2, target=counting_worker)
+        sup.serve_metrics(port=0)
+        for index in range(2):
+            sup.spawn(index)
+        deadline = time.monotonic() + 20
+        while sup.counter.value < 40 and time.monotonic() < deadline:
+            time.sleep(0.05)
+            sup.meter.sample()
+
+        port = sup.http.server_address[1]
+        stats = json.loads(urllib.request.urlopen(f'http://127.0.0.1:{port}/stats').read())
+        self.assertEqual(stats['workers_alive'], 2)
+        text = urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics').read().decode()
+        self.assertIn('fraud_engine_events_total', text)
+        self.assertIn('fraud_engine_decisions_total{status="COMPLETED"} 3\n', text)  # summed over both workers
+
+        sup.shutdown(grace=10)
+        self.assertEqual([p.exitcode for p in sup.processes.values()], [0, 0])
+        self.assertEqual(sup.counter.value % 10, 2)  # both workers finished their last batch
+
+    def test_workers_keep_separate_outboxes(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, 'ledger_outbox.jsonl')
+        previous = os.environ.get('CALLBACK_OUTBOX')
+        os.environ['CALLBACK_OUTBOX'] = path
+        self.addCleanup(lambda: os.environ.pop('CALLBACK_OUTBOX') if previous is None
+                        else os.environ.__setitem__('CALLBACK_OUTBOX', previous))
+        sup = Supervisor(workers=2, target=outbox_worker)
+        for run in range(2):
+            sup.counter.value = run
+            for index in range(2):
+                sup.spawn(index)
+            for process in sup.processes.values():
+                process.join(20)
+            self.assertEqual([p.exitcode for p in sup.processes.values()], [0, 0])
+        self.assertFalse(os.path.exists(path))
+        for index in range(2):
+            outbox = Outbox(worker_path(path, index))
+            outbox.open()
+            outbox.close()
+            # Neither the other worker's deliveries nor its rewrites of the log touched these
+            self.assertEqual([tx_id for _, tx_id, _ in outbox.undelivered()],
+                             [f'{index}-{run}-{k}' for run in range(2) for k in (1, 2)])
+
+    def test_crashed_workers_are_restarted(self):
+        sup = Supervisor(workers=1, target=crashing_worker)
+        sup.stopping.wait = lambda timeout: sup.restarts >= 2 or time.sleep(timeout)
+        handlers = signal.getsignal(signal.SIGTERM), signal.getsignal(signal.SIGINT)
+        supervisor.RESTART_DELAY, delay = 0, supervisor.RESTART_DELAY
+        try:
+            sup.run(poll_interval=0.2)
+        finally:
+            supervisor.RESTART_DELAY = delay
+            signal.signal(signal.SIGTERM, handlers[0])
+            signal.signal(signal.SIGINT, handlers[1])
+        self.assertEqual(sup.restarts, 2)
+        self.assertGreaterEqual(sup.counter.value, 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+import unittest
+import os
+import tempfile
+from unittest import mock
+import main
+from main import reset_state
+from verdicts import VerdictCache
+from test_fraud import FakeChannel, make_messages, queued_updates
+
+OK = ("COMPLETED", "Verified")
+NO = ("REJECTED", "Potential Structuring Detected")
+
+class TestVerdictCache(unittest.TestCase):
+    def test_lru_and_ttl(self):
+        cache = VerdictCache(capacity=2, ttl=10)
+        cache.put(["1", "2"], [OK, NO], now=0)
+        self.assertEqual(cache.lookup(["1"], now=1), ({0: (OK, False)}, []))  # "1" is now most recent
+        cache.put(["3"], [OK], now=2)
+        cached, fresh = cache.lookup(["1", "2", "3"], now=3)
+        self.assertEqual((sorted(cached), fresh), ([0, 2], [1]))  # "2" was evicted
+        self.assertEqual(cache.lookup(["1"], now=12), ({}, [0]))   # expired
+
+    def test_repeats_and_id_types(self):
+        cache = VerdictCache()
+        cache.put([7], [NO])
+        cached, fresh = cache.lookup(["7", "8", "8"])
+        self.assertEqual(cached, {0: (NO, False), 2: ('repeat', 1)})
+        self.assertEqual(fresh, [1])
+
+    def test_only_queued_verdicts_are_persisted(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'verdicts.jsonl')
+            cache = VerdictCache(path=path)
+            cache.put(["1", "2"], [OK, NO])
+            cache.mark_queued(["2"])
+            cache.put(["4"], [OK], queued=True)  # scored and queued in one go
+            cache.close()
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write('{"t": "3", "s"')  # torn by a crash
+            reloaded = VerdictCache(path=path)
+            self.assertEqual(reloaded.lookup(["1", "2", "4"]), ({1: (NO, True), 2: (OK, True)}, [0]))
+            reloaded.close()
+            self.assertEqual(len(VerdictCache(path=path, ttl=0)), 0)
+
+class TestRedelivery(unittest.TestCase):
+    def setUp(self):
+        reset_state()
+        self.events = [{"transactionId": str(1000 + i), "senderId": 7, "amount": amount}
+                       for i, amount in enumerate([10, 12, 9900, 11])]
+
+    def consume(self, batch, messages, fail=False):
+        ch = FakeChannel()
+        ch.basic_nack = mock.Mock()
+        with mock.patch.object(main, 'PROCESSING_DELAY', 0), mock.patch.object(main, 'ledger') as ledger:
+            if fail:
+                ledger.enqueue.side_effect = OSError("disk full")
+            if batch:
+                main.process_batch(ch, messages)
+            else:
+                for method, props, body in messages:
+                    main.process_transaction(ch, method, props, body)
+        return queued_updates(ledger), ch
+
+    def test_redelivered_batch_is_not_scored_again(self):
+        for batch in (True, False):
+            reset_state()
+            first, _ = self.consume(batch, make_messages(self.events))
+            profile = main.engine.get_profile(7)
+            history = profile.amounts.tolist()
+            # The acks were lost: RabbitMQ redelivers everything, plus one new event
+            again, ch = self.consume(batch, make_messages(self.events + [{"transactionId": "2000", "senderId": 7,
+                                                                          "amount": 10}]))
+            self.assertEqual(again, [{"transactionId": "2000", "status": "COMPLETED"}])
+            self.assertEqual(main.engine.get_profile(7).amounts.tolist(), history + [10.0])
+            self.assertTrue(ch.acks)
+            self.assertIn({"transactionId": "1002", "status": "REJECTED"}, first)
+
+    def test_nacked_verdicts_are_queued_on_redelivery(self):
+        messages = make_messages(self.events)
+        for batch, method in ((True, 'analyze_batch'), (False, 'analyze')):
+            reset_state()
+            _, ch = self.consume(batch, messages, fail=True)
+            self.assertEqual(ch.basic_nack.call_count, 1 if batch else len(messages))
+            with mock.patch.object(main.engine, method, wraps=getattr(main.engine, method)) as analyze:
+                again, _ = self.consume(batch, messages)
+                analyze.assert_not_called()
+                self.assertEqual(len(again), 4)
+                self.assertIn({"transactionId": "1002", "status": "REJECTED"}, again)
+                # Queued now: a further redelivery is only acked
+                self.assertEqual(self.consume(batch, messages)[0], [])
+
+    def test_verdicts_are_cached_before_the_ack(self):
+        """The channel drops while acking: the redelivered messages must not be scored or posted again"""
+        class DroppedChannel(FakeChannel):
+            def basic_ack(self, delivery_tag, multiple=False):
+                raise ConnectionError("channel closed")
+
+        messages = make_messages(self.events)
+        for batch in (True, False):
+            reset_state()
+            with mock.patch.object(main, 'PROCESSING_DELAY', 0), mock.patch.object(main, 'ledger') as ledger:
+                with self.assertRaises(ConnectionError):
+                    if batch:
+                        main.process_batch(DroppedChannel(), messages)
+                    else:
+                        main.process_transaction(DroppedChannel(), *messages[0])
+            scored = len(queued_updates(ledger))
+            history = main.engine.get_profile(7).amounts.tolist()
+            again, ch = self.consume(batch, messages[:scored])
+            self.assertEqual(again, [])
+            self.assertEqual(main.engine.get_profile(7).amounts.tolist(), history)
+            self.assertTrue(ch.acks)
+
+    def test_journaled_events_are_not_recorded_twice_after_a_crash(self):
+        """Crash after journaling, before the ack: the restart replays the events and RabbitMQ redelivers them"""
+        messages = make_messages(self.events)
+        for batch in (True, False):
+            reset_state()
+            with tempfile.TemporaryDirectory() as tmp:
+                snapshots = main.open_snapshots(main.engine, tmp)
+                first, _ = self.consume(batch, messages)
+                history = main.engine.get_profile(7).amounts.tolist()
+                snapshots.journal.close()  # the process dies: no final snapshot, nothing acked
+                main.engine.journal = None
+
+                reset_state()
+                snapshots = main.open_snapshots(main.engine, tmp)
+                self.assertEqual(main.engine.get_profile(7).amounts.tolist(), history)
+                again, ch = self.consume(batch, messages)
+                # Posted again (they may never have reached the outbox) but recorded only once
+                self.assertEqual(again, first)
+                self.assertEqual(main.engine.get_profile(7).amounts.tolist(), history)
+                self.assertTrue(ch.acks)
+                snapshots.close(main.engine)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+import json
+from types import SimpleNamespace
+import numpy as np
+from wire import EVENT_CONTENT_TYPE, EVENT_DTYPE, encode_events, decode_batch, decode_event, decode_records
+
+BINARY = SimpleNamespace(content_type=EVENT_CONTENT_TYPE)
+
+def json_message(tag, **event):
+    return (SimpleNamespace(delivery_tag=tag), None, json.dumps(event).encode())
+
+def binary_message(tag, tx_ids, users, amounts, timestamps=None):
+    return (SimpleNamespace(delivery_tag=tag), BINARY, encode_events(tx_ids, users, amounts, timestamps))
+
+class TestDecodeBatch(unittest.TestCase):
+    def test_json_matches_decode_event(self):
+        messages = [json_message(i, transactionId=str(1000 + i), senderId=i % 3, amount=10.5 + i,
+                                 timestamp=f"2024-03-0{1 + i}T12:00:00.{i:03d}Z", status="PENDING") for i in range(5)]
+        events = decode_batch(messages)
+        self.assertEqual(list(events), [decode_event(body) for _, _, body in messages])
+        self.assertEqual(events.errors, [])
+
+    def test_json_and_binary_keys_match(self):
+        """The same event decodes to the same keys whatever the format (and however the ledger typed its ids)"""
+        binary = decode_batch([binary_message(1, ['1042'], [7], [25.0], [1.7e9])])
+        for tx_id, sender in (("1042", 7), (1042, "7"), ("1042", 7.0)):
+            message = json_message(1, transactionId=tx_id, senderId=sender, amount=25, timestamp=1.7e9)
+            self.assertEqual(list(decode_batch([message])), list(binary))
+            self.assertEqual(decode_event(message[2]), next(iter(binary)))
+            self.assertEqual([type(key) for key in next(iter(decode_batch([message])))[:2]], [str, int])
+        # A non-numeric sender cannot be an int64: it is kept as it is
+        self.assertEqual(decode_event(json.dumps({"transactionId": 1, "senderId": "bot-1", "amount": 1}))[:2],
+                         ('1', 'bot-1'))
+
+    def test_binary_round_trip(self):
+        events = decode_batch([binary_message(1, ['7', '8'], [3, 4], [9800.0, 12.5], [1.7e9, 1.7e9 + 1])])
+        self.assertEqual(list(events), [('7', 3, 9800.0, 1.7e9), ('8', 4, 12.5, 1.7e9 + 1)])
+        self.assertEqual(EVENT_DTYPE.itemsize, 32)
+
+    def test_binary_without_timestamp_uses_wall_clock(self):
+        events = decode_batch([binary_message(1, ['7'], [3], [5.0])])
+        self.assertFalse(np.isnan(events.timestamps).any())
+
+    def test_mixed_batch_keeps_message_order(self):
+        messages = [json_message(1, transactionId="1", senderId=1, amount=1, timestamp=1.0),
+                    binary_message(2, ['2', '3'], [1, 2], [2.0, 3.0], [2.0, 3.0]),
+                    json_message(3, transactionId="4", senderId=1, amount=4, timestamp=4.0)]
+        events = decode_batch(messages)
+        self.assertEqual(events.transaction_ids, ['1', '2', '3', '4'])
+        self.assertEqual(events.amounts.tolist(), [1.0, 2.0, 3.0, 4.0])
+
+    def test_bad_messages_are_reported_not_fatal(self):
+        messages = [json_message(1, transactionId="1", senderId=1, amount=5, timestamp=1.0),
+                    (SimpleNamespace(delivery_tag=2), None, b'{not json'),
+                    json_message(3, transactionId="3", senderId=1, amount="lots"),
+                    (SimpleNamespace(delivery_tag=4), BINARY, b'\x00' * 31),
+                    json_message(5, transactionId="5", senderId=2, amount=6, timestamp="yesterday")]
+        events = decode_batch(messages)
+        self.assertEqual(events.transaction_ids, ['1'])
+        self.assertEqual([i for i, _ in events.errors], [1, 2, 3, 4])
+
+    def test_decode_records_rejects_partial_records(self):
+        with self.assertRaises(ValueError):
+            decode_records(b'\x00' * 40)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from metrics import REGISTRY
+
+# --- VERDICT CACHE ---
+# RabbitMQ redelivers every message that was not acked: after a crash, a lost connection, or a
+# nack because the outbox could not be written. Scoring such a message again would record its
+# amount in the sender's profile a second time (skewing velocity and anomaly statistics) and
+# post a second ledger callback. The consumers therefore look every transactionId up here first:
+# a cached verdict is reused as is, without touching the profiles.
+#
+# Entries are kept in LRU order, at most `capacity` of them, each for `ttl` seconds. An entry is
+# "queued" once its ledger update is in the outbox: redeliveries of queued verdicts are only
+# acked, the others are queued again. With a path, queued verdicts are also appended to a JSONL
+# file and reloaded on start, so redeliveries after a restart are recognised too:
+#   {"t": "1007", "s": "REJECTED", "r": "Potential Structuring Detected", "at": 1718000000.5}
+
+CACHE_HITS = REGISTRY.counter('fraud_engine_verdict_cache_hits_total', "Redelivered transactions answered from the verdict cache.")
+CACHE_MISSES = REGISTRY.counter('fraud_engine_verdict_cache_misses_total', "Transactions not in the verdict cache (scored).")
+
+
+class VerdictCache:
+    """Bounded LRU + TTL map of transactionId -> (status, reason), optionally persisted"""
+
+    COMPACT_FACTOR = 2  # rewrite the file once it holds this many times `capacity` lines
+    EXPIRE_INTERVAL = 1.0  # seconds between sweeps of expired entries by put()
+
+    def __init__(self, capacity=100000, ttl=3600.0, path=None):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.path = path
+        self.entries = OrderedDict()  # key -> [status, reason, queued, cached_at]
+        self.lock = threading.Lock()
+        self.file = None
+        self.lines = 0
+        self.next_expiry = 0.0
+        if path:
+            self._load()
+            self.file = open(path, 'a', encoding='utf-8')
+
+    @staticmethod
+    def key(tx_id):
+        # JSON events carry string ids, binary ones integers: both name the same transaction
+        return str(tx_id)
+
+    def _load(self):
+        """Reloads the unexpired verdicts of a previous run, then rewrites the file with only those"""
+        if os.path.exists(self.path):
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line from a crash mid-write
+                    self._store(record['t'], record['s'], record['r'], True, record['at'])
+        self._expire(time.time())
+        self._rewrite()
+
+    def _rewrite(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            for key, (status, reason, queued, cached_at) in self.entries.items():
+                if queued:
+                    f.write(json.dumps({"t": key, "s": status, "r": reason, "at": cached_at}) + '\n')
+        os.replace(tmp, self.path)
+        self.lines = len(self.entries)
+
+    def _store(self, key, status, reason, queued, cached_at):
+        self.entries[key] = [status, reason, queued, cached_at]
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def _expire(self, now):
+        # Drops expired entries from the least recently used end (an entry read recently may hide
+        # older ones behind it: lookup() checks the age of every entry anyway)
+        while self.entries:
+            key, entry = next(iter(self.entries.items()))
+            if now - entry[3] < self.ttl:
+                break
+            del self.entries[key]
+
+    def lookup(self, tx_ids, now=None):
+        """Splits a batch into cached verdicts and events to score.
+
+        Returns (cached, fresh): cached maps batch index -> ((status, reason), queued) for
+        transactions seen before, fresh lists the indices to score. A transaction repeated
+        within the batch is scored once; its later copies map to ('repeat', first index).
+        """
+        now = time.time() if now is None else now
+        cached, fresh, first = {}, [], {}
+        with self.lock:
+            for i, tx_id in enumerate(tx_ids):
+                key = self.key(tx_id)
+                entry = self.entries.get(key)
+                if entry is not None and now - entry[3] >= self.ttl:
+                    del self.entries[key]
+                    entry = None
+                if entry is not None:
+                    self.entries.move_to_end(key)
+                    cached[i] = ((entry[0], entry[1]), entry[2])
+                elif key in first:
+                    cached[i] = ('repeat', first[key])
+                else:
+                    first[key] = i
+                    fresh.append(i)
+        if cached:
+            CACHE_HITS.inc(len(cached))
+        CACHE_MISSES.inc(len(fresh))
+        return cached, fresh
+
+    def put(self, tx_ids, verdicts, now=None, queued=False):
+        """Caches freshly scored verdicts; queued=True when their ledger updates are already in the outbox"""
+        now = time.time() if now is None else now
+        persist = queued and self.file is not None
+        lines = []
+        with self.lock:
+            if now >= self.next_expiry:
+                # lookup() checks the age of every entry it returns: this only frees memory early
+                self._expire(now)
+                self.next_expiry = now + self.EXPIRE_INTERVAL
+            for tx_id, (status, reason) in zip(tx_ids, verdicts):
+                key = self.key(tx_id)
+                self._store(key, status, reason, queued, now)
+                if persist:
+                    lines.append(json.dumps({"t": key, "s": status, "r": reason, "at": now}) + '\n')
+            self._persist(lines)
+
+    def put_missing(self, tx_ids, verdicts, now=None):
+        """put() of the verdicts not cached yet, as not queued: replayed ones from the profile journal
+        (see snapshots.py), whose ledger updates may never have reached the outbox"""
+        with self.lock:
+            missing = [(tx_id, verdict) for tx_id, verdict in zip(tx_ids, verdicts)
+                       if self.key(tx_id) not in self.entries]
+        if missing:
+            self.put(*zip(*missing), now=now)
+
+    def mark_queued(self, tx_ids):
+        """Their ledger updates are in the outbox: redeliveries are now just acked (and persisted)"""
+        lines = []
+        with self.lock:
+            for tx_id in tx_ids:
+                entry = self.entries.get(self.key(tx_id))
+                if entry is not None and not entry[2]:
+                    entry[2] = True
+                    if self.file is not None:
+                        lines.append(json.dumps({"t": self.key(tx_id), "s": entry[0], "r": entry[1],
+                                                 "at": entry[3]}) + '\n')
+            self._persist(lines)
+
+    def _persist(self, lines):
+        if self.file is not None and lines:
+            # No fsync, like the profile journal: the page cache outlives a crashed process
+            self.file.write(''.join(lines))
+            self.file.flush()
+            self.lines += len(lines)
+            if self.lines > self.capacity * self.COMPACT_FACTOR:
+                self.file.close()
+                self._rewrite()
+                self.file = open(self.path, 'a', encoding='utf-8')
+
+    def __len__(self):
+        return len(self.entries)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
@@ -0,0 +1,221 @@
+import json
+import time
+import warnings
+from datetime import datetime
+import numpy as np
+
+# --- WIRE FORMAT ---
+# Transaction events arrive as JSON (what the ledger publishes today) or, when the message's
+# content-type is EVENT_CONTENT_TYPE, as packed fixed-size little-endian records:
+#
+#   offset  type     field
+#        0  uint64   transactionId (numeric)
+#        8  int64    senderId
+#       16  float64  amount
+#       24  float64  timestamp, epoch seconds (NaN = not set, the engine uses its wall clock)
+#
+# A binary message may carry any number of records back to back. decode_batch() turns a list of
+# messages of either kind into column arrays for RiskEngine.analyze_batch: binary records are
+# read with one np.frombuffer over the whole batch, JSON bodies are parsed in a single call and
+# their ISO timestamps converted together, so no per-event tuple or datetime is built.
+# Both paths yield the same key types: a str transactionId and, whenever it is numeric, an int
+# senderId (the ledger publishes "7" or 7 depending on where the id came from).
+
+EVENT_CONTENT_TYPE = 'application/vnd.safeledger.event'
+EVENT_DTYPE = np.dtype([('transaction_id', '<u8'), ('sender_id', '<i8'), ('amount', '<f8'), ('timestamp', '<f8')])
+
+
+def parse_timestamp(value):
+    """Event time in epoch seconds from the ledger's ISO-8601 'timestamp' (wall clock if missing)"""
+    if value is None:
+        return time.time()
+    if isinstance(value, (int, float)):
+        return float(value)
+    # Python 3.9's fromisoformat does not understand the trailing 'Z' of JavaScript's toISOString()
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+
+def sender_key(value):
+    """senderId as the binary format carries it (int64) when it is a whole number; other ids are kept as they are"""
+    if type(value) is int:
+        return value
+    if isinstance(value, str):
+        try:
+            return int(value)
+        except ValueError:
+            return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def transaction_key(value):
+    """transactionId as a str, like the binary path's str(uint64) (None stays None)"""
+    return value if value is None or type(value) is str else str(value)
+
+
+def decode_event(body):
+    """Parses one JSON queue message into (transactionId, senderId, amount, timestamp)"""
+    event = json.loads(body)
+    return (transaction_key(event.get('transactionId')), sender_key(event.get('senderId')),
+            float(event.get('amount')), parse_timestamp(event.get('timestamp')))
+
+
+def encode_events(transaction_ids, sender_ids, amounts, timestamps=None):
+    """Packs event columns into one binary message body (for producers, tests and benchmarks)"""
+    records = np.zeros(len(amounts), dtype=EVENT_DTYPE)
+    records['transaction_id'] = [int(tx_id) for tx_id in transaction_ids]
+    records['sender_id'] = sender_ids
+    records['amount'] = amounts
+    records['timestamp'] = np.nan if timestamps is None else timestamps
+    return records.tobytes()
+
+
+def content_type_of(properties):
+    return getattr(properties, 'content_type', None)
+
+
+def is_binary(properties):
+    return content_type_of(properties) == EVENT_CONTENT_TYPE
+
+
+def record_count(body):
+    if len(body) % EVENT_DTYPE.itemsize:
+        raise ValueError(f"Binary event message of {len(body)} bytes is not a whole number of "
+                         f"{EVENT_DTYPE.itemsize}-byte records")
+    return len(body) // EVENT_DTYPE.itemsize
+
+
+def decode_records(body):
+    """Structured array view of a binary message body"""
+    record_count(body)
+    return np.frombuffer(body, dtype=EVENT_DTYPE)
+
+
+class EventColumns:
+    """Decoded events of a batch, in message order, as columns"""
+
+    def __init__(self, transaction_ids, user_ids, amounts, timestamps, errors):
+        self.transaction_ids = transaction_ids  # list of str
+        self.user_ids = user_ids                # list
+        self.amounts = amounts                  # float64 array
+        self.timestamps = timestamps            # float64 array
+        self.errors = errors                    # [(message index, exception)] for undecodable messages
+
+    def __len__(self):
+        return len(self.amounts)
+
+    def __iter__(self):
+        return zip(self.transaction_ids, self.user_ids, self.amounts.tolist(), self.timestamps.tolist())
+
+    def take(self, indices):
+        """The events at `indices` (in that order), e.g. the ones left to score"""
+        indices = np.asarray(indices, dtype=np.intp)
+        return EventColumns([self.transaction_ids[i] for i in indices.tolist()],
+                            [self.user_ids[i] for i in indices.tolist()],
+                            self.amounts[indices], self.timestamps[indices], [])
+
+
+def iso_timestamps(values):
+    """Epoch seconds of ISO strings ending in 'Z', converted in one call (None if any value is something else)"""
+    if not all(isinstance(value, str) and value.endswith('Z') for value in values):
+        return None
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            stamps = np.array([value[:-1] for value in values], dtype='datetime64[us]')
+    except (ValueError, Warning):
+        return None
+    return stamps.astype(np.int64) / 1e6
+
+
+def _decode_json(messages, indices, errors):
+    """Columns of the JSON messages at `indices`; the whole batch goes through json.loads at once"""
+    bodies = [messages[i][2] for i in indices]
+    try:
+        joined = b','.join(body if isinstance(body, bytes) else body.encode() for body in bodies)
+        events = json.loads(b'[' + joined + b']')
+        if len(events) != len(bodies):
+            raise ValueError("message count mismatch")  # a body holding several values, e.g. '1,2'
+    except ValueError:
+        events = None
+    if events is None:
+        # Some body is not valid JSON on its own: find out which one, message by message
+        events = []
+        for i, body in zip(indices, bodies):
+            try:
+                events.append(json.loads(body))
+            except ValueError as e:
+                errors.append((i, e))
+                events.append(None)
+
+    kept, transaction_ids, user_ids, amounts, raw_times = [], [], [], [], []
+    for i, event in zip(indices, events):
+        if event is None:
+            continue
+        try:
+            amount = float(event.get('amount'))
+            transaction_ids.append(transaction_key(event.get('transactionId')))
+            user_ids.append(sender_key(event.get('senderId')))
+        except (AttributeError, TypeError, ValueError) as e:
+            errors.append((i, e))
+            continue
+        amounts.append(amount)
+        raw_times.append(event.get('timestamp'))
+        kept.append(i)
+
+    timestamps = iso_timestamps(raw_times)
+    if timestamps is None:
+        timestamps, good = [], []
+        for i, value in zip(kept, raw_times):
+            try:
+                timestamps.append(parse_timestamp(value))
+                good.append(True)
+            except (TypeError, ValueError) as e:
+                errors.append((i, e))
+                good.append(False)
+        if not all(good):
+            kept, transaction_ids, user_ids, amounts = (
+                [value for value, ok in zip(column, good) if ok] for column in (kept, transaction_ids, user_ids, amounts))
+    return kept, transaction_ids, user_ids, amounts, timestamps
+
+
+def decode_batch(messages):
+    """Decodes [(method, properties, body), ...] into EventColumns, JSON and binary messages alike"""
+    errors = []
+    binary = [i for i, (_, properties, _) in enumerate(messages) if is_binary(properties)]
+    if not binary:
+        _, transaction_ids, user_ids, amounts, timestamps = _decode_json(messages, range(len(messages)), errors)
+        return EventColumns(transaction_ids, user_ids, np.asarray(amounts, dtype=float),
+                            np.asarray(timestamps, dtype=float), sorted(errors, key=lambda error: error[0]))
+
+    # Every well-formed binary body is joined and read with a single frombuffer
+    whole, counts = [], []
+    for i in binary:
+        try:
+            counts.append(record_count(messages[i][2]))
+            whole.append(i)
+        except ValueError as e:
+            errors.append((i, e))
+    records = np.frombuffer(b''.join([messages[i][2] for i in whole]), dtype=EVENT_DTYPE)
+    message = np.repeat(np.asarray(whole, dtype=np.intp), counts)
+    transaction_ids = list(map(str, records['transaction_id'].tolist()))
+    user_ids = records['sender_id'].tolist()
+    amounts = records['amount'].astype(float)
+    timestamps = records['timestamp'].astype(float)
+    missing = np.isnan(timestamps)
+    if missing.any():
+        timestamps[missing] = time.time()
+
+    json_indices = [i for i in range(len(messages)) if not is_binary(messages[i][1])]
+    if json_indices:
+        kept, json_ids, json_users, json_amounts, json_times = _decode_json(messages, json_indices, errors)
+        # Mixed batch: merge back into message order (a user's events must stay in arrival order)
+        message = np.concatenate([message, np.asarray(kept, dtype=np.intp)])
+        order = np.argsort(message, kind='stable').tolist()
+        merged_ids, merged_users = transaction_ids + json_ids, user_ids + json_users
+        transaction_ids = [merged_ids[k] for k in order]
+        user_ids = [merged_users[k] for k in order]
+        amounts = np.concatenate([amounts, np.asarray(json_amounts, dtype=float)])[order]
+        timestamps = np.concatenate([timestamps, np.asarray(json_times, dtype=float)])[order]
+    return EventColumns(transaction_ids, user_ids, amounts, timestamps, sorted(errors, key=lambda error: error[0]))
@@ -14,7 +14,7 @@ const AUTH_SERVICE_URL =
   process.env.AUTH_SERVICE_URL || "http://localhost:3001";
 const RABBITMQ_URL = process.env.RABBITMQ_URL || "amqp://localhost";
 const QUEUE_NAME = "transaction_events";
-const DB_PATH = path.join(__dirname, "ledger_db.json");
+const DB_PATH = process.env.LEDGER_DB_PATH || path.join(__dirname, "ledger_db.json");
 
 // --- DATABASE HELPERS ---
 function getDb() {
@@ -58,7 +58,7 @@ async function connectRabbitMQ() {
     console.error("RabbitMQ Connection Error:", error);
   }
 }
-connectRabbitMQ();
+if (require.main === module) connectRabbitMQ();
 
 // Auth Middleware
 const authenticateToken = async (req, res, next) => {
@@ -175,45 +175,56 @@ app.post("/transfer", authenticateToken, async (req, res) => {
   });
 });
 
-app.post("/transaction/update", async (req, res) => {
-  const { transactionId, status } = req.body;
-  const db = getDb();
-
-  if (db.transactions[transactionId]) {
-    db.transactions[transactionId].status = status;
-    console.log(`🔄 Transaction ${transactionId} updated to ${status}`);
+// Applies one fraud verdict to the ledger. Returns false if the transaction is unknown.
+// Only a PENDING transaction takes a verdict; once it is final any later update is ignored,
+// so the fraud engine can safely redeliver updates (it retries failed callbacks from its
+// outbox) and a stray conflicting verdict can never refund or credit the amount twice.
+function applyStatusUpdate(db, transactionId, status) {
+  const tx = db.transactions[transactionId];
+  if (!tx) return false;
+  if (tx.status !== "PENDING") {
+    console.log(`🔁 Transaction ${transactionId} already ${tx.status}, ignoring ${status}`);
+    return true;
+  }
 
-    // Retrieve transaction details
-    const tx = db.transactions[transactionId];
+  tx.status = status;
+  console.log(`🔄 Transaction ${transactionId} updated to ${status}`);
 
-    // REFUND LOGIC (If Fraud Detected)
-    if (status === "REJECTED") {
-      const senderAcc = db.accounts.find((acc) => acc.userId == tx.senderId);
-      if (senderAcc) {
-        senderAcc.balance += tx.amount;
-        console.log(`↩️  Refunded ${tx.amount} to User ${tx.senderId}`);
-      }
+  // REFUND LOGIC (If Fraud Detected)
+  if (status === "REJECTED") {
+    const senderAcc = db.accounts.find((acc) => acc.userId == tx.senderId);
+    if (senderAcc) {
+      senderAcc.balance += tx.amount;
+      console.log(`↩️  Refunded ${tx.amount} to User ${tx.senderId}`);
     }
+  }
 
-    // CREDIT LOGIC (If Verified)
-    if (status === "COMPLETED") {
-      // FIX: Use loose equality (==) to find recipient even if types mismatch
-      const recipientAcc = db.accounts.find(
-        (acc) => acc.userId == tx.recipientId
-      );
+  // CREDIT LOGIC (If Verified)
+  if (status === "COMPLETED") {
+    // FIX: Use loose equality (==) to find recipient even if types mismatch
+    const recipientAcc = db.accounts.find(
+      (acc) => acc.userId == tx.recipientId
+    );
 
-      if (recipientAcc) {
-        recipientAcc.balance += tx.amount;
-        console.log(
-          `💰 Credited ${tx.amount} to Recipient ${tx.recipientId}. New Balance: ${recipientAcc.balance}`
-        );
-      } else {
-        console.error(
-          `⚠️ CRITICAL: Recipient ${tx.recipientId} NOT FOUND during credit. Money lost?`
-        );
-      }
+    if (recipientAcc) {
+      recipientAcc.balance += tx.amount;
+      console.log(
+        `💰 Credited ${tx.amount} to Recipient ${tx.recipientId}. New Balance: ${recipientAcc.balance}`
+      );
+    } else {
+      console.error(
+        `⚠️ CRITICAL: Recipient ${tx.recipientId} NOT FOUND during credit. Money lost?`
+      );
     }
+  }
+  return true;
+}
+
+app.post("/transaction/update", async (req, res) => {
+  const { transactionId, status } = req.body;
+  const db = getDb();
 
+  if (applyStatusUpdate(db, transactionId, status)) {
     saveDb(db);
     return res.json({ success: true });
   }
@@ -221,8 +232,40 @@ app.post("/transaction/update", async (req, res) => {
   res.status(404).json({ error: "Transaction not found" });
 });
 
-app.listen(PORT, () => {
-  console.log(`💰 Ledger Service running on port ${PORT}`);
+// Bulk variant: { updates: [{ transactionId, status }, ...] } with a single DB read and write
+const VERDICT_STATUSES = ["COMPLETED", "REJECTED"];
+
+app.post("/transaction/update/bulk", async (req, res) => {
+  const updates = req.body.updates;
+  if (!Array.isArray(updates)) {
+    return res.status(400).json({ error: "updates must be an array" });
+  }
+  // A malformed entry is the caller's bug: answer 400 (the fraud engine drops it) rather than
+  // throwing a 500, which it would retry forever. Nothing is applied unless every entry is valid.
+  const invalid = updates.findIndex(
+    (update) => update === null || typeof update !== "object" || !VERDICT_STATUSES.includes(update.status)
+  );
+  if (invalid !== -1) {
+    return res.status(400).json({
+      error: `updates[${invalid}] must be { transactionId, status } with status ${VERDICT_STATUSES.join(" or ")}`,
+    });
+  }
+
+  const db = getDb();
+  const notFound = [];
+  for (const { transactionId, status } of updates) {
+    if (!applyStatusUpdate(db, transactionId, status)) notFound.push(transactionId);
+  }
+  saveDb(db);
+  res.json({ success: true, updated: updates.length - notFound.length, notFound });
 });
 
+if (require.main === module) {
+  app.listen(PORT, () => {
+    console.log(`💰 Ledger Service running on port ${PORT}`);
+  });
+}
+
+module.exports = { app, applyStatusUpdate };
+
 
@@ -10,4 +10,86 @@ describe('Transaction Logic', () => {
         const isValid = amount > 0;
         expect(isValid).toBe(false);
     });
-});
\ No newline at end of file
+});
+
+const fs = require('fs');
+const os = require('os');
+const path = require('path');
+const request = require('supertest');
+
+process.env.LEDGER_DB_PATH = path.join(fs.mkdtempSync(path.join(os.tmpdir(), 'ledger-')), 'ledger_db.json');
+const { app } = require('./index');
+
+describe('Fraud verdict updates', () => {
+    const readDb = () => JSON.parse(fs.readFileSync(process.env.LEDGER_DB_PATH, 'utf8'));
+    const balance = (db, userId) => db.accounts.find((acc) => acc.userId === userId).balance;
+
+    beforeEach(() => {
+        const tx = (transactionId, status) => ({
+            transactionId, senderId: 1, recipientId: '2', amount: 100,
+            timestamp: '2025-12-15T05:15:13.293Z', status,
+        });
+        fs.writeFileSync(process.env.LEDGER_DB_PATH, JSON.stringify({
+            accounts: [{ userId: 1, balance: 900 }, { userId: 2, balance: 5000 }],
+            transactions: { 1000: tx('1000', 'PENDING'), 1001: tx('1001', 'PENDING'), 1002: tx('1002', 'COMPLETED') },
+            currentTransactionId: 1003,
+        }));
+    });
+
+    test('Should credit the recipient once when a verdict is redelivered', async () => {
+        for (let i = 0; i < 2; i++) {
+            const res = await request(app).post('/transaction/update').send({ transactionId: '1000', status: 'COMPLETED' });
+            expect(res.body).toEqual({ success: true });
+        }
+        const db = readDb();
+        expect(db.transactions['1000'].status).toBe('COMPLETED');
+        expect(balance(db, 2)).toBe(5100);
+    });
+
+    test('Should ignore a conflicting verdict for a transaction that is already final', async () => {
+        const res = await request(app).post('/transaction/update').send({ transactionId: '1002', status: 'REJECTED' });
+        expect(res.body).toEqual({ success: true });
+        const db = readDb();
+        expect(db.transactions['1002'].status).toBe('COMPLETED');
+        expect(balance(db, 1)).toBe(900);
+    });
+
+    test('Should return 404 for an unknown transaction', async () => {
+        const res = await request(app).post('/transaction/update').send({ transactionId: '42', status: 'COMPLETED' });
+        expect(res.status).toBe(404);
+    });
+
+    test('Should apply a bulk update in one pass', async () => {
+        const res = await request(app).post('/transaction/update/bulk').send({
+            updates: [
+                { transactionId: '1000', status: 'COMPLETED' },
+                { transactionId: '1001', status: 'REJECTED' },
+                { transactionId: '1001', status: 'COMPLETED' },
+                { transactionId: '1002', status: 'REJECTED' },
+                { transactionId: '42', status: 'COMPLETED' },
+            ],
+        });
+        expect(res.body).toEqual({ success: true, updated: 4, notFound: ['42'] });
+        const db = readDb();
+        expect([db.transactions['1000'].status, db.transactions['1001'].status, db.transactions['1002'].status])
+            .toEqual(['COMPLETED', 'REJECTED', 'COMPLETED']);
+        expect(balance(db, 1)).toBe(1000);
+        expect(balance(db, 2)).toBe(5100);
+    });
+
+    test('Should reject a bulk body without an updates array', async () => {
+        const res = await request(app).post('/transaction/update/bulk').send({ transactionId: '1000' });
+        expect(res.status).toBe(400);
+    });
+
+    test('Should reject malformed bulk entries without applying any', async () => {
+        const before = readDb();
+        for (const bad of [null, 'COMPLETED', { transactionId: '1000', status: 'APPROVED' }, { transactionId: '1000' }]) {
+            const res = await request(app).post('/transaction/update/bulk').send({
+                updates: [{ transactionId: '1001', status: 'REJECTED' }, bad],
+            });
+            expect(res.status).toBe(400);
+        }
+        expect(readDb()).toEqual(before);
+    });
+});
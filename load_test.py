@@ -0,0 +1,587 @@
+import argparse
+import heapq
+import itertools
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+from requests.adapters import HTTPAdapter
+
+# --- LOAD TEST ---
+# Open-loop load generator for the gateway (the grown-up version of load_gen.py / bot_attack.py).
+#
+#   python load_test.py --users 1000 --stages 30s@50,60s@50-500,30s@500
+#   python load_test.py --mix balance=6,transfer=3,status=1 --track 0.25 --json report.json
+#   python load_test.py --stub                      same test against an in-process stub gateway
+#   python load_test.py --serve-stub 3000           only run the stub (e.g. for the CLI)
+#
+# Requests are started on a fixed schedule (open loop) whatever the responses do, and latency is
+# measured from the *scheduled* start, so a slow server shows up as latency instead of silently
+# lowering the request rate. Virtual users are plain (token, userId) records shared by a pool of
+# worker threads over keep-alive connections, so thousands of them cost nothing.
+# A sample of transfers (--track) is polled until it leaves PENDING: that is the end-to-end time
+# through RabbitMQ, the fraud engine and the ledger callback.
+
+URL = "http://localhost:3000"
+PASSWORD = "password123"
+DEFAULT_MIX = "balance=5,transfer=4,status=1"
+
+
+# --- HISTOGRAM ---
+
+class Histogram:
+    """HDR-style latency histogram: log buckets with ~1% relative precision, constant memory"""
+
+    BASE = 1.01
+
+    def __init__(self):
+        self.buckets = Counter()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        micros = max(seconds * 1e6, 1.0)
+        self.buckets[int(math.log(micros, self.BASE))] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def merge(self, other):
+        """Adds another histogram's samples to this one (buckets line up, so nothing is lost)"""
+        self.buckets.update(other.buckets)
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        return self
+
+    def percentile(self, p):
+        """Value (seconds) at or below which p% of the samples fall (upper edge of its bucket)"""
+        if not self.count:
+            return 0.0
+        rank = math.ceil(self.count * p / 100)
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(self.BASE ** (bucket + 1) / 1e6, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_ms": self.total / self.count * 1000 if self.count else 0.0,
+            **{f"p{p:g}_ms": self.percentile(p) * 1000 for p in (50, 90, 99, 99.9)},
+            "max_ms": self.max * 1000,
+        }
+
+
+class Stats:
+    """Per-endpoint latency histograms, status codes and errors (thread-safe)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency = {}
+        self.codes = {}
+        self.errors = Counter()
+
+    def record(self, name, seconds, code=None, error=None):
+        with self.lock:
+            self.latency.setdefault(name, Histogram()).record(seconds)
+            self.codes.setdefault(name, Counter())[str(code if code is not None else error)] += 1
+            if error is not None or code is None or code >= 400:
+                self.errors[name] += 1
+
+    def summary(self, elapsed):
+        with self.lock:
+            return {name: self._summary(histogram, self.errors[name], self.codes[name], elapsed)
+                    for name, histogram in sorted(self.latency.items())}
+
+    def overall(self, elapsed, skip=('status_poll',)):
+        """One summary over every endpoint but `skip` (the settlement polls are not part of the mix)"""
+        with self.lock:
+            histogram, codes = Histogram(), Counter()
+            for name in self.latency:
+                if name not in skip:
+                    histogram.merge(self.latency[name])
+                    codes.update(self.codes[name])
+            errors = sum(count for name, count in self.errors.items() if name not in skip)
+            return self._summary(histogram, errors, codes, elapsed)
+
+    @staticmethod
+    def _summary(histogram, errors, codes, elapsed):
+        return dict(histogram.summary(),
+                    rps=histogram.count / elapsed if elapsed else 0.0,
+                    errors=errors,
+                    error_rate=errors / histogram.count if histogram.count else 0.0,
+                    codes=dict(codes))
+
+
+# --- LOAD PROFILE ---
+
+def parse_duration(text):
+    match = re.fullmatch(r'([\d.]+)(ms|s|m|h)?', text)
+    if not match:
+        raise ValueError(f"Bad duration {text!r}")
+    return float(match.group(1)) * {'ms': 0.001, 's': 1, None: 1, 'm': 60, 'h': 3600}[match.group(2)]
+
+
+def parse_stages(spec):
+    """"30s@100,60s@100-500" -> [(30.0, 100.0, 100.0), (60.0, 100.0, 500.0)]: constant and linear ramp stages"""
+    stages = []
+    for part in spec.split(','):
+        duration, rate = part.split('@')
+        start, _, end = rate.partition('-')
+        stages.append((parse_duration(duration), float(start), float(end or start)))
+    return stages
+
+
+def parse_mix(spec):
+    """"balance=5,transfer=4,status=1" -> [(name, weight), ...]"""
+    mix = []
+    for part in spec.split(','):
+        name, weight = part.split('=')
+        if name not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint {name!r}, expected one of {', '.join(ENDPOINTS)}")
+        mix.append((name, float(weight)))
+    return mix
+
+
+def arrivals(stages, poisson=False, rng=random):
+    """Start offsets (seconds from t0) following the stages' rates; exponential gaps if poisson"""
+    offset = 0.0
+    stage_start = 0.0
+    for duration, start_rate, end_rate in stages:
+        stage_end = stage_start + duration
+        while True:
+            # Instantaneous rate of a linear ramp at the current offset
+            progress = (offset - stage_start) / duration if duration else 1.0
+            rate = start_rate + (end_rate - start_rate) * min(max(progress, 0.0), 1.0)
+            if rate <= 0:
+                offset = stage_end
+                break
+            gap = rng.expovariate(rate) if poisson else 1.0 / rate
+            if offset + gap >= stage_end:
+                break
+            offset += gap
+            yield offset
+        offset = stage_start = stage_end
+
+
+# --- VIRTUAL USERS AND ENDPOINTS ---
+
+class VirtualUser:
+    __slots__ = ('index', 'user_id', 'headers', 'transactions')
+
+    def __init__(self, index, user_id, token):
+        self.index = index
+        self.user_id = user_id
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.transactions = []  # recent transfer ids, for status checks
+
+
+def call_balance(test, vu):
+    return test.session.get(f"{test.url}/transaction/balance", headers=vu.headers, timeout=test.timeout)
+
+
+def call_transfer(test, vu):
+    recipient = test.random_recipient(vu)
+    payload = {"amount": test.rng.choice(test.amounts), "recipientId": recipient}
+    started = time.monotonic()
+    response = test.session.post(f"{test.url}/transaction/transfer", json=payload, headers=vu.headers,
+                                 timeout=test.timeout)
+    if response.status_code == 200:
+        tx_id = response.json().get('transactionId')
+        if tx_id is not None:
+            vu.transactions = (vu.transactions + [tx_id])[-10:]
+            if test.rng.random() < test.track:
+                test.track_settlement(vu, tx_id, started)
+    return response
+
+
+def call_status(test, vu):
+    if not vu.transactions:
+        return call_balance(test, vu)  # nothing to look up yet (counted under 'status' anyway)
+    tx_id = test.rng.choice(vu.transactions)
+    return test.session.get(f"{test.url}/transaction/status/{tx_id}", headers=vu.headers, timeout=test.timeout)
+
+
+ENDPOINTS = {'balance': call_balance, 'transfer': call_transfer, 'status': call_status}
+
+
+class LoadTest:
+    def __init__(self, url=URL, users=100, workers=200, mix=DEFAULT_MIX, track=0.1, poll_interval=0.1,
+                 settle_timeout=30.0, timeout=10.0, max_inflight=10000, user_prefix='loadtest', seed=None):
+        self.url = url.rstrip('/')
+        self.user_count = users
+        self.workers = workers
+        self.mix = parse_mix(mix) if isinstance(mix, str) else mix
+        self.track = track
+        self.poll_interval = poll_interval
+        self.settle_timeout = settle_timeout
+        self.timeout = timeout
+        self.max_inflight = max_inflight
+        self.user_prefix = user_prefix
+        self.rng = random.Random(seed)
+        self.amounts = [1, 2, 5, 10, 20, 50]
+        self.users = []
+        self.stats = Stats()
+        self.settle = Histogram()
+        self.settled = Counter()
+        self.settle_lock = threading.Lock()
+        self.pending = []          # heap of (next poll time, sequence, vu, tx_id, started)
+        self.polling = 0           # polls submitted but not finished (they may push their transfer back)
+        self.pending_lock = threading.Condition()
+        self.sequence = itertools.count()
+        self.inflight = 0
+        self.inflight_lock = threading.Lock()
+        self.dropped = 0
+        self.stopping = threading.Event()
+        # One keep-alive pool shared by every worker thread
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=workers + 16)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def random_recipient(self, vu):
+        if len(self.users) < 2:
+            return 1
+        other = self.users[self.rng.randrange(len(self.users))]
+        return other.user_id if other is not vu else 1
+
+    # --- setup ---
+
+    def create_user(self, index):
+        """Registers (if needed) and logs in one virtual user, then opens its account with a balance check"""
+        username = f"{self.user_prefix}_{index}"
+        response = self.session.post(f"{self.url}/auth/login", json={"username": username, "password": PASSWORD},
+                                     timeout=self.timeout)
+        if response.status_code != 200:
+            self.session.post(f"{self.url}/auth/register", json={"username": username, "password": PASSWORD},
+                              timeout=self.timeout)
+            response = self.session.post(f"{self.url}/auth/login", json={"username": username, "password": PASSWORD},
+                                         timeout=self.timeout)
+        response.raise_for_status()
+        body = response.json()
+        vu = VirtualUser(index, body.get('id'), body['token'])
+        # Lazy account initialization happens on the first balance check (see bot_attack.py)
+        balance = self.session.get(f"{self.url}/transaction/balance", headers=vu.headers, timeout=self.timeout)
+        balance.raise_for_status()
+        vu.user_id = balance.json().get('userId', vu.user_id)
+        return vu
+
+    def setup(self):
+        print(f"🤖 Logging in {self.user_count} virtual users...")
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=min(self.workers, 64)) as pool:
+            futures = [pool.submit(self.create_user, i) for i in range(self.user_count)]
+            failures = 0
+            for future in futures:
+                try:
+                    self.users.append(future.result())
+                except Exception as e:
+                    failures += 1
+                    if failures <= 3:
+                        print(f"⚠️ Could not set up a virtual user: {e}")
+        if not self.users:
+            raise RuntimeError("No virtual user could log in, is the gateway up?")
+        print(f"✅ {len(self.users)} virtual users ready in {time.monotonic() - start:.1f}s ({failures} failed)")
+
+    # --- requests ---
+
+    def pick_endpoint(self):
+        return self.rng.choices([name for name, _ in self.mix], weights=[weight for _, weight in self.mix])[0]
+
+    def fire(self, name, vu, scheduled):
+        """Runs one request; latency counts from when it was *scheduled* to start"""
+        try:
+            response = ENDPOINTS[name](self, vu)
+            self.stats.record(name, time.monotonic() - scheduled, response.status_code)
+        except Exception as e:
+            self.stats.record(name, time.monotonic() - scheduled, error=type(e).__name__)
+        finally:
+            with self.inflight_lock:
+                self.inflight -= 1
+
+    # --- settlement tracking ---
+
+    def track_settlement(self, vu, tx_id, started):
+        with self.pending_lock:
+            heapq.heappush(self.pending, (time.monotonic() + self.poll_interval, next(self.sequence), vu, tx_id, started))
+            self.pending_lock.notify()
+
+    def poll_settlements(self, pool):
+        """Polls tracked transfers until their status leaves PENDING (or settle_timeout passes)"""
+        while True:
+            with self.pending_lock:
+                while not self.pending and (self.polling or not self.stopping.is_set()):
+                    self.pending_lock.wait(0.1)
+                if not self.pending:
+                    return
+                due = self.pending[0][0]
+                wait = due - time.monotonic()
+                if wait > 0:
+                    self.pending_lock.wait(min(wait, 0.1))
+                    continue
+                _, _, vu, tx_id, started = heapq.heappop(self.pending)
+                self.polling += 1
+            pool.submit(self.poll_once, vu, tx_id, started)
+
+    def poll_once(self, vu, tx_id, started):
+        now = time.monotonic()
+        status = None
+        try:
+            response = self.session.get(f"{self.url}/transaction/status/{tx_id}", headers=vu.headers,
+                                        timeout=self.timeout)
+            self.stats.record('status_poll', time.monotonic() - now, response.status_code)
+            if response.status_code == 200:
+                status = response.json().get('status')
+        except Exception as e:
+            self.stats.record('status_poll', time.monotonic() - now, error=type(e).__name__)
+        now = time.monotonic()
+        if status not in (None, 'PENDING'):
+            with self.settle_lock:
+                self.settle.record(now - started)
+                self.settled[status] += 1
+        elif now - started > self.settle_timeout or (self.stopping.is_set() and self.drain_deadline < now):
+            with self.settle_lock:
+                self.settled['TIMEOUT'] += 1
+        else:
+            with self.pending_lock:
+                heapq.heappush(self.pending, (now + self.poll_interval, next(self.sequence), vu, tx_id, started))
+        with self.pending_lock:
+            self.polling -= 1
+            self.pending_lock.notify()
+
+    # --- run ---
+
+    def run(self, stages, poisson=False, report_every=5.0):
+        total = sum(duration for duration, _, _ in stages)
+        planned = sum(duration * (start + end) / 2 for duration, start, end in stages)
+        print(f"🚀 Open-loop load: {len(stages)} stage(s), {total:.0f}s, ~{planned:,.0f} requests")
+        self.drain_deadline = math.inf
+        pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='vu')
+        poll_pool = ThreadPoolExecutor(max_workers=max(4, self.workers // 8), thread_name_prefix='poll')
+        poller = threading.Thread(target=self.poll_settlements, args=(poll_pool,), daemon=True)
+        poller.start()
+        t0 = time.monotonic()
+        next_report = t0 + report_every
+        sent = 0
+        try:
+            for offset in arrivals(stages, poisson, self.rng):
+                scheduled = t0 + offset
+                delay = scheduled - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                with self.inflight_lock:
+                    if self.inflight >= self.max_inflight:
+                        self.dropped += 1  # the client itself cannot keep up: never silently slow down
+                        continue
+                    self.inflight += 1
+                pool.submit(self.fire, self.pick_endpoint(), self.users[self.rng.randrange(len(self.users))], scheduled)
+                sent += 1
+                if time.monotonic() >= next_report:
+                    next_report += report_every
+                    self.progress(time.monotonic() - t0, sent)
+        except KeyboardInterrupt:
+            print("\n🛑 Interrupted, draining in-flight requests...")
+        pool.shutdown(wait=True)
+        self.elapsed = time.monotonic() - t0
+        # Give tracked transfers a last chance to settle
+        self.drain_deadline = time.monotonic() + min(self.settle_timeout, 10.0)
+        self.stopping.set()
+        poller.join()
+        poll_pool.shutdown(wait=True)
+        return self.report()
+
+    def progress(self, elapsed, sent):
+        summary = self.stats.summary(elapsed)
+        errors = self.stats.overall(elapsed)['errors']
+        p99 = max((endpoint['p99_ms'] for name, endpoint in summary.items() if name != 'status_poll'), default=0)
+        print(f"⚡ {elapsed:5.0f}s  sent {sent:>8}  in-flight {self.inflight:>5}  errors {errors:>6}  "
+              f"worst p99 {p99:8.1f} ms  settled {sum(self.settled.values()):>6}")
+
+    def report(self):
+        with self.settle_lock:
+            settle = dict(self.settle.summary(), outcomes=dict(self.settled))
+        return {
+            "url": self.url,
+            "virtual_users": len(self.users),
+            "elapsed_seconds": self.elapsed,
+            "dropped_by_client": self.dropped,
+            "endpoints": self.stats.summary(self.elapsed),
+            "all_requests": self.stats.overall(self.elapsed),
+            "transfer_to_settled": settle,
+        }
+
+
+def print_report(report):
+    print(f"\n📊 {report['url']}: {report['elapsed_seconds']:.1f}s, {report['virtual_users']} virtual users, "
+          f"{report['dropped_by_client']} requests dropped by the client")
+    print(f"   {'endpoint':<12}{'count':>9}{'rps':>9}{'err%':>8}{'p50':>9}{'p90':>9}{'p99':>9}{'p99.9':>9}{'max':>9}  (ms)")
+    for name, s in [*report['endpoints'].items(), ('all', report['all_requests'])]:
+        print(f"   {name:<12}{s['count']:>9}{s['rps']:>9.1f}{s['error_rate'] * 100:>7.2f}%{s['p50_ms']:>9.1f}"
+              f"{s['p90_ms']:>9.1f}{s['p99_ms']:>9.1f}{s['p99.9_ms']:>9.1f}{s['max_ms']:>9.1f}")
+    s = report['transfer_to_settled']
+    print(f"   ⏳ transfer -> not PENDING: {s['count']} settled, p50 {s['p50_ms']:.0f} ms, p99 {s['p99_ms']:.0f} ms, "
+          f"max {s['max_ms']:.0f} ms  {s['outcomes']}")
+
+
+# --- STUB GATEWAY ---
+
+class StubGateway(ThreadingHTTPServer):
+    """In-process stand-in for api-gateway + auth + ledger + fraud engine (transfers settle after a delay)"""
+    daemon_threads = True
+
+    def __init__(self, port=0, settle_delay=0.2, reject_rate=0.05, latency=0.0):
+        super().__init__(('127.0.0.1', port), _StubHandler)
+        self.settle_delay = settle_delay
+        self.reject_rate = reject_rate
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.users = {}          # username -> id
+        self.balances = {}
+        self.transactions = {}   # id -> (status, settle time)
+        self.next_tx = 1000
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like Express
+    disable_nagle_algorithm = True  # headers and body go out in separate writes
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, code, body):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def user(self):
+        token = (self.headers.get('Authorization') or '').rpartition(' ')[2]
+        return int(token.rpartition('-')[2]) if token.startswith('stub-') else None
+
+    def do_POST(self):
+        server = self.server
+        body = self.body()
+        time.sleep(server.latency)
+        if self.path == '/auth/register':
+            with server.lock:
+                if body['username'] in server.users:
+                    return self.reply(400, {"message": "Username already exists"})
+                server.users[body['username']] = len(server.users) + 1
+            return self.reply(200, {"message": "Registration successful"})
+        if self.path == '/auth/login':
+            user_id = server.users.get(body.get('username'))
+            if user_id is None:
+                return self.reply(401, {"message": "Invalid credentials"})
+            return self.reply(200, {"token": f"stub-{user_id}", "id": user_id})
+        if self.path == '/transaction/transfer':
+            if self.user() is None:
+                return self.reply(401, {"message": "No token provided"})
+            with server.lock:
+                tx_id = str(server.next_tx)
+                server.next_tx += 1
+                status = "REJECTED" if random.random() < server.reject_rate else "COMPLETED"
+                server.transactions[tx_id] = (status, time.monotonic() + server.settle_delay)
+            return self.reply(200, {"message": "Transaction processing", "status": "PENDING", "transactionId": tx_id})
+        self.reply(404, {"message": "Not found"})
+
+    def do_GET(self):
+        server = self.server
+        time.sleep(server.latency)
+        user_id = self.user()
+        if user_id is None:
+            return self.reply(401, {"message": "No token provided"})
+        if self.path == '/transaction/balance':
+            return self.reply(200, {"userId": user_id, "balance": server.balances.setdefault(user_id, 1000)})
+        if self.path.startswith('/transaction/status/'):
+            tx = server.transactions.get(self.path.rsplit('/', 1)[1])
+            if tx is None:
+                return self.reply(404, {"message": "Transaction not found"})
+            status, settle_at = tx
+            return self.reply(200, {"status": status if time.monotonic() >= settle_at else "PENDING"})
+        self.reply(404, {"message": "Not found"})
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Open-loop load test for the SafeLedger gateway")
+    parser.add_argument('--url', default=URL, help="gateway URL (port-forward it, like load_gen.py)")
+    parser.add_argument('--users', type=int, default=100, help="virtual users (logged-in accounts)")
+    parser.add_argument('--stages', default='30s@20', help="'DURATION@RATE' or 'DURATION@FROM-TO' (ramp), comma-separated")
+    parser.add_argument('--rate', type=float, help="shortcut for a single constant stage of --duration")
+    parser.add_argument('--duration', default='30s')
+    parser.add_argument('--poisson', action='store_true', help="exponential inter-arrival times instead of even spacing")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help="endpoint weights")
+    parser.add_argument('--workers', type=int, default=200, help="concurrent requests (threads and pooled connections)")
+    parser.add_argument('--max-inflight', type=int, default=10000, help="requests queued beyond this are dropped and counted")
+    parser.add_argument('--track', type=float, default=0.1, help="fraction of transfers polled until they settle")
+    parser.add_argument('--poll-interval', type=float, default=0.1)
+    parser.add_argument('--settle-timeout', type=float, default=30.0)
+    parser.add_argument('--timeout', type=float, default=10.0, help="per-request timeout (seconds)")
+    parser.add_argument('--user-prefix', default='loadtest', help="virtual users are <prefix>_<n>")
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--json', metavar='FILE', help="write the report as JSON ('-' = stdout)")
+    parser.add_argument('--stub', action='store_true', help="run against an in-process stub gateway")
+    parser.add_argument('--serve-stub', type=int, metavar='PORT', help="only serve the stub gateway on PORT")
+    parser.add_argument('--stub-settle', type=float, default=0.2, help="seconds until stub transfers leave PENDING")
+    parser.add_argument('--stub-latency', type=float, default=0.0, help="seconds of service time per stub request")
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    if args.serve_stub is not None:
+        stub = StubGateway(args.serve_stub, args.stub_settle, latency=args.stub_latency)
+        print(f"🧪 Stub gateway on {stub.url}")
+        stub.serve_forever()
+        sys.exit()
+
+    stub = None
+    url = args.url
+    if args.stub:
+        stub = StubGateway(0, args.stub_settle, latency=args.stub_latency).start()
+        url = stub.url
+        print(f"🧪 Using in-process stub gateway at {url}")
+
+    stages = parse_stages(f"{args.duration}@{args.rate:g}" if args.rate else args.stages)
+    test = LoadTest(url, args.users, args.workers, args.mix, args.track, args.poll_interval, args.settle_timeout,
+                    args.timeout, args.max_inflight, args.user_prefix, args.seed)
+    try:
+        test.setup()
+        report = test.run(stages, args.poisson)
+    finally:
+        if stub is not None:
+            stub.stop()
+    print_report(report)
+    if args.json == '-':
+        print(json.dumps(report, indent=2))
+    elif args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
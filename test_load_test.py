@@ -0,0 +1,80 @@
+import unittest
+import io
+import random
+from contextlib import redirect_stdout
+import load_test
+from load_test import Histogram, LoadTest, StubGateway, arrivals, parse_stages
+
+class TestLoadProfile(unittest.TestCase):
+    def test_parse_stages(self):
+        self.assertEqual(parse_stages("30s@100,60s@100-500,2m@0.5,250ms@10"),
+                         [(30.0, 100.0, 100.0), (60.0, 100.0, 500.0), (120.0, 0.5, 0.5), (0.25, 10.0, 10.0)])
+        for spec in ("30x@10", "30s", "s@10"):
+            with self.assertRaises(ValueError):
+                parse_stages(spec)
+
+    def test_constant_rate_is_evenly_spaced(self):
+        offsets = list(arrivals([(2.0, 10.0, 10.0)]))
+        self.assertEqual(len(offsets), 19)  # 0.1, 0.2, ... 1.9: the next one would start the next stage
+        self.assertTrue(all(abs(b - a - 0.1) < 1e-9 for a, b in zip(offsets, offsets[1:])))
+
+    def test_ramp_follows_the_rate(self):
+        """A 0 -> 100/s ramp over 10s sends about the area under it, most of it in the second half"""
+        offsets = list(arrivals([(1.0, 0.0, 0.0), (10.0, 10.0, 100.0)]))
+        self.assertAlmostEqual(len(offsets), 550, delta=10)
+        self.assertTrue(all(1.0 <= t < 11.0 for t in offsets))
+        self.assertGreater(sum(t >= 6.0 for t in offsets), 0.6 * len(offsets))
+
+    def test_poisson_keeps_the_average_rate(self):
+        offsets = list(arrivals([(100.0, 50.0, 50.0)], poisson=True, rng=random.Random(7)))
+        self.assertAlmostEqual(len(offsets) / 5000, 1.0, delta=0.05)
+        self.assertEqual(offsets, sorted(offsets))
+
+class TestHistogram(unittest.TestCase):
+    def test_percentiles_within_a_bucket(self):
+        histogram = Histogram()
+        for ms in range(1, 1001):
+            histogram.record(ms / 1000)
+        for p, expected in ((50, 0.5), (90, 0.9), (99, 0.99)):
+            self.assertAlmostEqual(histogram.percentile(p), expected, delta=expected * 0.011)
+        self.assertEqual(histogram.percentile(100), 1.0)  # never past the largest sample
+        self.assertEqual(Histogram().percentile(99), 0.0)
+
+    def test_merge_matches_recording_everything_once(self):
+        rng = random.Random(3)
+        samples = [rng.lognormvariate(-4, 1) for _ in range(3000)]
+        whole, left, right = Histogram(), Histogram(), Histogram()
+        for i, seconds in enumerate(samples):
+            whole.record(seconds)
+            (left if i % 3 else right).record(seconds)
+        merged = left.merge(right)
+        self.assertEqual(merged.buckets, whole.buckets)
+        self.assertEqual((merged.count, merged.max), (whole.count, whole.max))
+        self.assertAlmostEqual(merged.total, whole.total)
+        for p in (50, 90, 99, 99.9):
+            self.assertEqual(merged.percentile(p), whole.percentile(p))
+
+class TestAgainstStub(unittest.TestCase):
+    def test_short_run(self):
+        stub = StubGateway(settle_delay=0.05, reject_rate=0.5).start()
+        self.addCleanup(stub.stop)
+        test = LoadTest(stub.url, users=5, workers=8, track=1.0, poll_interval=0.02, settle_timeout=5.0,
+                        user_prefix='unittest', seed=1)
+        with redirect_stdout(io.StringIO()):
+            test.setup()
+            report = test.run(parse_stages("1s@40"))
+            load_test.print_report(report)
+
+        endpoints = report['endpoints']
+        self.assertEqual(report['virtual_users'], 5)
+        self.assertEqual(sum(endpoints[name]['count'] for name in ('balance', 'transfer', 'status')), 39)
+        self.assertEqual(report['all_requests']['count'], 39)
+        self.assertEqual(report['all_requests']['errors'], 0)
+        settled = report['transfer_to_settled']
+        # Every tracked transfer leaves PENDING, no sooner than the stub lets it
+        self.assertEqual(sum(settled['outcomes'].values()), endpoints['transfer']['count'])
+        self.assertNotIn('TIMEOUT', settled['outcomes'])
+        self.assertGreaterEqual(settled['p50_ms'], 50)
+
+if __name__ == '__main__':
+    unittest.main()